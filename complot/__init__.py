@@ -1,6 +1,9 @@
 import io
 import logging
+import threading
 from complot.utils import Timer, Lock
+from complot.metrics import metrics
+from complot.profiler import Profiler
 
 #formatter_info = logging.Formatter('%(message)s')
 #formatter_debug = logging.Formatter('%(levelname)5s %(module)3s.%(funcName)-10s %(lineno)3s %(message)s')
@@ -22,4 +25,7 @@ logger.addHandler(fileHandler)
 
 # create global objects
 lock = Lock()
-timer = Timer()
+# curses is not thread safe, is held while the terminal is written, read or resized
+terminal_lock = threading.Lock()
+timer = Timer(metrics)
+profiler = Profiler()
@@ -19,6 +19,10 @@ class StatusLine():
         """ Clear all statusses """
         self._status = {}
 
+    def get_signature(self):
+        """ Represents the inputs of this actor, used to check if it needs to be drawn again """
+        return tuple(self._status.items())
+
     def draw(self, backend):
         """ Draw status line """
         x_counter = 0
@@ -78,6 +82,15 @@ class Legend():
         else:
             self._right_lines.append(line)
 
+    def remove_line(self, line):
+        for lines in [self._left_lines, self._right_lines]:
+            if line in lines:
+                lines.remove(line)
+
+    def get_signature(self):
+        """ Represents the inputs of this actor, used to check if it needs to be drawn again """
+        return tuple((line.name, line.icon, line.color, line.line_number, line.is_hidden()) for line in self._left_lines + self._right_lines)
+
     def draw(self, backend):
         x = 0
         y = backend.get_rows() -1
@@ -114,6 +127,15 @@ class LastValues():
         else:
             self._right_lines.append(line)
 
+    def remove_line(self, line):
+        for lines in [self._left_lines, self._right_lines]:
+            if line in lines:
+                lines.remove(line)
+
+    def get_signature(self):
+        """ Represents the inputs of this actor, used to check if it needs to be drawn again """
+        return tuple((line.get_version(), line.symbol, line.color) for line in self._left_lines + self._right_lines)
+
     def draw(self, backend):
         x = backend._l_offset
         y = backend.get_rows() - 2 - backend._t_offset
@@ -128,3 +150,49 @@ class LastValues():
 
                 backend.set_string(x, y, str(f"{k} {v}{symbol}"), fg_color=line.color, reverse=True, skip_bg=True)
                 y -= 1
+
+
+class Hud():
+    """ Performance overlay in the top right corner of the plot.
+        Rows are collected by the plot at most every $interval seconds so the overlay costs close to nothing """
+    def __init__(self, interval=0.5):
+        self._interval = interval
+        self._last_update = None
+        self._rows = []
+
+        # counters at last update, used to calculate rates
+        self._last_counts = {}
+
+    def is_due(self, now):
+        return self._last_update == None or now - self._last_update >= self._interval
+
+    def get_rate(self, name, count, now):
+        """ Return change of count per second since last update """
+        last = self._last_counts.get(name)
+        self._last_counts[name] = (count, now)
+        if last == None or now == last[1]:
+            return 0
+        return (count - last[0]) / (now - last[1])
+
+    def set_rows(self, rows, now):
+        self._rows = rows
+        self._last_update = now
+
+    def get_signature(self):
+        """ Represents the inputs of this actor, used to check if it needs to be drawn again """
+        return tuple(self._rows)
+
+    def draw(self, backend):
+        if not self._rows:
+            return
+
+        width = max(len(row) for row in self._rows) + 2
+        x = max(backend._l_offset, backend.get_cols() - backend._r_offset - width)
+        y = backend.get_rows() - 1 - backend._t_offset
+
+        for row in self._rows:
+            if y < backend._b_offset:
+                return
+            row = f" {row}".ljust(width)[:backend.get_cols() - x]
+            backend.set_string(x, y, row, fg_color='white', bg_color='black', reverse=True, skip_bg=True)
+            y -= 1
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+import time
+import math
+import bisect
+import logging
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger('complot')
+
+
+def aggregate_partition(shm_name, keys_offset, field_offsets, row_start, row_end, base_key, group_size, n_groups):
+    """ Runs in worker process.
+        Aggregate rows [row_start:row_end] of one column into groups of $group_size keys starting at $base_key.
+        Return {group number: [count, first key, first row, last key, last row, sums, mins, maxs]} """
+    # NOTE workers share the resource tracker of the main process so attaching doesn't need the unregister workaround
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        n_rows = row_end - row_start
+        keys = shm.buf[keys_offset:].cast('d')[row_start:row_end].tolist()
+        fields = [shm.buf[offset:].cast('d')[row_start:row_end].tolist() for offset in field_offsets]
+    finally:
+        shm.close()
+
+    n_fields = len(fields)
+    groups = {}
+    for i in range(n_rows):
+        k = keys[i]
+        g = int((k - base_key) // group_size)
+        if g < 0 or g >= n_groups:
+            continue
+
+        row = [f[i] for f in fields]
+        agg = groups.get(g)
+        if agg == None:
+            groups[g] = [1, k, row, k, row, list(row), list(row), list(row)]
+            continue
+
+        agg[0] += 1
+        if k < agg[1]:
+            agg[1], agg[2] = k, row
+        if k >= agg[3]:
+            agg[3], agg[4] = k, row
+
+        sums, mins, maxs = agg[5], agg[6], agg[7]
+        for j in range(n_fields):
+            v = row[j]
+            sums[j] += v
+            if v < mins[j]:
+                mins[j] = v
+            if v > maxs[j]:
+                maxs[j] = v
+    return groups
+
+
+def merge_aggregate(merged, g, agg):
+    """ Merge aggregate of group $g into {group number: aggregate}, $agg may be stored in $merged and changed later """
+    m = merged.get(g)
+    if m == None:
+        merged[g] = agg
+        return
+
+    m[0] += agg[0]
+    if agg[1] < m[1]:
+        m[1], m[2] = agg[1], agg[2]
+    if agg[3] >= m[3]:
+        m[3], m[4] = agg[3], agg[4]
+    m[5] = [a+b for a,b in zip(m[5], agg[5])]
+    m[6] = [min(a,b) for a,b in zip(m[6], agg[6])]
+    m[7] = [max(a,b) for a,b in zip(m[7], agg[7])]
+
+
+def merge_partials(partials):
+    """ Merge the results of aggregate_partition() for one column """
+    merged = {}
+    for partial in partials:
+        for g, agg in partial.items():
+            merge_aggregate(merged, g, agg)
+    return merged
+
+
+class AggregatedPoint():
+    """ Stands in for the first/last point of an AggregatedGroup, only has the attributes of the point class """
+    def __init__(self, store, row):
+        for field, value in zip(store.fields, row):
+            setattr(self, field, value)
+        for alias, field in store.aliases.items():
+            setattr(self, alias, getattr(self, field))
+
+
+class AggregatedGroup():
+    """ Behaves like indexer.Group but only holds aggregates (count, sum, min, max, first, last) per column
+        instead of the points themselves """
+    def __init__(self, start, end, count, stores, aggregates):
+        self._start = start
+        self._end = end
+        self._count = count
+
+        # {column name: ColumnStore}, used to resolve attribute names to fields
+        self._stores = stores
+
+        # {column name: [count, first key, first row, last key, last row, sums, mins, maxs]}
+        self._aggregates = aggregates
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    def get_field_index(self, column, key):
+        store = self._stores[column]
+        return store.fields.index(store.aliases.get(key, key))
+
+    def is_empty(self, column):
+        return column not in self._aggregates
+
+    def get_col(self, col_name):
+        """ Points are not available in aggregated groups """
+        return {}
+
+    def get_first(self, col_name):
+        if self.is_empty(col_name):
+            return
+        return AggregatedPoint(self._stores[col_name], self._aggregates[col_name][2])
+
+    def get_last(self, col_name):
+        if self.is_empty(col_name):
+            return
+        return AggregatedPoint(self._stores[col_name], self._aggregates[col_name][4])
+
+    def get_avg(self, column, key='value'):
+        if self.is_empty(column):
+            return
+        agg = self._aggregates[column]
+        return agg[5][self.get_field_index(column, key)] / agg[0]
+
+    def get_max(self, columns=[], key='value', use_avg=False):
+        if type(columns) != list:
+            columns = [columns]
+
+        values = []
+        for col in columns:
+            if self.is_empty(col):
+                continue
+            if use_avg:
+                values.append(self.get_avg(col, key=key))
+            else:
+                values.append(self._aggregates[col][7][self.get_field_index(col, key)])
+        return max(values, default=None)
+
+    def get_min(self, columns=[], key='value', use_avg=False):
+        if type(columns) != list:
+            columns = [columns]
+
+        values = []
+        for col in columns:
+            if self.is_empty(col):
+                continue
+            if use_avg:
+                values.append(self.get_avg(col, key=key))
+            else:
+                values.append(self._aggregates[col][6][self.get_field_index(col, key)])
+        return min(values, default=None)
+
+
+class ColumnStore():
+    """ Keeps the keys and numeric fields of the points of one column in flat arrays so they can be copied
+        to shared memory and aggregated by worker processes """
+    def __init__(self, fields, aliases):
+        self.fields = fields
+        self.aliases = aliases
+        self.keys = array('d')
+        self.values = [array('d') for _ in fields]
+
+    def add(self, key, point):
+        self.keys.append(key)
+        for values, field in zip(self.values, self.fields):
+            values.append(getattr(point, field))
+
+    def clear(self):
+        """ Free arrays, fields and aliases are still used by AggregatedGroup """
+        self.keys = array('d')
+        self.values = [array('d') for _ in self.fields]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Aggregator():
+    """ Aggregates groups in parallel for fit-all over large datasets.
+        Nothing is copied on insert. When fit-all needs groups and the data changed since last time, the points that were
+        added since the last copy are copied column by column into flat arrays and appended to shared memory.
+        Shared memory has room for twice the amount of points that it holds so appending rarely has to reallocate.
+        Only when points were removed, or added before the last copied point, everything is copied again.
+        So while fit-all is shown, shared memory holds one extra copy of all keys and numeric fields (8 bytes per value).
+        Every column is split into $workers row ranges that are aggregated by a pool of worker processes, partial
+        aggregates are merged into AggregatedGroup objects. """
+    def __init__(self, workers=None, min_points=100_000):
+        self._workers = workers if workers else multiprocessing.cpu_count()
+
+        # below this amount of points the single process path is faster
+        self._min_points = min_points
+
+        # {column name: ColumnStore}, arrays are empty after they're copied to shared memory
+        self._stores = {}
+
+        # data version and rewrite counter of index that shared memory was built from
+        self._shm = None
+        self._shm_version = None
+        self._rewrite = None
+
+        # {column name: (rows, capacity, keys offset, field offsets)}
+        self._layout = {}
+
+        # {column name: biggest key in shared memory}
+        self._last_keys = {}
+
+        # last result: (metadata, groups)
+        self._cache = (None, None)
+
+        self._pool = None
+
+        self.last_time = 0
+
+        # stats
+        self.copied = 0
+        self.rebuilds = 0
+
+    def is_enabled(self, n_points):
+        """ Only worth the overhead for big datasets """
+        return n_points >= self._min_points
+
+    def get_pool(self):
+        if self._pool == None:
+            # fork is not safe with our threads running, spawn starts fresh interpreters
+            self._pool = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def find_row(self, name, key):
+        """ Return first row of column with a key >= $key, rows in shared memory are sorted by key """
+        rows, _, keys_offset, _ = self._layout[name]
+        view = self._shm.buf[keys_offset:keys_offset + rows*8].cast('d')
+        try:
+            return bisect.bisect_left(view, key)
+        finally:
+            view.release()
+
+    def allocate(self, rows):
+        """ Create shared memory with room for twice $rows: {column name: rows}, rows that are already in shared memory are copied """
+        layout = {}
+        offset = 0
+        for name, n in rows.items():
+            capacity = max(2 * n, 1024)
+            n_fields = len(self._stores[name].fields)
+            layout[name] = (0, capacity, offset, [offset + (i+1) * capacity * 8 for i in range(n_fields)])
+            offset += capacity * 8 * (1 + n_fields)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+        for name, (old_rows, _, old_keys_offset, old_field_offsets) in self._layout.items():
+            keep = min(old_rows, rows.get(name, 0))
+            if not keep:
+                continue
+            _, capacity, keys_offset, field_offsets = layout[name]
+            for src, dst in zip([old_keys_offset] + old_field_offsets, [keys_offset] + field_offsets):
+                shm.buf[dst:dst + keep*8] = self._shm.buf[src:src + keep*8]
+            layout[name] = (keep, capacity, keys_offset, field_offsets)
+
+        if self._shm != None:
+            self._shm.close()
+            self._shm.unlink()
+        self._shm = shm
+        self._layout = layout
+
+    def update_shared_memory(self, version, rewrite, columns, iter_column):
+        """ Copy points that were added since last update to shared memory.
+            $version changes when points are added, $rewrite changes when points were removed or added before the
+            last point, then all points are copied again. $columns are column names,
+            iter_column(name, from_key) yields (key, point) of column with key >= from_key, or all when from_key is None.
+            Points from the last copied key on are copied again so a replaced last point is updated """
+        if self._shm_version == version:
+            return
+
+        if self._rewrite != rewrite or set(self._layout) - set(columns):
+            self.close_shared_memory()
+            self._stores = {}
+            self._rewrite = rewrite
+            self.rebuilds += 1
+
+        # copy new points to arrays, rows of a column are kept from $start
+        starts = {}
+        for name in columns:
+            from_key = self._last_keys.get(name)
+            for k, point in sorted(iter_column(name, from_key), key=lambda item: item[0]):
+                store = self._stores.get(name)
+                if store == None:
+                    store = self._stores[name] = ColumnStore(point.fields, point.aliases)
+                store.add(k, point)
+
+            store = self._stores.get(name)
+            if store == None:
+                continue
+            starts[name] = self.find_row(name, from_key) if name in self._layout else 0
+
+        rows = {name : start + len(self._stores[name]) for name, start in starts.items()}
+        if self._shm == None or any(n > self._layout.get(name, (0, 0))[1] for name, n in rows.items()):
+            self.allocate(rows)
+
+        for name, start in starts.items():
+            store = self._stores[name]
+            _, capacity, keys_offset, field_offsets = self._layout[name]
+            for values, offset in zip([store.keys] + store.values, [keys_offset] + field_offsets):
+                data = values.tobytes()
+                self._shm.buf[offset + start*8:offset + start*8 + len(data)] = data
+            self._layout[name] = (start + len(store), capacity, keys_offset, field_offsets)
+            if len(store):
+                self._last_keys[name] = store.keys[-1]
+            self.copied += len(store)
+
+            # data lives in shared memory now
+            store.clear()
+
+        self._shm_version = version
+
+    def close_shared_memory(self):
+        """ Free shared memory, next update copies all points again """
+        if self._shm != None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        self._shm_version = None
+        self._layout = {}
+        self._last_keys = {}
+
+    def get_grouped(self, bounds, group_size, version, rewrite, columns, iter_column):
+        """ Return groups for bounds: list of (start key, end key, count) as returned by Index.get_group_bounds().
+            $version, $rewrite, $columns and $iter_column are passed to update_shared_memory() """
+        metadata = (tuple(bounds), group_size, version, rewrite)
+        if self._cache[0] == metadata:
+            return self._cache[1]
+
+        t_start = time.perf_counter()
+        self.update_shared_memory(version, rewrite, columns, iter_column)
+
+        valid = [b for b in bounds if b[0] != None]
+        base_key = valid[0][0] if valid else 0
+        n_groups = len(valid)
+
+        # submit partitions of every column
+        futures = {}
+        for name, (rows, _, keys_offset, field_offsets) in self._layout.items():
+            partition_size = math.ceil(rows / self._workers)
+            futures[name] = [self.get_pool().submit(aggregate_partition, self._shm.name, keys_offset, field_offsets,
+                                                    start, min(start+partition_size, rows), base_key, group_size, n_groups)
+                             for start in range(0, rows, partition_size)]
+
+        merged = {name: merge_partials([f.result() for f in fs]) for name, fs in futures.items()}
+
+        groups = []
+        g = 0
+        for start, end, count in bounds:
+            if start == None:
+                groups.append(AggregatedGroup(None, None, count, self._stores, {}))
+                continue
+            aggregates = {name: columns[g] for name, columns in merged.items() if g in columns}
+            groups.append(AggregatedGroup(start, end, count, self._stores, aggregates))
+            g += 1
+
+        self.last_time = time.perf_counter() - t_start
+        logger.debug(f"Aggregated {n_groups} groups in {round(self.last_time, 3)}s using {self._workers} workers")
+
+        self._cache = (metadata, groups)
+        return groups
+
+    def clear_cache(self):
+        """ Aggregate groups again on next call, shared memory is kept """
+        self._cache = (None, None)
+
+    def shutdown(self):
+        if self._pool != None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.close_shared_memory()
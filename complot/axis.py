@@ -137,6 +137,10 @@ class VerticalAxis():
         """ Add line to this axis """
         self._lines.append(line)
 
+    def remove_line(self, line):
+        if line in self._lines:
+            self._lines.remove(line)
+
     def get_scaled_y(self, y, y_min, y_max, matrix_size):
         """ Scale a value to the plot dimensions """
         return int(self.map_value(y, y_min, y_max, 0, matrix_size-1))
@@ -181,17 +185,28 @@ class VerticalAxis():
         self._y_min -= y_max_factor
         self._y_max -= y_max_factor
 
-    def draw_lines(self, backend, data):
-        """ Draw all points for all lines in backend object """
+    def get_lines(self):
+        return self._lines
+
+    def get_range(self):
+        """ Return current data dimensions """
+        return self._y_min, self._y_max
+
+    def draw_line(self, backend, data, line):
+        """ Draw all points for one line in backend object """
         if self._y_min == None or self._y_max == None:
             return
 
-        for line in self._lines:
-            if not line.is_enabled():
-                continue
+        if not line.is_enabled():
+            return
+
+        if line.is_populated():
+            line.draw(backend, data, self._y_min, self._y_max)
 
-            if line.is_populated():
-                line.draw(backend, data, self._y_min, self._y_max)
+    def draw_lines(self, backend, data):
+        """ Draw all points for all lines in backend object """
+        for line in self._lines:
+            self.draw_line(backend, data, line)
 
     def calculate_fractions(self, amount):
         return [ (1/(amount-1))*i for i in range(amount) ]
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
+import os, sys
+import abc
 import curses
 import inspect
 import logging
+from contextlib import contextmanager
+
 
 logger = logging.getLogger('complot')
 
@@ -40,27 +44,20 @@ class CursesColors():
                 index += 1
 
 
-class CursesBackend():
-    """ This backend takes care of the plot drawing in an ncurses matrix """
-    def __init__(self, stdscr, x_size=None, y_size=None):
-        # curses screen object
+class BackendBaseClass(abc.ABC):
+    """ Baseclass for all drawing backends.
+        Holds the plot dimensions and all the drawing methods that are build on top of set_char() """
+    def __init__(self, stdscr):
+        # curses screen object, used for dimensions and user input
         self._stdscr = stdscr
 
-        # init color pairs
-        self._colors = CursesColors()
-
-        # paint background default terminal colors
-        self._stdscr.bkgd(' ', curses.color_pair(self._colors.get_pair('white', 'black')))
-
-        # turn off cursor
-        curses.curs_set(False)
+        # ListenInputThread that reads keys from stdscr, is paused while widgets read keys themselves
+        self._input_thread = None
 
         # is updated with update_ly_col_width, update_ry_col_width
         self.ly_axis_col_width = 0
         self.ry_axis_col_width = 0
 
-        self.init_display()
-
     def update_ly_col_width(self, width):
         self.ly_axis_col_width = width
 
@@ -93,10 +90,6 @@ class CursesBackend():
         self._color_matrix = [['' for x in range(self.get_cols())] for y in range(self.get_rows())]
         self._char_matrix = [['' for x in range(self.get_cols())] for y in range(self.get_rows())]
 
-    def get_char(self, x, y):
-        y = self._term_y_size - y -1
-        return chr(self._stdscr.inch(y, x) & 0xFF).strip(' ')
-
     def draw_horizontal_line(self, y, *args, char='─', prefix=None, draw_on_top=False, **kwargs):
         """ Draw a line, don't draw over existing chars if draw_on_top==False """
         y_matrix = self._term_y_size - y -1
@@ -174,25 +167,11 @@ class CursesBackend():
         y = self._term_y_size - y -1
 
         # save color in matrix so other lines can write on top while using their fg color as bg color
-        #logger.debug(f"{y}  :  {x}")
         if not skip_bg and self._color_matrix[y][x]:
             if fg_color != self._color_matrix[y][x]:
                 bg_color = self._color_matrix[y][x]
 
-        args = 0
-        pair = self._colors.get_pair(fg_color, bg_color)
-        args |= curses.color_pair(pair)
-
-        if reverse:
-            args |= curses.A_REVERSE
-        if dim:
-            args |= curses.A_DIM
-
-        try:
-            self._stdscr.addch(y, x, char, args)
-            
-        except curses.error as e:
-            logger.error(f"ERROR: Failed to set point: {x},{y} '{char}'")
+        self.put_char(x, y, char, fg_color, bg_color, reverse=reverse, dim=dim)
 
         # save color in color matrix so we can use its fg color later as bg color when drawing lines on top
         if char == '█':
@@ -200,6 +179,46 @@ class CursesBackend():
 
         self._char_matrix[y][x] = char
 
+    @abc.abstractmethod
+    def put_char(self, x, y, char, fg_color, bg_color, reverse=False, dim=False):
+        """ Put character on screen at terminal coordinates """
+
+    @abc.abstractmethod
+    def get_char(self, x, y):
+        """ Return character at plot coordinates """
+
+    @abc.abstractmethod
+    def refresh(self):
+        """ Show drawn characters on screen """
+
+    @abc.abstractmethod
+    def clear(self):
+        """ Clear screen """
+
+    def invalidate(self):
+        """ Indicate that the screen contents are unknown and need a full redraw.
+            Is called by widgets that draw over the screen when they close """
+        pass
+
+    def set_input_thread(self, input_thread):
+        """ Set ListenInputThread, this is done by Plot """
+        self._input_thread = input_thread
+
+    @contextmanager
+    def reading_input(self):
+        """ Context manager for widgets that read keys themselves, input thread doesn't consume keys meanwhile """
+        if self._input_thread:
+            self._input_thread.pause()
+        try:
+            yield
+        finally:
+            if self._input_thread:
+                self._input_thread.resume()
+
+    def get_stats(self):
+        """ Return backend specific statistics, override in child """
+        return {}
+
     def get_cols(self):
         if self.get_rows():
             return self._term_x_size
@@ -215,12 +234,6 @@ class CursesBackend():
     def get_plot_rows(self):
         return self._plot_height
 
-    def refresh(self):
-        self._stdscr.refresh()
-
-    def clear(self):
-        self._stdscr.clear()
-
     def check_resized(self):
         if (self._old_rows , self._old_cols) != self._stdscr.getmaxyx():
             self._old_rows, self._old_cols = self._stdscr.getmaxyx()
@@ -241,8 +254,10 @@ class CursesBackend():
         self.refresh()
         sub = self._stdscr.subwin(1, 50, y_calc, len(msg) + 2)
         tb = curses.textpad.Textbox(sub)
-        tb.edit()
+        with self.reading_input():
+            tb.edit()
         curses.curs_set(False)
+        self.invalidate()
         self.refresh()
         return tb.gather().strip()
 
@@ -252,14 +267,19 @@ class CursesBackend():
 
     def select_point(self, x_pos=None, y_pos=None, callback=None, cursor_chr='█'):
         """ Move cursor around screen and select point with enter, $callback is called to update screen when specified """
-        X,Y = 0,1
-
         if None in [x_pos, y_pos]:
             cursor = [int(self.get_plot_cols()/2), int(self.get_plot_rows()/2)]
         else:
             cursor = [x_pos, y_pos]
 
+        with self.reading_input():
+            return self.run_select_point(cursor, callback, cursor_chr)
+
+    def run_select_point(self, cursor, callback, cursor_chr):
+        X,Y = 0,1
+
         self.set_point_in_plot(*cursor, cursor_chr)
+        self.refresh()
 
         while True:
             key = self._stdscr.getch()
@@ -284,5 +304,343 @@ class CursesBackend():
                 callback()
 
             self.set_point_in_plot(*cursor, cursor_chr)
-            #self.refresh()
+            self.refresh()
             curses.flushinp()
+
+
+class CursesBackend(BackendBaseClass):
+    """ This backend takes care of the plot drawing in an ncurses matrix """
+    def __init__(self, stdscr, x_size=None, y_size=None):
+        BackendBaseClass.__init__(self, stdscr)
+
+        # init color pairs
+        self._colors = CursesColors()
+
+        # paint background default terminal colors
+        self._stdscr.bkgd(' ', curses.color_pair(self._colors.get_pair('white', 'black')))
+
+        # turn off cursor
+        curses.curs_set(False)
+
+        self.init_display()
+
+    def get_char(self, x, y):
+        y = self._term_y_size - y -1
+        return chr(self._stdscr.inch(y, x) & 0xFF).strip(' ')
+
+    def put_char(self, x, y, char, fg_color, bg_color, reverse=False, dim=False):
+        args = 0
+        pair = self._colors.get_pair(fg_color, bg_color)
+        args |= curses.color_pair(pair)
+
+        if reverse:
+            args |= curses.A_REVERSE
+        if dim:
+            args |= curses.A_DIM
+
+        try:
+            self._stdscr.addch(y, x, char, args)
+            
+        except curses.error as e:
+            logger.error(f"ERROR: Failed to set point: {x},{y} '{char}'")
+
+    def refresh(self):
+        self._stdscr.refresh()
+
+    def clear(self):
+        self._stdscr.clear()
+
+
+class AnsiBackend(BackendBaseClass):
+    """ This backend bypasses curses and writes ANSI/VT escape sequences directly to the tty.
+        It keeps a copy of what is on the terminal and on refresh() only emits the cells that changed,
+        using the shortest cursor movements and attribute changes, in one write() per frame.
+        Curses is still used for dimensions, user input and the menu windows. """
+
+    # SGR parameters, 'black' maps to the terminal default background just like in CursesBackend
+    fg_codes = { 'red'     : '31',
+                 'green'   : '32',
+                 'yellow'  : '33',
+                 'blue'    : '34',
+                 'magenta' : '35',
+                 'cyan'    : '36',
+                 'white'   : '37',
+                 'black'   : '90' }
+
+    bg_codes = { 'red'     : '41',
+                 'green'   : '42',
+                 'yellow'  : '43',
+                 'blue'    : '44',
+                 'magenta' : '45',
+                 'cyan'    : '46',
+                 'white'   : '47',
+                 'black'   : '49' }
+
+    # attribute bits in a cell
+    REVERSE = 1
+    DIM     = 2
+
+    def __init__(self, stdscr, fd=None):
+        BackendBaseClass.__init__(self, stdscr)
+
+        # file descriptor of the terminal we write to
+        self._fd = sys.stdout.fileno() if fd == None else fd
+
+        # position of window on terminal, makes it possible to draw in a curses subwindow
+        self._y_origin, self._x_origin = self._stdscr.getbegyx()
+
+        # cell matrix that is drawn in (back buffer) and the matrix that is on screen (front buffer)
+        # a cell is a tuple: (char, fg_color, bg_color, attributes)
+        self._cells = []
+        self._screen = None
+
+        # cursor position and SGR state of the terminal, None means unknown
+        self._cursor = None
+        self._sgr = None
+
+        # bytes written to terminal
+        self._frames = 0
+        self._frame_bytes = 0
+        self._total_bytes = 0
+
+        self.hide_cursor()
+        self.init_display()
+
+    def hide_cursor(self):
+        curses.curs_set(False)
+
+    def init_display(self):
+        BackendBaseClass.init_display(self)
+
+        self._cells = [[self.get_blank() for x in range(self.get_cols())] for y in range(self.get_rows())]
+
+        # terminal dimensions changed, redraw everything
+        if self._screen != None and len(self._screen) != self.get_rows():
+            self.invalidate()
+        elif self._screen and len(self._screen[0]) != self.get_cols():
+            self.invalidate()
+
+    def get_blank(self):
+        return (' ', 'white', 'black', 0)
+
+    def get_char(self, x, y):
+        y = self._term_y_size - y -1
+        return self._cells[y][x][0].strip(' ')
+
+    def put_char(self, x, y, char, fg_color, bg_color, reverse=False, dim=False):
+        if not (0 <= y < self.get_rows() and 0 <= x < self.get_cols()):
+            logger.error(f"ERROR: Failed to set point: {x},{y} '{char}'")
+            return
+
+        attrs = 0
+        if reverse:
+            attrs |= self.REVERSE
+        if dim:
+            attrs |= self.DIM
+
+        self._cells[y][x] = (char, fg_color, bg_color, attrs)
+
+    def clear(self):
+        self._cells = [[self.get_blank() for x in range(self.get_cols())] for y in range(self.get_rows())]
+
+    def invalidate(self):
+        """ Screen contents are unknown, eg. when a curses window was drawn over plot, next refresh() redraws everything """
+        self._screen = None
+
+    def get_sgr(self, cell):
+        """ Return shortest escape sequence that changes current terminal attributes to those of cell """
+        _, fg, bg, attrs = cell
+
+        if self._sgr == None:
+            params = ['0']
+            if attrs & self.DIM:
+                params.append('2')
+            if attrs & self.REVERSE:
+                params.append('7')
+            params.append(self.fg_codes.get(fg, '39'))
+            params.append(self.bg_codes.get(bg, '49'))
+            return f"\x1b[{';'.join(params)}m"
+
+        cur_fg, cur_bg, cur_attrs = self._sgr
+        params = []
+
+        if (cur_attrs & self.DIM) and not (attrs & self.DIM):
+            params.append('22')
+        elif (attrs & self.DIM) and not (cur_attrs & self.DIM):
+            params.append('2')
+
+        if (cur_attrs & self.REVERSE) and not (attrs & self.REVERSE):
+            params.append('27')
+        elif (attrs & self.REVERSE) and not (cur_attrs & self.REVERSE):
+            params.append('7')
+
+        if fg != cur_fg:
+            params.append(self.fg_codes.get(fg, '39'))
+        if bg != cur_bg:
+            params.append(self.bg_codes.get(bg, '49'))
+
+        if not params:
+            return ''
+        return f"\x1b[{';'.join(params)}m"
+
+    def get_move(self, y, x, row, old_row):
+        """ Return shortest sequence that moves cursor from current position to y,x
+            When skipped cells are only a couple of chars with current attributes, rewriting them is cheaper """
+        # absolute position, terminal coordinates are 1 based
+        move = f"\x1b[{y+self._y_origin+1};{x+self._x_origin+1}H"
+
+        if self._cursor == None:
+            return move
+
+        cur_y, cur_x = self._cursor
+
+        if cur_y == y:
+            if cur_x == x:
+                return ''
+
+            if cur_x < x:
+                # rewrite skipped cells if they are already on screen with the current attributes
+                skipped = row[cur_x:x]
+                if len(skipped) <= 4 and old_row != None and old_row[cur_x:x] == skipped:
+                    if all(c[1:] == self._sgr for c in skipped):
+                        rewrite = ''.join(c[0] for c in skipped)
+                        if len(rewrite.encode()) < len(move):
+                            move = rewrite
+
+                relative = f"\x1b[{x-cur_x}C" if x-cur_x > 1 else "\x1b[C"
+            else:
+                relative = f"\x1b[{cur_x-x}D" if cur_x-x > 1 else "\x1b[D"
+
+            if x == 0 and len("\r") < len(move):
+                return "\r"
+
+            return relative if len(relative) < len(move) else move
+
+        if cur_x == x and cur_y < y:
+            relative = f"\x1b[{y-cur_y}B" if y-cur_y > 1 else "\x1b[B"
+            return relative if len(relative) < len(move) else move
+
+        return move
+
+    def refresh(self):
+        """ Write all changed cells to the terminal in one go """
+        out = []
+
+        if self._screen == None:
+            # hide cursor and reset attributes so cleared cells get the default background
+            out.append("\x1b[?25l\x1b[0m")
+
+            # clear terminal when window covers it, a window inside the terminal is blank-filled below
+            # because every cell is written when the screen contents are unknown
+            if (self._y_origin, self._x_origin) == (0, 0):
+                out.append("\x1b[2J")
+            self._cursor = None
+            self._sgr = None
+            screen = [[None] * self.get_cols() for y in range(self.get_rows())]
+        else:
+            screen = self._screen
+
+        for y, row in enumerate(self._cells):
+            old_row = screen[y]
+
+            if row == old_row:
+                continue
+
+            for x, cell in enumerate(row):
+                if cell == old_row[x]:
+                    continue
+
+                out.append(self.get_move(y, x, row, old_row))
+                out.append(self.get_sgr(cell))
+                out.append(cell[0])
+                self._sgr = cell[1:]
+
+                # cursor position is ambiguous after writing in the last column
+                if x+1 < self.get_cols():
+                    self._cursor = (y, x+1)
+                else:
+                    self._cursor = None
+
+            screen[y] = list(row)
+
+        self._screen = screen
+        self.write(''.join(out).encode())
+
+    def write(self, data):
+        """ Write frame to terminal, os.write() may not write all data at once """
+        self._frames += 1
+        self._frame_bytes = len(data)
+        self._total_bytes += len(data)
+
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    def get_stats(self):
+        return { 'frames'         : self._frames,
+                 'bytes last frame' : self._frame_bytes,
+                 'bytes per frame': round(self._total_bytes / self._frames) if self._frames else 0,
+                 'bytes total'    : self._total_bytes }
+
+
+class HeadlessScreen():
+    """ Stands in for the curses screen when there is no terminal, eg. in benchmarks """
+    def __init__(self, rows=40, cols=120):
+        self._rows = rows
+        self._cols = cols
+
+    def resize(self, rows, cols):
+        self._rows = rows
+        self._cols = cols
+
+    def getmaxyx(self):
+        return (self._rows, self._cols)
+
+    def getbegyx(self):
+        return (0, 0)
+
+    def getch(self):
+        return -1
+
+    def nodelay(self, state):
+        pass
+
+    def keypad(self, state):
+        pass
+
+    def bkgd(self, *args):
+        pass
+
+    def refresh(self):
+        pass
+
+    def clear(self):
+        pass
+
+
+class HeadlessBackend(AnsiBackend):
+    """ Renders frames exactly like AnsiBackend but keeps the output instead of writing it to a terminal.
+        Is used to measure frame times without a terminal, use it with a HeadlessScreen """
+    def __init__(self, stdscr):
+        # last frame that would have been written to the terminal
+        self.output = b''
+        AnsiBackend.__init__(self, stdscr, fd=-1)
+
+    def hide_cursor(self):
+        pass
+
+    def check_resized(self):
+        if (self._old_rows, self._old_cols) != self._stdscr.getmaxyx():
+            self.init_display()
+            return True
+
+    def write(self, data):
+        self._frames += 1
+        self._frame_bytes = len(data)
+        self._total_bytes += len(data)
+        self.output = data
+
+    def get_text(self):
+        """ Return screen contents as list of strings, top row first """
+        return [''.join(cell[0] for cell in row) for row in self._cells]
@@ -0,0 +1 @@
+""" Benchmarks, run them as modules, eg: python -m complot.bench.indexer --help """
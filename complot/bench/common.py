@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import importlib
+import statistics
+import subprocess
+
+
+def measure(func, repeat=5, setup=None):
+    """ Run func $repeat times and return list of durations in seconds.
+        If $setup is given, it is called before every run (not timed) and its result is passed to func """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t_start = time.perf_counter()
+        func(arg) if setup else func()
+        times.append(time.perf_counter() - t_start)
+    return times
+
+
+def summarize(times, ops=None):
+    """ Return statistics of durations, if $ops is given, also per operation time """
+    times = sorted(times)
+    result = { 'runs'   : len(times),
+               'min'    : times[0],
+               'median' : statistics.median(times),
+               'mean'   : statistics.mean(times),
+               'p95'    : times[min(len(times)-1, int(len(times) * 0.95))],
+               'max'    : times[-1] }
+    if ops:
+        result['ops'] = ops
+        result['ns_per_op'] = round(result['median'] / ops * 1e9, 1)
+    return result
+
+
+def get_version():
+    """ Git revision of the tree that is benchmarked, None when not in a git repo """
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_meta(args):
+    """ Describe the environment so results of different runs can be compared """
+    return { 'version'   : get_version(),
+             'python'    : platform.python_version(),
+             'platform'  : platform.platform(),
+             'date'      : datetime.datetime.now().isoformat(timespec='seconds'),
+             'arguments' : vars(args) }
+
+
+def get_argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--size',    type=int, default=100_000, help="amount of points in dataset")
+    parser.add_argument('--seed',    type=int, default=1,       help="seed for generated datasets")
+    parser.add_argument('--repeat',  type=int, default=5,       help="amount of runs per benchmark")
+    parser.add_argument('--dataset', default='walk',            help="'walk', 'random' or path to csv file, see datasets.get_dataset()")
+    parser.add_argument('--only',    action='append',           help="only run benchmarks that start with this name, can be given multiple times")
+    parser.add_argument('--out',     help="write JSON results to file instead of stdout")
+    return parser
+
+
+def load_class(path):
+    """ Import class from 'module:Class' path, eg. 'complot.indexer:Index' """
+    module, _, name = path.partition(':')
+    if not name:
+        raise ValueError(f"Expected module:Class, got: {path}")
+    return getattr(importlib.import_module(module), name)
+
+
+def is_selected(args, name):
+    return not args.only or any(name.startswith(only) for only in args.only)
+
+
+def write_results(args, results):
+    """ Write results as JSON to file or stdout """
+    out = json.dumps({ 'meta' : get_meta(args), 'results' : results }, indent=4, default=str)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out + '\n')
+        print(f"Wrote results to: {args.out}", file=sys.stderr)
+    else:
+        print(out)
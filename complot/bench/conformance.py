@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+""" Conformance suite for index backends, see complot.indexer.IndexBaseClass.
+    Every check builds a fresh index, feeds it data and compares the results with a brute force calculation
+    over the same points. Backends other than the reference Index are also compared with Index.
+    With --bench, the indexer benchmarks are run against the backend too.
+
+    python -m complot.bench.conformance
+    python -m complot.bench.conformance --backend mymodule:MyIndex --bench --size 100000
+    python -m complot.bench.conformance --backend complot.tiering:TieredIndex --index-options '{"max_points": 500}'
+"""
+
+import sys
+import json
+import math
+import bisect
+import random
+import threading
+import functools
+
+from complot import lock
+from complot.indexer import Index
+from complot.lines import Point, CandleStickPoint
+from complot.bench.common import get_argument_parser, write_results, is_selected, load_class
+from complot.bench.datasets import get_dataset
+from complot.bench import indexer as bench_indexer
+
+# small grow amount so growing the index is exercised
+GROW_AMOUNT = 100
+SPREAD = 60
+
+GROUP_SIZES = [60, 600, 3600]
+AMOUNTS = [5, 50]
+
+# threads that read different views at the same time, and the amount of views every thread reads
+READERS = 3
+READS = 200
+
+CHECKS = []
+
+
+class CheckFailed(Exception):
+    pass
+
+
+class CheckSkipped(Exception):
+    pass
+
+
+def conformance(func):
+    """ Register check """
+    CHECKS.append(func)
+    return func
+
+
+def check(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def requires(index, *methods):
+    """ Skip check when backend doesn't implement optional methods that are not part of IndexBaseClass """
+    missing = [m for m in methods if not hasattr(index, m)]
+    if missing:
+        raise CheckSkipped(f"backend doesn't implement {', '.join(missing)}")
+
+
+def is_close(a, b):
+    if a == None or b == None:
+        return a == b
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+
+def get_points(rows):
+    return [(x, Point(x, y, None)) for x,y in rows]
+
+
+def get_candles(rows):
+    return [(x, CandleStickPoint(x, o, h, l, c, None)) for x,o,h,l,c in rows]
+
+
+def build(index_class, columns):
+    """ Return index that contains {column: items} """
+    index = index_class(GROW_AMOUNT, SPREAD)
+    for name, items in columns.items():
+        index.insert_many(name, items)
+    return index
+
+
+def get_expected(columns, start, end):
+    """ Brute force: {column: {key: point}} for points with start <= key < end """
+    return { name : { k:v for k,v in items if start <= k < end } for name, items in columns.items() }
+
+
+def check_groups(index, columns, group_size, amount):
+    """ Groups are contiguous, span $group_size keys, contain the right points and calculate the right aggregates """
+    groups = index.get_grouped_from_last_data(group_size, amount)
+    check(len(groups) == amount, f"expected {amount} groups of {group_size}, got {len(groups)}")
+
+    last_key = index.get_key_range()[1]
+    check(groups[-1].start <= last_key < groups[-1].end, f"last group {groups[-1].start}:{groups[-1].end} doesn't contain last key {last_key}")
+
+    for prev, group in zip(groups, groups[1:]):
+        if prev.start == None:
+            continue
+        check(prev.end == group.start, f"groups are not contiguous: {prev.start}:{prev.end}, {group.start}:{group.end}")
+
+    for group in groups:
+        if group.start == None:
+            continue
+
+        check(group.end - group.start == group_size, f"group {group.start}:{group.end} is not {group_size} wide")
+        for name, expected in get_expected(columns, group.start, group.end).items():
+            check(set(group.get_col(name)) == set(expected), f"group {group.start}:{group.end} column {name} has wrong points")
+            check(group.is_empty(name) == (not expected), f"group {group.start}:{group.end} column {name} is_empty() is wrong")
+            if not expected:
+                continue
+
+            key = 'y' if name != 'candles' else 'close'
+            values = [getattr(v, key) for v in expected.values()]
+            check(is_close(group.get_avg(name, key=key), sum(values) / len(values)), f"wrong avg in {group.start}:{group.end}")
+            check(is_close(group.get_max([name], key=key), max(values)), f"wrong max in {group.start}:{group.end}")
+            check(is_close(group.get_min([name], key=key), min(values)), f"wrong min in {group.start}:{group.end}")
+    return groups
+
+
+@conformance
+def check_empty(index_class, rows, candles):
+    index = index_class(GROW_AMOUNT, SPREAD)
+    check(not index.has_data(), "empty index has data")
+    check(index.get_key_range() == (None, None), "empty index has a key range")
+    check(not index.get_grouped_from_last_data(600, 10), "empty index returns groups")
+
+
+@conformance
+def check_key_range(index_class, rows, candles):
+    items = get_points(rows)
+    random.Random(1).shuffle(items)
+    index = build(index_class, {'a' : items})
+    check(index.has_data(), "index has no data")
+    check(index.get_key_range() == (min(k for k,_ in items), max(k for k,_ in items)), f"wrong key range: {index.get_key_range()}")
+    check(index.get_columns() == ['a'], f"wrong columns: {index.get_columns()}")
+
+
+@conformance
+def check_grouped(index_class, rows, candles):
+    columns = { 'a' : get_points(rows), 'candles' : get_candles(candles) }
+    index = build(index_class, columns)
+    for group_size in GROUP_SIZES:
+        for amount in AMOUNTS:
+            check_groups(index, columns, group_size, amount)
+
+
+@conformance
+def check_insert(index_class, rows, candles):
+    """ Inserting one by one gives the same result as inserting in one go, also in random order """
+    items = get_points(rows)
+    index = index_class(GROW_AMOUNT, SPREAD)
+    for k,v in items:
+        index.insert('a', k, v)
+
+    # first key decides bucket alignment, so random order is only compared with brute force
+    shuffled = list(items)
+    random.Random(2).shuffle(shuffled)
+    shuffled_index = index_class(GROW_AMOUNT, SPREAD)
+    for k,v in shuffled:
+        shuffled_index.insert('a', k, v)
+
+    reference = build(index_class, {'a' : items})
+    for group_size in GROUP_SIZES:
+        groups = check_groups(index, {'a' : items}, group_size, AMOUNTS[-1])
+        expected = reference.get_grouped_from_last_data(group_size, AMOUNTS[-1])
+        check([g.start for g in groups] == [g.start for g in expected], "insert() and insert_many() give different groups")
+        check_groups(shuffled_index, {'a' : items}, group_size, AMOUNTS[-1])
+
+
+@conformance
+def check_replace(index_class, rows, candles):
+    """ Point with existing key replaces old point """
+    items = get_points(rows)
+    index = build(index_class, {'a' : items})
+    k, _ = items[-1]
+    index.insert('a', k, Point(k, -1, None))
+
+    group = index.get_grouped_from_last_data(SPREAD, 1)[-1]
+    check(len([key for key in group.get_col('a') if key == k]) == 1, "replaced point is missing or stored twice")
+    check(group.get_col('a')[k].y == -1, "point is not replaced")
+
+
+@conformance
+def check_gaps(index_class, rows, candles):
+    """ Keys far outside of index on both sides """
+    items = get_points(rows[:10])
+    x, y = rows[0]
+    far = [(x - 1_000 * GROW_AMOUNT * SPREAD, y), (x + 1_000 * GROW_AMOUNT * SPREAD, y)]
+    items += get_points(far)
+
+    index = index_class(GROW_AMOUNT, SPREAD)
+    for k,v in items:
+        index.insert('a', k, v)
+    check(index.get_key_range() == (far[0][0], far[1][0]), "index didn't grow to fit keys")
+    check_groups(index, {'a' : items}, SPREAD * 10, 10)
+
+
+@conformance
+def check_range(index_class, rows, candles):
+    columns = { 'a' : get_points(rows), 'b' : get_points([(x, -y) for x,y in rows]) }
+    index = build(index_class, columns)
+    requires(index, 'get_range_min', 'get_range_max')
+
+    keys = sorted(k for k,_ in columns['a'])
+    for start, end in [(keys[0], keys[-1] + 1), (keys[len(keys)//3], keys[len(keys)//2]), (keys[-1] + 1, keys[-1] + 100)]:
+        expected = get_expected(columns, start, end)
+        values = [v.y for points in expected.values() for v in points.values()]
+        check(is_close(index.get_range_min(['a', 'b'], start, end), min(values, default=None)), f"wrong range min for {start}:{end}")
+        check(is_close(index.get_range_max(['a', 'b'], start, end), max(values, default=None)), f"wrong range max for {start}:{end}")
+        a_values = [v.y for v in expected['a'].values()]
+        check(is_close(index.get_range_max(['a'], start, end, key='y'), max(a_values, default=None)), f"wrong range max for column a in {start}:{end}")
+
+
+@conformance
+def check_last_value(index_class, rows, candles):
+    # column b stops halfway
+    columns = { 'a' : get_points(rows), 'b' : get_points(rows[:len(rows)//2]) }
+    index = build(index_class, columns)
+    requires(index, 'get_last_value')
+    check(index_class(GROW_AMOUNT, SPREAD).get_last_value('a') == None, "empty index has a last value")
+    for name, items in columns.items():
+        # backends that spill points to disk return a copy of the point
+        k, v = max(items, key=lambda item: item[0])
+        last = index.get_last_value(name)
+        check(last != None and (last.x, last.y) == (v.x, v.y), f"wrong last value for column {name}")
+    check(index.get_last_value('c') == None, "unknown column has a last value")
+
+
+@conformance
+def check_remove_column(index_class, rows, candles):
+    columns = { 'a' : get_points(rows), 'b' : get_points(rows) }
+    index = build(index_class, columns)
+    index.remove_column('b')
+    check(index.get_columns() == ['a'], f"wrong columns after remove: {index.get_columns()}")
+    if hasattr(index, 'get_last_value'):
+        check(index.get_last_value('b') == None, "removed column has a last value")
+
+    del columns['b']
+    for group in check_groups(index, columns, SPREAD * 10, AMOUNTS[-1]):
+        check(group.is_empty('b'), "removed column has data")
+
+
+@conformance
+def check_evict(index_class, rows, candles):
+    columns = { 'a' : get_points(rows), 'candles' : get_candles(candles) }
+    index = build(index_class, columns)
+    requires(index, 'evict')
+    before = index.get_grouped_from_last_data(600, AMOUNTS[-1])
+    version = index.get_version()
+
+    keys = sorted(k for items in columns.values() for k,_ in items)
+    key = keys[len(keys)//2] + 1
+    index.evict(key)
+    check(index.get_version() != version, "version didn't change after evict")
+    check(index.get_key_range()[0] >= key, f"points before {key} are not evicted")
+
+    columns = { name : [(k,v) for k,v in items if k >= key] for name, items in columns.items() }
+    after = check_groups(index, columns, 600, AMOUNTS[-1])
+    check([g.start for g in before] == [g.start for g in after], "group boundaries moved after evict")
+
+    index.evict(keys[-1] + 1)
+    check(not index.has_data(), "index has data after evicting everything")
+
+
+@conformance
+def check_version(index_class, rows, candles):
+    index = index_class(GROW_AMOUNT, SPREAD)
+    versions = [index.get_version()]
+    for k,v in get_points(rows[:3]):
+        index.insert('a', k, v)
+        versions.append(index.get_version())
+    check(len(set(versions)) == len(versions), "version didn't change after insert")
+
+
+@conformance
+def check_reference(index_class, rows, candles):
+    """ Other backends must give the same groups as the reference implementation """
+    columns = { 'a' : get_points(rows), 'candles' : get_candles(candles) }
+    index = build(index_class, columns)
+    reference = build(Index, columns)
+
+    views = [(group_size, amount) for group_size in GROUP_SIZES for amount in AMOUNTS]
+    for group_size, amount in views:
+        groups = index.get_grouped_from_last_data(group_size, amount)
+        expected = reference.get_grouped_from_last_data(group_size, amount)
+        check([(g.start, g.end) for g in groups] == [(g.start, g.end) for g in expected], f"groups of {group_size}x{amount} differ from Index")
+
+    groups = index.get_all_grouped(AMOUNTS[-1])
+    expected = reference.get_all_grouped(AMOUNTS[-1])
+    check([(g.start, g.end) for g in groups] == [(g.start, g.end) for g in expected], "get_all_grouped() differs from Index")
+
+
+@conformance
+def check_concurrent_readers(index_class, rows, candles):
+    """ Render thread and RefineThread read at the same time while holding the global read lock.
+        Run with a small memory budget to check backends that page points in and out while reading """
+    items = get_points(rows)
+    index = build(index_class, {'a' : items})
+    keys = sorted(k for k,_ in items)
+
+    rng = random.Random(3)
+    views = [(rng.choice(GROUP_SIZES), index.get_index_key(rng.choice(keys)), AMOUNTS[0]) for _ in range(20)]
+    errors = []
+
+    def read(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(READS):
+                view = rng.choice(views)
+                with lock.reading(name='check_concurrent_readers'):
+                    groups = index.get_grouped(*view)
+
+                for group in groups:
+                    if group.start == None:
+                        continue
+                    expected = keys[bisect.bisect_left(keys, group.start):bisect.bisect_left(keys, group.end)]
+                    if set(group.get_col('a')) != set(expected):
+                        errors.append(f"group {group.start}:{group.end} of view {view} has {len(group.get_col('a'))} points, expected {len(expected)}")
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=read, args=(seed,)) for seed in range(READERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    check(not errors, f"{len(errors)} errors while reading concurrently, first: {errors[0] if errors else None}")
+
+
+def run_checks(args, index_class):
+    """ Return {check name: 'ok' or reason it failed} """
+    rows = get_dataset(args.dataset, args.size, seed=args.seed)
+    candles = get_dataset(args.dataset, args.size, seed=args.seed, candles=True)
+
+    results = {}
+    for func in CHECKS:
+        name = func.__name__
+        if not is_selected(args, name):
+            continue
+        try:
+            func(index_class, rows, candles)
+            results[name] = 'ok'
+        except CheckFailed as e:
+            results[name] = f"failed: {e}"
+        except CheckSkipped as e:
+            results[name] = f"skipped: {e}"
+        except Exception as e:
+            results[name] = f"error: {type(e).__name__}: {e}"
+    return results
+
+
+def run_bench(args, index_class):
+    """ Run indexer benchmarks against backend """
+    args.index_class = index_class
+    rows = get_dataset(args.dataset, args.size, seed=args.seed)
+    items = bench_indexer.get_points(rows)
+
+    results = {}
+    bench_indexer.bench_insert(args, items, results)
+    bench_indexer.bench_grouped(args, items, results)
+    bench_indexer.bench_fit_all(args, items, results)
+    return results
+
+
+def main():
+    parser = get_argument_parser("Check if an index backend conforms to IndexBaseClass")
+    parser.set_defaults(size=5_000)
+    parser.add_argument('--backend', default='complot.indexer:Index', help="index backend to check: module:Class")
+    parser.add_argument('--bench',   action='store_true',             help="also run indexer benchmarks against backend")
+    parser.add_argument('--index-options', help="JSON object with extra keyword arguments for backend")
+    args = parser.parse_args()
+
+    index_class = load_class(args.backend)
+    if args.index_options:
+        index_class = functools.partial(index_class, **json.loads(args.index_options))
+    results = { 'checks' : run_checks(args, index_class) }
+    if args.bench:
+        results['bench'] = run_bench(args, index_class)
+    write_results(args, results)
+
+    failed = [name for name, result in results['checks'].items() if result.startswith(('failed', 'error'))]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import csv
+import random
+import datetime
+
+# 2021-01-01 00:00 UTC
+START = 1_609_459_200
+
+
+def generate_series(size, seed=1, kind='walk', start=START, step=7):
+    """ Return list of (x, y) with a point every $step seconds.
+        kind: 'walk' is a random walk, 'random' is uniform noise """
+    rand = random.Random(seed)
+    rows = []
+    y = 100.0
+    for i in range(size):
+        if kind == 'random':
+            y = rand.random()
+        else:
+            y += rand.gauss(0, 1)
+        rows.append((start + i * step, y))
+    return rows
+
+
+def generate_candles(size, seed=1, start=START, step=60):
+    """ Return list of (x, open, high, low, close) following a random walk """
+    rand = random.Random(seed)
+    rows = []
+    close = 100.0
+    for i in range(size):
+        open_price = close
+        close = open_price + rand.gauss(0, 1)
+        high = max(open_price, close) + abs(rand.gauss(0, 0.5))
+        low = min(open_price, close) - abs(rand.gauss(0, 0.5))
+        rows.append((start + i * step, open_price, high, low, close))
+    return rows
+
+
+def parse_datetime(s):
+    return datetime.datetime.fromisoformat(s).timestamp()
+
+
+def load_csv(path, columns=None):
+    """ Load csv file with a Datetime column like the ones in test_data/.
+        Return list of (timestamp, value, ...) for $columns, defaults to the first column that has numeric values.
+        Rows with missing values are skipped """
+    rows = []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        for record in reader:
+            if columns == None:
+                columns = [k for k,v in record.items() if k != 'Datetime' and is_number(v)][:1]
+                if not columns:
+                    continue
+            try:
+                rows.append((parse_datetime(record['Datetime']),) + tuple(float(record[c]) for c in columns))
+            except (ValueError, TypeError):
+                continue
+    return rows
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def tile(rows, size):
+    """ Repeat rows, shifted in time, until there are $size rows """
+    if not rows or len(rows) >= size:
+        return rows[:size]
+
+    span = rows[-1][0] - rows[0][0] + (rows[1][0] - rows[0][0] if len(rows) > 1 else 1)
+    out = []
+    shift = 0
+    while len(out) < size:
+        out += [(row[0] + shift,) + tuple(row[1:]) for row in rows[:size - len(out)]]
+        shift += span
+    return out
+
+
+def get_dataset(name, size, seed=1, candles=False, step=None):
+    """ Return $size rows for dataset $name:
+            'walk'      random walk
+            'random'    uniform noise
+            path.csv    csv file, repeated when it's shorter than $size
+        If $candles is True, rows are (x, open, high, low, close), otherwise (x, y).
+        $step sets the seconds between generated rows, csv files keep their own timestamps """
+    if name.endswith('.csv'):
+        columns = ['Open', 'High', 'Low', 'Close'] if candles else None
+        return tile(load_csv(name, columns=columns), size)
+    kwargs = { 'step' : step } if step else {}
+    if candles:
+        return generate_candles(size, seed=seed, **kwargs)
+    return generate_series(size, seed=seed, kind=name, **kwargs)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+""" End to end frame time benchmark, plots are drawn on a headless backend so no terminal is needed.
+    Reports draw latency per scenario and terminal size, broken down per actor layer.
+
+    python -m complot.bench.frame --lines line,candlestick,peaks --size 50000 --terms 80x24,200x60
+"""
+
+import datetime
+
+from complot import metrics
+from complot.plot import Plot
+from complot.backends import HeadlessScreen
+from complot.lines import Line, CandleStickLine, HistogramLine, PeaksDetect, CurrentValueLine
+from complot.utils import Histogram
+from complot.bench.common import summarize, get_argument_parser, is_selected, write_results
+from complot.bench.datasets import get_dataset
+
+LINE_TYPES = ['line', 'candlestick', 'histogram', 'peaks', 'currentvalue']
+
+# seconds between points in generated datasets, all lines use the same so they cover the same time span
+STEP = 60
+
+SCENARIOS = ['static', 'update', 'zoom', 'pan', 'fit_all']
+
+
+def create_lines(plot, types, rows, candles):
+    """ Add lines of $types to plot and load data.
+        Peaks follow the last candlestick line, current value follows the last line that has data """
+    source = candlestick = None
+    for i,line_type in enumerate(types):
+        name = f"{line_type} {i}"
+        orientation = 'right' if i % 2 else 'left'
+
+        if line_type == 'line':
+            source = plot.add_line(Line(name=name), orientation=orientation)
+            source.add_points(rows)
+        elif line_type == 'histogram':
+            source = plot.add_line(HistogramLine(name=name), orientation=orientation)
+            source.add_points(rows)
+        elif line_type == 'candlestick':
+            source = candlestick = plot.add_line(CandleStickLine(name=name), orientation=orientation)
+            source.add_points(candles)
+        elif line_type == 'peaks':
+            # peaks are found in the high and low values of candles
+            if candlestick == None:
+                raise ValueError("Line type 'peaks' needs a candlestick line before it")
+            plot.add_line(PeaksDetect(candlestick, name=name), orientation=orientation)
+        elif line_type == 'currentvalue':
+            if source == None:
+                raise ValueError("Line type 'currentvalue' needs a line with data before it")
+            plot.add_line(CurrentValueLine(source, name=name), orientation=orientation)
+        else:
+            raise ValueError(f"Unknown line type: {line_type}, choose from: {', '.join(LINE_TYPES)}")
+
+
+def create_plot(args, rows, candles, term):
+    cols, term_rows = term
+    plot = Plot(HeadlessScreen(term_rows, cols), backend='headless', bin_window=datetime.timedelta(seconds=args.bin_window),
+                progressive=args.progressive, precompute=False)
+    create_lines(plot, args.lines.split(','), rows, candles)
+    return plot
+
+
+def prepare(plot, scenario, frame):
+    """ Change plot state before a frame is drawn """
+    if scenario == 'static':
+        # draw everything again but don't change the view
+        plot._compositor.invalidate()
+    elif scenario == 'update':
+        # append a point to every line, like a live plot
+        for line in plot._lines:
+            last = line.get_last_point()
+            if last == None:
+                continue
+            if isinstance(line, CandleStickLine):
+                line.add_point(last.x + STEP, last.open, last.high, last.low, last.close)
+            else:
+                line.add_point(last.x + STEP, last.y)
+    elif scenario == 'zoom':
+        # alternate zooming out and in, every frame is a new view
+        if frame % 2:
+            plot.zoom_x(None, None)
+        else:
+            plot.unzoom_x(None, None)
+    elif scenario == 'pan':
+        # pan left until we're half way and back again
+        if frame % 20 < 10:
+            plot.pan_left(None, None)
+        else:
+            plot.pan_right(None, None)
+    elif scenario == 'fit_all':
+        plot.state['fit all'].enable()
+        plot._compositor.invalidate()
+
+
+def run_scenario(args, plot, scenario):
+    """ Draw $args.repeat frames and return latency stats and per layer breakdown """
+    # first frame builds everything, it's reported separately
+    prepare(plot, scenario, 0)
+    plot.draw()
+    first = plot._scheduler.get_frame_time()
+
+    # layers of lines are named after the global line number, report them by line name
+    names = { f"line {line.line_number}" : line.name for line in plot._lines }
+
+    metrics.reset()
+    layers = {}
+    frames = []
+    for frame in range(1, args.repeat+1):
+        prepare(plot, scenario, frame)
+        plot.draw()
+        frames.append(plot._scheduler.get_frame_time())
+
+        # layers that were composited from an earlier render cost nothing this frame
+        for layer in plot._compositor.get_layers():
+            layers.setdefault(names.get(layer.name, layer.name), Histogram()).record(layer.frame_time)
+
+    stats = metrics.get_stats()['histograms']
+    return { 'first frame' : first,
+             'frames'      : summarize(frames),
+             'layers'      : { name : hist.get_stats() for name, hist in layers.items() },
+             'composite'   : stats.get('draw.composite'),
+             'refresh'     : stats.get('backend.refresh'),
+             'bytes'       : plot._backend.get_stats()['bytes per frame'] }
+
+
+def main():
+    parser = get_argument_parser("Benchmark frames drawn by Plot on a headless backend")
+    # every frame is a run
+    parser.set_defaults(size=20_000, repeat=50)
+    parser.add_argument('--lines',      default='line,candlestick', help=f"comma separated line types: {', '.join(LINE_TYPES)}")
+    parser.add_argument('--terms',      default='80x24,160x48',     help="comma separated terminal sizes: COLSxROWS")
+    parser.add_argument('--bin-window', type=int, default=300,      help="seconds per column")
+    parser.add_argument('--progressive', action='store_true',       help="refine expensive views in the background")
+    args = parser.parse_args()
+
+    rows = [(x, y) for x,y,*_ in get_dataset(args.dataset, args.size, seed=args.seed, step=STEP)]
+    candles = get_dataset(args.dataset, args.size, seed=args.seed, candles=True, step=STEP)
+
+    metrics.set_enabled(True)
+
+    results = {}
+    for term in args.terms.split(','):
+        cols, term_rows = [int(x) for x in term.split('x')]
+        for scenario in SCENARIOS:
+            name = f"{scenario}.{term}"
+            if not is_selected(args, name):
+                continue
+
+            # every scenario starts with a fresh plot so they don't influence each other
+            plot = create_plot(args, rows, candles, (cols, term_rows))
+            try:
+                results[name] = run_scenario(args, plot, scenario)
+            finally:
+                plot.stop_workers()
+
+    write_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
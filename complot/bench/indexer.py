@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+""" Indexer micro benchmarks, results are written as JSON.
+
+    python -m complot.bench.indexer --size 100000 --out before.json
+    python -m complot.bench.indexer --dataset test_data/XMRBTC_2021-01-01_1m.csv --only insert
+    python -m complot.bench.indexer --backend mymodule:MyIndex
+    python -m complot.bench.indexer --size 1000000 --workers 4 --only fit_all
+"""
+
+import json
+import random
+import functools
+import tracemalloc
+
+from complot.lines import Point
+from complot.aggregate import Aggregator
+from complot.bench.common import measure, summarize, get_argument_parser, is_selected, write_results, load_class
+from complot.bench.datasets import get_dataset
+
+# same as Data()
+GROW_AMOUNT = 10000
+SPREAD = 60
+
+GROUP_SIZES = [60, 600, 3600]
+AMOUNTS = [100, 500]
+
+
+def get_points(rows):
+    """ Return list of (key, point) """
+    return [(x, Point(x, y, None)) for x,y in rows]
+
+
+def build_index(args, items):
+    index = args.index_class(GROW_AMOUNT, SPREAD)
+    index.insert_many('col1', items)
+    return index
+
+
+def bench_insert(args, items, results):
+    """ Insert one point at a time in order, in random order and in one batch """
+    shuffled = list(items)
+    random.Random(args.seed).shuffle(shuffled)
+
+    def insert(items):
+        def run(index):
+            for k,v in items:
+                index.insert('col1', k, v)
+        return run
+
+    new_index = lambda: args.index_class(GROW_AMOUNT, SPREAD)
+    benchmarks = { 'insert.in_order'     : insert(items),
+                   'insert.out_of_order' : insert(shuffled),
+                   'insert.bulk'         : lambda index: index.insert_many('col1', items) }
+
+    for name, func in benchmarks.items():
+        if is_selected(args, name):
+            results[name] = summarize(measure(func, repeat=args.repeat, setup=new_index), ops=len(items))
+
+
+def bench_grouped(args, items, results):
+    """ Group last data at several group sizes and amounts, with and without cache """
+    index = build_index(args, items)
+
+    for group_size in GROUP_SIZES:
+        for amount in AMOUNTS:
+            name = f"get_grouped.miss.{group_size}x{amount}"
+            if is_selected(args, name):
+                def miss():
+                    index.clear_cache()
+                    index.get_grouped_from_last_data(group_size, amount)
+                results[name] = summarize(measure(miss, repeat=args.repeat), ops=amount)
+
+            name = f"get_grouped.hit.{group_size}x{amount}"
+            if is_selected(args, name):
+                index.get_grouped_from_last_data(group_size, amount)
+                results[name] = summarize(measure(lambda: index.get_grouped_from_last_data(group_size, amount), repeat=args.repeat), ops=1)
+
+    # group aggregates are calculated when a group is drawn
+    for amount in AMOUNTS:
+        name = f"get_grouped.aggregates.{amount}"
+        if is_selected(args, name):
+            def aggregates():
+                index.clear_cache()
+                for group in index.get_grouped_from_last_data(SPREAD * 10, amount):
+                    group.get_avg('col1', key='y')
+                    group.get_max(['col1'], key='max')
+                    group.get_min(['col1'], key='min')
+            results[name] = summarize(measure(aggregates, repeat=args.repeat), ops=amount)
+
+
+def bench_fit_all(args, items, results):
+    """ Group all data into the width of a terminal """
+    index = build_index(args, items)
+
+    for amount in AMOUNTS:
+        name = f"fit_all.{amount}"
+        if is_selected(args, name):
+            def fit_all():
+                index.clear_cache()
+                index.get_all_grouped(amount)
+            results[name] = summarize(measure(fit_all, repeat=args.repeat), ops=amount)
+
+
+def bench_fit_all_workers(args, items, results):
+    """ Group all data into the width of a terminal with worker processes, same as Plot(fit_all_workers=...).
+        fit_all.workers.* copies all points to shared memory once and is then comparable to fit_all.*,
+        fit_all.workers.append.* also appends a batch of new points before every run, like a live feed does """
+    names = [f"fit_all.workers.{kind}{amount}" for kind in ('', 'append.') for amount in AMOUNTS]
+    if not args.workers or not any(is_selected(args, name) for name in names):
+        return
+
+    # last points are appended while benchmarking
+    batch = max(1, len(items) // 1000)
+    n_batches = args.repeat * len(AMOUNTS)
+    index = build_index(args, items[:-batch * n_batches])
+    index.set_aggregator(Aggregator(workers=args.workers, min_points=0))
+    new_items = iter(items[-batch * n_batches:])
+
+    try:
+        for amount in AMOUNTS:
+            name = f"fit_all.workers.{amount}"
+            if is_selected(args, name):
+                def fit_all():
+                    index.clear_cache()
+                    index.get_all_grouped(amount)
+
+                # first run starts the worker processes and copies all points
+                fit_all()
+                results[name] = summarize(measure(fit_all, repeat=args.repeat), ops=amount)
+
+            name = f"fit_all.workers.append.{amount}"
+            if is_selected(args, name):
+                def append():
+                    index.insert_many('col1', [next(new_items) for _ in range(batch)])
+                def fit_all_after_append(_):
+                    index.get_all_grouped(amount)
+                results[name] = summarize(measure(fit_all_after_append, repeat=args.repeat, setup=append), ops=amount)
+    finally:
+        index.shutdown()
+
+
+def bench_memory(args, rows, results):
+    """ Bytes allocated per point, for the point objects and for the index that holds them """
+    if not is_selected(args, 'memory'):
+        return
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = get_points(rows)
+    points = tracemalloc.get_traced_memory()[0]
+    index = build_index(args, items)
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    results['memory'] = { 'points'                : len(rows),
+                          'buckets'               : index.get_bucket_count(),
+                          'point_bytes'           : round((points - before) / len(rows), 1),
+                          'index_bytes_per_point' : round((total - points) / len(rows), 1) }
+
+
+def main():
+    parser = get_argument_parser("Benchmark indexer operations")
+    parser.add_argument('--backend', default='complot.indexer:Index', help="index backend to benchmark: module:Class")
+    parser.add_argument('--index-options', help="JSON object with extra keyword arguments for backend")
+    parser.add_argument('--workers', type=int, help="also benchmark fit all with this amount of worker processes")
+    args = parser.parse_args()
+    args.index_class = load_class(args.backend)
+    if args.index_options:
+        args.index_class = functools.partial(args.index_class, **json.loads(args.index_options))
+
+    rows = get_dataset(args.dataset, args.size, seed=args.seed)
+    items = get_points(rows)
+
+    results = {}
+    bench_insert(args, items, results)
+    bench_grouped(args, items, results)
+    bench_fit_all(args, items, results)
+    bench_fit_all_workers(args, items, results)
+    bench_memory(args, rows, results)
+    write_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
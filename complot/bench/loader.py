@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+""" CSV loading benchmark, compares reading a whole file before plotting it with the chunked CSVLoader.
+    Reports parse rate, peak memory while parsing and the time until the first frame is drawn.
+    When no --csv is given, a candlestick file like test_data/candlesticks.csv is generated from --dataset.
+
+    python -m complot.bench.loader --size 1000000
+    python -m complot.bench.loader --csv test_data/XMRBTC_2021-01-01_1m.csv --chunk-size 5000
+"""
+
+import os
+import csv
+import time
+import datetime
+import tempfile
+import tracemalloc
+
+from complot.plot import Plot
+from complot.backends import HeadlessScreen
+from complot.lines import CandleStickLine
+from complot.loaders import CSVLoader, parse_key, parse_value
+from complot.bench.common import measure, summarize, get_argument_parser, is_selected, write_results
+from complot.bench.datasets import get_dataset
+
+COLUMNS = ['Open', 'High', 'Low', 'Close']
+
+
+def write_csv(path, candles):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Datetime'] + COLUMNS)
+        for x, *values in candles:
+            writer.writerow([datetime.datetime.fromtimestamp(x, tz=datetime.timezone.utc)] + values)
+
+
+def read_all(path):
+    """ Read whole file before anything is plotted, like csvplot used to do """
+    with open(path, newline='') as f:
+        rows = [(parse_key(record['Datetime']),) + tuple(parse_value(record[col]) for col in COLUMNS) for record in csv.DictReader(f)]
+    return [rows]
+
+
+def read_chunked(path, chunk_size):
+    loader = CSVLoader(path, chunk_size=chunk_size)
+    return (chunk.get_rows(COLUMNS) for chunk in loader.read_chunks())
+
+
+def parse(chunks):
+    """ Parse file and throw rows away, return amount of rows """
+    return sum(len(rows) for rows in chunks)
+
+
+def get_peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def plot(reader):
+    """ Add chunks to a headless plot, draw after first chunk and at the end. Return (time to first frame, total time) """
+    p = Plot(HeadlessScreen(40, 120), backend='headless', bin_window=datetime.timedelta(minutes=5),
+             progressive=False, precompute=False)
+    try:
+        line = p.add_line(CandleStickLine(name='candles'))
+        t_start = time.perf_counter()
+        t_first = None
+        for rows in reader():
+            line.add_points(rows)
+            if t_first == None:
+                p.draw()
+                t_first = time.perf_counter() - t_start
+        p.draw()
+        return t_first, time.perf_counter() - t_start
+    finally:
+        p.stop_workers()
+
+
+def main():
+    parser = get_argument_parser("Benchmark loading csv files")
+    parser.set_defaults(size=200_000, repeat=3)
+    parser.add_argument('--csv',        help="csv file with Datetime, Open, High, Low and Close columns")
+    parser.add_argument('--chunk-size', type=int, default=10_000, help="amount of rows per chunk")
+    args = parser.parse_args()
+
+    path = args.csv
+    if path == None:
+        fd, path = tempfile.mkstemp(prefix='complot-', suffix='.csv')
+        os.close(fd)
+        write_csv(path, get_dataset(args.dataset, args.size, seed=args.seed, candles=True, step=60))
+
+    readers = { 'all'     : lambda: read_all(path),
+                'chunked' : lambda: read_chunked(path, args.chunk_size) }
+
+    results = { 'bytes' : os.path.getsize(path) }
+    try:
+        for name, reader in readers.items():
+            if not is_selected(args, name):
+                continue
+
+            counts = []
+            times = measure(lambda: counts.append(parse(reader())), repeat=args.repeat)
+            first, total = zip(*[plot(reader) for _ in range(args.repeat)])
+            results[name] = { 'parse'       : summarize(times, ops=counts[-1]),
+                              'peak memory' : get_peak_memory(lambda: parse(reader())),
+                              'first frame' : summarize(first),
+                              'plot'        : summarize(total, ops=counts[-1]) }
+    finally:
+        if args.csv == None:
+            os.remove(path)
+
+    write_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+""" Ingestion benchmark, replays a recorded feed into a plot that is drawn on a headless backend.
+    Reports ingest rate, point to screen latency and memory growth.
+    Record a feed with Plot(record=PATH) or eg. cryptostreamer.py --record PATH.
+    When no recording is given, a recording is generated from --dataset.
+
+    python -m complot.bench.replay feed.rec --speed 10 --ingest
+    python -m complot.bench.replay --size 100000 --rate 20000 --speed 0
+"""
+
+import os
+import time
+import tempfile
+import threading
+from collections import deque
+
+from complot import lock
+from complot.plot import Plot
+from complot.backends import HeadlessScreen
+from complot.lines import Line, CandleStickLine
+from complot.recorder import Recorder, Replayer
+from complot.utils import Histogram, get_memory_usage
+from complot.bench.common import get_argument_parser, write_results
+from complot.bench.datasets import get_dataset
+
+
+class LatencyTracker():
+    """ Measures time between adding points and the end of the first frame that shows them """
+    def __init__(self):
+        # per line: (amount of points line has after batch is added, time batch was added)
+        self._pending = {}
+        self._added = {}
+        self.latency = Histogram()
+
+    def on_batch(self, line, amount):
+        """ Is called by replayer after points are added """
+        self._added[line] = self._added.get(line, 0) + amount
+        self._pending.setdefault(line, deque()).append((self._added[line], time.perf_counter()))
+
+    def on_frame(self, counts, t_done):
+        """ $counts are the amount of points lines had when frame started """
+        for line, count in counts.items():
+            pending = self._pending.get(line)
+            while pending and pending[0][0] <= count:
+                self.latency.record(t_done - pending.popleft()[1])
+
+    def get_pending(self):
+        return sum(len(pending) for pending in self._pending.values())
+
+
+def generate_recording(args, path):
+    """ Write a recording of a line and a candlestick line that receive $args.rate points per second """
+    rows = get_dataset(args.dataset, args.size, seed=args.seed)
+    candles = get_dataset(args.dataset, args.size, seed=args.seed, candles=True)
+
+    recorder = Recorder(path)
+    line = Line(name='line')
+    candlestick = CandleStickLine(name='candlestick')
+    recorder.add_line(line, 'left')
+    recorder.add_line(candlestick, 'right')
+
+    for i, (row, candle) in enumerate(zip(rows, candles)):
+        t = i / args.rate
+        recorder.record(line, row, t=t)
+        recorder.record(candlestick, candle, t=t)
+    recorder.close()
+
+
+def replay(args, path):
+    cols, rows = [int(x) for x in args.term.split('x')]
+    plot = Plot(HeadlessScreen(rows, cols), backend='headless', ingest=args.ingest, precompute=False)
+
+    tracker = LatencyTracker()
+    replayer = Replayer(plot, path, speed=args.speed, on_batch=tracker.on_batch)
+    lines = replayer.create_lines()
+
+    frame_times = Histogram()
+    rss_start = rss_peak = get_memory_usage()
+
+    feeder = threading.Thread(target=replayer.run, daemon=True)
+    feeder.start()
+
+    # render loop, stops when feed is done and the last points are drawn
+    while True:
+        done = not feeder.is_alive()
+        if plot._scheduler.wait(timeout=0.1):
+            # points that are in the index when the frame starts are on screen when it's done
+            counts = { line : line.get_point_count() for line in lines }
+            with lock.reading(name='replay'):
+                plot.draw()
+            tracker.on_frame(counts, time.perf_counter())
+            frame_times.record(plot._scheduler.get_frame_time())
+            rss_peak = max(rss_peak, get_memory_usage())
+        elif done:
+            break
+
+    plot.stop_workers()
+    rss_end = get_memory_usage()
+    stats = replayer.get_stats()
+
+    return { 'replay'    : stats,
+             'latency'   : tracker.latency.get_stats(),
+             'not drawn' : tracker.get_pending(),
+             'frames'    : frame_times.get_stats(),
+             'ingest'    : plot._ingest_thread.get_stats() if plot._ingest_thread else None,
+             'memory'    : { 'start'           : rss_start,
+                             'end'             : rss_end,
+                             'peak'            : rss_peak,
+                             'bytes per point' : round((rss_end - rss_start) / stats['points'], 1) if stats['points'] else None } }
+
+
+def main():
+    parser = get_argument_parser("Replay a recorded feed into a plot and measure ingestion")
+    parser.set_defaults(size=10_000)
+    parser.add_argument('path', nargs='?',                   help="recording made by complot.recorder.Recorder")
+    parser.add_argument('--speed',  type=float, default=1,   help="1 is real time, 0 is as fast as possible")
+    parser.add_argument('--ingest', action='store_true',     help="buffer points in IngestThread")
+    parser.add_argument('--term',   default='120x40',        help="terminal size: COLSxROWS")
+    parser.add_argument('--rate',   type=int, default=1_000, help="points per second per line in generated recording")
+    args = parser.parse_args()
+
+    if args.path:
+        results = replay(args, args.path)
+    else:
+        fd, path = tempfile.mkstemp(suffix='.rec')
+        os.close(fd)
+        try:
+            generate_recording(args, path)
+            results = replay(args, path)
+        finally:
+            os.remove(path)
+
+    write_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
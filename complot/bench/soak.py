@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+""" Soak benchmark, streams days of data into a headless plot at accelerated time while zooming, panning,
+    resizing and replacing lines. The size of long lived structures is sampled over time and structures
+    that keep growing are flagged, so leaks show up in minutes instead of after days.
+
+    python -m complot.bench.soak --days 7 --step 10
+    python -m complot.bench.soak --days 30 --step 60 --samples 40 --out soak.json
+"""
+
+import gc
+import sys
+import time
+import weakref
+import datetime
+
+from complot import errors_list
+from complot.plot import Plot
+from complot.backends import HeadlessScreen
+from complot.lines import Line, CandleStickLine
+from complot.menu import MenuItemBaseClass
+from complot.utils import get_memory_usage
+from complot.bench.common import get_argument_parser, write_results
+from complot.bench.datasets import get_dataset
+
+# operations that are done in turn every $args.op_every points, like a user would
+OPERATIONS = ['zoom in', 'zoom out', 'pan left', 'pan right', 'fit all', 'reset', 'resize', 'replace line']
+
+# terminal sizes that are used by the resize operation
+TERMS = [(120, 40), (80, 24)]
+
+# a structure is flagged when it grew in this part of the sample intervals and never shrunk
+GROWTH_THRESHOLD = 0.75
+
+
+def get_sizes(plot, removed):
+    """ Return sizes of structures that live as long as the plot, $removed are weak references to removed lines """
+    gc.collect()
+    return { 'rss'                 : get_memory_usage(),
+             'gc objects'          : len(gc.get_objects()),
+             'points'              : sum(line.get_point_count() for line in plot._lines),
+             'index buckets'       : plot._data.get_bucket_count(),
+             'index columns'       : len(plot._data.get_columns()),
+             'cache items'         : plot._data.get_cache_stats()['items'],
+             'refine results'      : len(plot._refine_thread._results) if plot._refine_thread else 0,
+             'layers'              : len(plot._compositor._layers),
+             'log buffer'          : errors_list.tell(),
+             'menu items'          : len(MenuItemBaseClass.items),
+             'lines'               : len(plot._lines),
+             'removed lines alive' : sum(1 for ref in removed if ref() != None) }
+
+
+def find_growth(samples, warmup=1):
+    """ Return growth per simulated day of every structure and flag the ones that only grow """
+    samples = samples[warmup:]
+    if len(samples) < 3:
+        return {}
+
+    days = (samples[-1]['day'] - samples[0]['day']) or 1
+    result = {}
+    for name in samples[0]['sizes']:
+        values = [sample['sizes'][name] for sample in samples]
+        steps = [b - a for a,b in zip(values, values[1:])]
+        grew = len([s for s in steps if s > 0])
+
+        result[name] = { 'first'   : values[0],
+                         'last'    : values[-1],
+                         'per day' : round((values[-1] - values[0]) / days, 1),
+                         'growing' : min(steps) >= 0 and grew >= GROWTH_THRESHOLD * len(steps) }
+    return result
+
+
+class Soak():
+    """ Feeds points into plot and does an operation every $op_every points """
+    def __init__(self, args):
+        self._args = args
+
+        cols, rows = TERMS[0]
+        self._screen = HeadlessScreen(rows, cols)
+        self._plot = Plot(self._screen, backend='headless', bin_window=datetime.timedelta(minutes=5), precompute=False)
+
+        self._line = self._plot.add_line(Line(name='line'))
+        self._candlestick = self._plot.add_line(CandleStickLine(name='candlestick'), orientation='right')
+
+        # line that is replaced by the 'replace line' operation, removed lines should be freed
+        self._temporary = None
+        self._replaced = 0
+        self._removed = []
+
+        self._operations = 0
+
+    def do_operation(self):
+        plot = self._plot
+        operation = OPERATIONS[self._operations % len(OPERATIONS)]
+        self._operations += 1
+
+        if operation == 'zoom in':
+            plot.zoom_x(None, None)
+        elif operation == 'zoom out':
+            plot.unzoom_x(None, None)
+        elif operation == 'pan left':
+            plot.pan_left(None, None)
+        elif operation == 'pan right':
+            plot.pan_right(None, None)
+        elif operation == 'fit all':
+            plot.state['fit all'].enable()
+        elif operation == 'reset':
+            plot.reset_settings(None, None)
+            plot.state['paused'].disable()
+        elif operation == 'resize':
+            cols, rows = TERMS[self._operations % len(TERMS)]
+            self._screen.resize(rows, cols)
+            plot._backend.check_resized()
+        elif operation == 'replace line':
+            if self._temporary:
+                plot.remove_line(self._temporary)
+                self._removed.append(weakref.ref(self._temporary))
+            self._replaced += 1
+            self._temporary = plot.add_line(Line(name=f"temporary {self._replaced}"))
+
+    def run(self):
+        args = self._args
+        plot = self._plot
+
+        size = int(args.days * 86400 / args.step)
+        rows = get_dataset(args.dataset, size, seed=args.seed, step=args.step)
+        candles = get_dataset(args.dataset, size, seed=args.seed, candles=True, step=args.step)
+        sample_every = max(1, size // args.samples)
+
+        samples = []
+        t_start = time.perf_counter()
+        for i, (row, candle) in enumerate(zip(rows, candles)):
+            self._line.add_point(*row)
+            self._candlestick.add_point(*candle)
+            if self._temporary:
+                self._temporary.add_point(*row)
+
+            if i % args.op_every == 0:
+                self.do_operation()
+            if i % args.draw_every == 0:
+                plot.draw()
+
+            if i % sample_every == 0 or i == size-1:
+                samples.append({ 'day'   : round(i * args.step / 86400, 3),
+                                 'time'  : round(time.perf_counter() - t_start, 3),
+                                 'sizes' : get_sizes(plot, self._removed) })
+
+        plot.stop_workers()
+        return { 'points per line' : size,
+                 'operations'      : self._operations,
+                 'removed lines'   : len(self._removed),
+                 'growth'          : find_growth(samples),
+                 'samples'         : samples }
+
+
+def main():
+    parser = get_argument_parser("Stream days of data into a plot and look for structures that keep growing")
+    parser.add_argument('--days',       type=float, default=7,  help="simulated days")
+    parser.add_argument('--step',       type=int,   default=10, help="simulated seconds between points")
+    parser.add_argument('--samples',    type=int,   default=20, help="amount of times structure sizes are measured")
+    parser.add_argument('--op-every',   type=int,   default=500, help="do a zoom/pan/reset/resize/replace operation every n points")
+    parser.add_argument('--draw-every', type=int,   default=50, help="draw a frame every n points")
+    args = parser.parse_args()
+
+    results = Soak(args).run()
+    write_results(args, results)
+
+    growing = [name for name, growth in results['growth'].items() if growth['growing']]
+    if growing:
+        print(f"Growing: {', '.join(growing)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
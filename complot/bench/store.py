@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+""" Restart benchmark, compares starting a plot from a store with adding the same history point by point and in one go.
+    store.cold_start measures until the first frame is drawn, store.full_load until all stored points are loaded.
+    store.points adds history point by point with a store, compare it with rebuild.points for the cost of storing.
+    Default size is a month of 1m candles.
+
+    python -m complot.bench.store
+    python -m complot.bench.store --size 525600 --repeat 3
+"""
+
+import shutil
+import tempfile
+import datetime
+
+from complot.plot import Plot
+from complot.backends import HeadlessScreen
+from complot.lines import CandleStickLine
+from complot.bench.common import measure, summarize, get_argument_parser, is_selected, write_results
+from complot.bench.datasets import get_dataset
+
+
+def create_plot(path=None):
+    plot = Plot(HeadlessScreen(40, 120), backend='headless', bin_window=datetime.timedelta(minutes=5),
+                progressive=False, precompute=False, store=path)
+    return plot
+
+
+def start(path=None, rows=None, bulk=True, wait=False):
+    """ Create plot, load history and draw first frame, if $wait is True, wait until all stored points are loaded """
+    plot = create_plot(path)
+    line = plot.add_line(CandleStickLine(name='candles'))
+    if rows and bulk:
+        line.add_points(rows)
+    elif rows:
+        for row in rows:
+            line.add_point(*row)
+    plot.draw()
+    if wait:
+        plot.wait_for_store()
+    plot.stop_workers()
+    return line
+
+
+def main():
+    parser = get_argument_parser("Benchmark starting a plot from a store")
+    parser.set_defaults(size=30 * 24 * 60, repeat=5)
+    args = parser.parse_args()
+
+    candles = get_dataset(args.dataset, args.size, seed=args.seed, candles=True, step=60)
+    path = tempfile.mkdtemp(prefix='complot-store-')
+
+    results = {}
+    try:
+        # fill store
+        times = measure(lambda: start(path, candles, bulk=True), repeat=1)
+        results['store.write'] = summarize(times, ops=len(candles))
+
+        if is_selected(args, 'store.cold_start'):
+            times = measure(lambda: start(path), repeat=args.repeat)
+            results['store.cold_start'] = summarize(times, ops=len(candles))
+
+        if is_selected(args, 'store.full_load'):
+            lines = []
+            times = measure(lambda: lines.append(start(path, wait=True)), repeat=args.repeat)
+            if lines[-1].get_point_count() != len(candles):
+                raise ValueError(f"Loaded {lines[-1].get_point_count()} points from store, expected {len(candles)}")
+            results['store.full_load'] = summarize(times, ops=len(candles))
+
+        if is_selected(args, 'store.points'):
+            # every run writes to an empty store
+            times = measure(lambda p: start(p, candles, bulk=False), repeat=args.repeat, setup=lambda: tempfile.mkdtemp(dir=path))
+            results['store.points'] = summarize(times, ops=len(candles))
+
+        if is_selected(args, 'rebuild.bulk'):
+            times = measure(lambda: start(rows=candles, bulk=True), repeat=args.repeat)
+            results['rebuild.bulk'] = summarize(times, ops=len(candles))
+
+        if is_selected(args, 'rebuild.points'):
+            times = measure(lambda: start(rows=candles, bulk=False), repeat=args.repeat)
+            results['rebuild.points'] = summarize(times, ops=len(candles))
+    finally:
+        shutil.rmtree(path)
+
+    write_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
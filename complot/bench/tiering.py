@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+""" Tiering benchmark, fills a plot that uses TieredIndex with a memory budget and compares it with the plain Index.
+    Reports memory, how many points are spilled, the time it takes to pan far back (segments are paged in)
+    and the time of a fit all view (built from the aggregates of spilled buckets).
+    Default size is a month of 1m candles, the tiered plot runs first so its memory isn't hidden by the plain one.
+
+    python -m complot.bench.tiering
+    python -m complot.bench.tiering --size 525600 --max-points 50000
+"""
+
+import time
+import datetime
+
+from complot.plot import Plot
+from complot.indexer import Index
+from complot.tiering import TieredIndex
+from complot.backends import HeadlessScreen
+from complot.lines import CandleStickLine
+from complot.utils import get_memory_usage
+from complot.bench.common import measure, summarize, get_argument_parser, is_selected, write_results
+from complot.bench.datasets import get_dataset
+
+COLS = 120
+ROWS = 40
+
+
+def create_plot(index_class, index_options=None):
+    return Plot(HeadlessScreen(ROWS, COLS), backend='headless', bin_window=datetime.timedelta(minutes=5),
+                progressive=False, precompute=False, index_class=index_class, index_options=index_options)
+
+
+def pan_back(plot, offset):
+    """ Draw view that ends $offset columns before the last data """
+    plot.state['fit all'].disable()
+    plot._data.forget_position()
+    plot._data.keep_position()
+    plot._data.increase_offset(offset, plot._backend.get_plot_cols())
+    plot.draw()
+
+
+def fit_all(plot):
+    plot.state['fit all'].enable()
+    plot._compositor.invalidate()
+    plot.draw()
+
+
+def run(args, name, index_class, candles, index_options=None):
+    results = {}
+    rss_start = get_memory_usage()
+
+    plot = create_plot(index_class, index_options)
+    try:
+        line = plot.add_line(CandleStickLine(name='candles'))
+        t_start = time.perf_counter()
+        for i in range(0, len(candles), args.batch):
+            line.add_points(candles[i:i+args.batch])
+        plot.draw()
+        results['fill'] = summarize([time.perf_counter() - t_start], ops=len(candles))
+        results['memory'] = get_memory_usage() - rss_start
+
+        # pan to the oldest view and back to the newest, every step is a view that wasn't drawn yet
+        if is_selected(args, f"{name}.pan"):
+            n_views = len(candles) // (COLS * 5)
+            offsets = [COLS * i for i in range(n_views, -1, -max(1, n_views // args.repeat))]
+            times = measure(lambda offset: pan_back(plot, offset), repeat=len(offsets), setup=lambda: offsets.pop(0))
+            results['pan'] = summarize(times)
+
+        if is_selected(args, f"{name}.fit_all"):
+            times = measure(lambda: fit_all(plot), repeat=args.repeat)
+            results['fit_all'] = summarize(times)
+
+        index = plot._data.get_index()
+        if isinstance(index, TieredIndex):
+            results['tiers'] = index.get_tier_stats()
+    finally:
+        plot.stop_workers()
+    return results
+
+
+def main():
+    parser = get_argument_parser("Benchmark a plot that spills old buckets to disk")
+    parser.set_defaults(size=30 * 24 * 60, repeat=10)
+    parser.add_argument('--max-points', type=int, default=10_000, help="amount of points TieredIndex keeps in memory")
+    parser.add_argument('--batch',      type=int, default=1000,   help="amount of points added in one go")
+    args = parser.parse_args()
+
+    candles = get_dataset(args.dataset, args.size, seed=args.seed, candles=True, step=60)
+
+    results = {}
+    results['tiered'] = run(args, 'tiered', TieredIndex, candles, {'max_points' : args.max_points})
+    results['index'] = run(args, 'index', Index, candles)
+    write_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,20 +8,24 @@ from pprint import pformat
 
 from complot.utils import timeit
 from complot.indexer import Index
+from complot.aggregate import Aggregator
 
 logger = logging.getLogger('complot')
 
 
-class Data(Index):
-    """ The Bins() class handles all data """
-    def __init__(self):
+class Data():
+    """ The Bins() class handles all data.
+        Points are stored in an index, $index_class can be any implementation of IndexBaseClass, defaults to Index.
+        $index_options are passed to the index class as keyword arguments.
+        If $workers is set, fit all groups are aggregated in parallel by that amount of processes """
+    def __init__(self, workers=None, index_class=None, index_options=None):
         # grow index $grow_factor amount of keys when inserted key doesn't fit in index
         grow_factor = 10000
 
         # internal bin size in index object
         # BUG the bin size part becomes a problem when we want to have bin windows of <60
         bin_size    = 60
-        Index.__init__(self, grow_factor, bin_size)
+        self._index = (index_class or Index)(grow_factor, bin_size, **(index_options or {}))
 
         # length of one bin in float or float timestamp
         self._bin_window = None
@@ -32,6 +36,37 @@ class Data(Index):
         # offset, is amount of groups from last data (end), is used for panning
         self._offset = 0
 
+        if workers:
+            self._index.set_aggregator(Aggregator(workers=workers))
+
+        # views that were precomputed for current view: (current view, set of views)
+        self._precomputed = (None, set())
+
+    def shutdown(self):
+        """ Stop worker processes """
+        self._index.shutdown()
+
+    def get_index(self):
+        return self._index
+
+    def has_data(self):
+        return self._index.has_data()
+
+    def get_columns(self):
+        return self._index.get_columns()
+
+    def remove_column(self, col_name):
+        self._index.remove_column(col_name)
+
+    def set_refiner(self, refiner):
+        self._index.set_refiner(refiner)
+
+    def get_cache_stats(self):
+        return self._index.get_cache_stats()
+
+    def get_bucket_count(self):
+        return self._index.get_bucket_count()
+
     def increase_offset(self, amount, plot_width):
         """ The offset from last data, is used by get_bins(). used for panning """
         # TODO saveguard for out of bound
@@ -67,11 +102,54 @@ class Data(Index):
             offset = self._offset
 
         if self._keep_position:
-            return self.get_grouped_from_last_data(int(self._bin_window), amount, offset=offset)
+            return self._index.get_grouped_from_last_data(int(self._bin_window), amount, offset=offset)
         if self._show_all_data:
-            return self.get_all_grouped(amount)
+            return self._index.get_all_grouped(amount)
         else:
-            return self.get_grouped_from_last_data(int(self._bin_window), amount)
+            return self._index.get_grouped_from_last_data(int(self._bin_window), amount)
+
+    def get_neighbours(self, pan_steps, zoom_unit):
+        """ Return (group size, offset) of views that are shown after one pan or zoom step, most likely first """
+        pan = pan_steps * self._bin_window
+        views = [(self._bin_window, self._offset + pan),
+                 (self._bin_window, max(0, self._offset - pan)),
+                 (self._bin_window + zoom_unit, self._offset),
+                 (self._bin_window - zoom_unit, self._offset)]
+
+        current = (int(self._bin_window), self._offset)
+        return [(int(window), offset) for window, offset in views if window > 0 and (int(window), offset) != current]
+
+    def precompute(self, amount, pan_steps, zoom_unit):
+        """ Build groups for views that are one pan or zoom step away from current view and store them in cache with
+            low priority, so they're ready when user presses a key. One view is built per call so caller stays responsive.
+            Return False when there is nothing left to do """
+        if not self._index.has_data():
+            return False
+
+        # start over when view or data changed
+        current = (self._bin_window, self._offset, amount, self._index.get_version())
+        if self._precomputed[0] != current:
+            self._precomputed = (current, set())
+
+        for group_size, offset in self.get_neighbours(pan_steps, zoom_unit):
+            if (group_size, offset) in self._precomputed[1]:
+                continue
+            self._precomputed[1].add((group_size, offset))
+
+            if (group_size % self._index.get_spread()) != 0:
+                continue
+
+            # don't go past start of data
+            min_key, max_key = self._index.get_key_range()
+            end_key = int(self._index.get_index_key(max_key)) - offset
+            if end_key < self._index.get_index_key(min_key):
+                continue
+
+            # aggregates are calculated now so drawing the view is cheap
+            for group in self._index.get_grouped(group_size, end_key, amount, priority='low') or []:
+                group.warm()
+            return True
+        return False
 
     def get_y_min(self, amount, lines):
         """ Get the minimum bin y value for lines for last n amount of bins, if lines=None, return for all lines """
@@ -87,4 +165,13 @@ class Data(Index):
 
     def add_point(self, point):
         """ Add point to index """
-        self.insert(point.line.name, point.x, point)
+        self._index.insert(point.line.name, point.x, point)
+
+    def add_points(self, points):
+        """ Add list of points to index, points are inserted per line in one go """
+        columns = {}
+        for point in points:
+            columns.setdefault(point.line.name, []).append((point.x, point))
+
+        for name, items in columns.items():
+            self._index.insert_many(name, items)
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 
+import abc
 import time
 import logging
 import math
 import datetime
-import random
+import threading
 from pprint import pprint, pformat
 
 #from utils import timeit
 from complot.utils import timeit
+from complot import metrics, lock
 
 logger = logging.getLogger('complot')
 
@@ -27,16 +29,15 @@ class Group():
         # column names in data
         self._columns = data.keys()
 
-        # these values are cached when one of the corresponding functions are called, don't access directly
-        self._min = None
-        self._max = None
-        self._avg = None
+        # values are cached by arguments when one of the corresponding functions are called, don't access directly
+        # data is a snapshot of the index so cached values stay valid
+        self._min = {}
+        self._max = {}
+        self._avg = {}
 
         # the group number counted from beginning of data
         self._count = count
 
-        #TODO values are cached but when calling a second time, key or column name may have changed
-
     @property
     def count(self):
         return self._count
@@ -68,10 +69,16 @@ class Group():
         if self.is_empty(column):
             return
 
+        if (column, key) in self._avg:
+            return self._avg[(column, key)]
+
         if key:
-            return sum(getattr(point,key) for point in self.get_col(column).values()) / len(self.get_col(column))
+            avg = sum(getattr(point,key) for point in self.get_col(column).values()) / len(self.get_col(column))
         else:
-            return sum(self.get_col(column).values()) / len(self.get_col(column))
+            avg = sum(self.get_col(column).values()) / len(self.get_col(column))
+
+        self._avg[(column, key)] = avg
+        return avg
 
     def get_max(self, columns=[], key=None, use_avg=False):
         """ return max for specified column names. If key is specified, access object attribute by key
@@ -79,6 +86,10 @@ class Group():
         if type(columns) != list:
             columns = [columns]
 
+        cache_key = (tuple(columns), key, use_avg)
+        if cache_key in self._max:
+            return self._max[cache_key]
+
         values = []
         for col in columns:
             if use_avg:
@@ -88,8 +99,8 @@ class Group():
             else:
                 values.append(max(self.get_col(col).values(), default=None))
 
-        self._max = max([v for v in values if v != None], default=None)
-        return self._max
+        self._max[cache_key] = max([v for v in values if v != None], default=None)
+        return self._max[cache_key]
 
     def get_min(self, columns=[], key=None, use_avg=False):
         """ return min for specified column names. If key is specified, access object attribute by key
@@ -97,6 +108,10 @@ class Group():
         if type(columns) != list:
             columns = [columns]
 
+        cache_key = (tuple(columns), key, use_avg)
+        if cache_key in self._min:
+            return self._min[cache_key]
+
         values = []
         for col in columns:
             #values.append(self.get_avg(col, key=key))
@@ -107,8 +122,25 @@ class Group():
             else:
                 values.append(min(self.get_col(col).values(), default=None))
 
-        self._min = min([v for v in values if v != None], default=None)
-        return self._min
+        self._min[cache_key] = min([v for v in values if v != None], default=None)
+        return self._min[cache_key]
+
+    def warm(self, job=None):
+        """ Calculate and cache aggregates that actors will ask for, is done by RefineThread so drawing is cheap.
+            Return False if job was cancelled """
+        for column, points in self._data.items():
+            if not points:
+                continue
+
+            point = next(iter(points.values()))
+            keys = list(getattr(point, 'fields', [])) + list(getattr(point, 'aliases', {}))
+            for key in keys:
+                if job and job.is_cancelled():
+                    return False
+                self.get_avg(column, key=key)
+                self.get_max([column], key=key)
+                self.get_min([column], key=key)
+        return True
 
     @property
     def data(self):
@@ -137,11 +169,14 @@ class Group():
 
 class CacheItem():
     """ Representing one item in cache """
-    def __init__(self, metadata, data):
+    def __init__(self, metadata, data, priority='normal'):
         self.dt = datetime.datetime.utcnow()
         self.metadata = metadata
         self.data = data
 
+        # 'normal' or 'low', low priority items are evicted first
+        self.priority = priority
+
     def compare(self, metadata, dt=None):
         """ Check if cacheitem is something we're looking for """
         if dt:
@@ -151,26 +186,50 @@ class CacheItem():
 
 
 class Cache():
-    """ Store group data in cache, when there were no data updates, we can send back cached items """
-    def __init__(self):
+    """ Store group data in cache, when there were no data updates, we can send back cached items.
+        Items that are precomputed in idle time are stored with low priority, when there are more than
+        $max_items items, low priority items are evicted first """
+    def __init__(self, max_items=64):
         self._cache = []
+        self._max_items = max_items
+
+        # render thread and RefineThread can use the cache at the same time
+        self._lock = threading.RLock()
 
         # count lookups, cleanup every $cleanup_interval lookups
         self._lookup_counter = 0
         self._cleanup_interval = 500
 
-    def get(self, metadata, dt=None):
+        # stats
+        self.hits = 0
+        self.misses = 0
+        self.precomputed_hits = 0
+        self.evicted = 0
+
+    def get(self, metadata, dt=None, count=True):
         """ Find item in cache where this metadata is the same.
-            Only return items newer than index """
-        self._lookup_counter += 1
+            Only return items newer than index.
+            If $count is False, lookup is not counted in hit/miss stats """
+        with self._lock:
+            self._lookup_counter += 1
+
+            # cleanup every once in a while
+            if (self._lookup_counter % self._cleanup_interval) == 0:
+                self.cleanup(dt)
+
+            for ci in reversed(self._cache):
+                if ci.compare(metadata, dt=dt):
+                    if count:
+                        self.hits += 1
 
-        # cleanup every once in a while
-        if (self._lookup_counter % self._cleanup_interval) == 0:
-            self.cleanup(dt)
+                        # precomputed item is used so it's just as important as the others now
+                        if ci.priority == 'low':
+                            self.precomputed_hits += 1
+                            ci.priority = 'normal'
+                    return ci.data
 
-        for ci in reversed(self._cache):
-            if ci.compare(metadata, dt=dt):
-                return ci.data
+            if count:
+                self.misses += 1
 
     def display_cache(self):
         for i,ci in enumerate(self._cache):
@@ -178,20 +237,122 @@ class Cache():
             for k,v in ci.metadata.items():
                 logger.debug(f"    {k}: {v}")
 
-    def add(self, metadata, data):
+    def add(self, metadata, data, priority='normal'):
         """ Add data to cache, identified by item dict """
-        if not self.get(metadata, datetime.datetime.utcnow()):
-            self._cache.append(CacheItem(metadata, data))
+        with self._lock:
+            if not self.get(metadata, datetime.datetime.utcnow(), count=False):
+                self._cache.append(CacheItem(metadata, data, priority=priority))
+                self.evict()
+
+    def evict(self):
+        """ Remove oldest items until cache fits, low priority items go first """
+        with self._lock:
+            while len(self._cache) > self._max_items:
+                low = [ci for ci in self._cache if ci.priority == 'low']
+                self._cache.remove(low[0] if low else self._cache[0])
+                self.evicted += 1
 
     def cleanup(self, dt):
         """ Cleanup everything older than dt """
-        for ci in self._cache:
-            if ci.dt < dt:
-                logger.debug(f"[CACHE] cleaning up item: {ci.dt}")
-                self._cache.remove(ci)
+        with self._lock:
+            for ci in list(self._cache):
+                if ci.dt < dt:
+                    logger.debug(f"[CACHE] cleaning up item: {ci.dt}")
+                    self._cache.remove(ci)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return { 'items'            : len(self._cache),
+                 'low priority'     : len([ci for ci in self._cache if ci.priority == 'low']),
+                 'hits'             : self.hits,
+                 'misses'           : self.misses,
+                 'hit rate'         : round(self.hits / lookups, 3) if lookups else 0,
+                 'precomputed hits' : self.precomputed_hits,
+                 'evicted'          : self.evicted }
+
+
+class IndexBaseClass(abc.ABC):
+    """ Contract for index backends, Data only talks to its index through these methods so backends can be swapped.
+        Keys are numbers (eg. timestamps), values are point objects and columns are identified by line name.
+        Points are stored in buckets of $spread keys wide, groups span a multiple of buckets.
+        Groups that are returned must behave like Group: start, end, count, get_col(), get_first(), get_last(),
+        get_avg(), get_max(), get_min(), is_empty() and warm().
+        Index is the reference implementation, check other backends with: python -m complot.bench.conformance """
+    def __init__(self, amount, spread):
+        pass
+
+    @abc.abstractmethod
+    def insert(self, col_name, k, v):
+        pass
+
+    @abc.abstractmethod
+    def insert_many(self, col_name, items):
+        """ Insert list of (key, value) tuples """
+
+    @abc.abstractmethod
+    def remove_column(self, col_name):
+        pass
+
+    @abc.abstractmethod
+    def has_data(self):
+        pass
+
+    @abc.abstractmethod
+    def get_columns(self):
+        pass
+
+    @abc.abstractmethod
+    def get_spread(self):
+        pass
 
+    @abc.abstractmethod
+    def get_key_range(self):
+        """ Return (smallest key, biggest key), (None, None) when there is no data """
 
-class Index():
+    @abc.abstractmethod
+    def get_index_key(self, key):
+        """ Return first key of bucket that key belongs to """
+
+    @abc.abstractmethod
+    def get_version(self):
+        """ Return a value that changes when data changes """
+
+    @abc.abstractmethod
+    def get_grouped(self, group_size, end_key, amount, parallel=False, priority='normal'):
+        """ Return $amount groups of $group_size keys wide, last group contains bucket that starts at $end_key """
+
+    @abc.abstractmethod
+    def get_grouped_from_last_data(self, group_size, amount, offset=0, parallel=False):
+        """ Return groups that end $offset keys before last data """
+
+    @abc.abstractmethod
+    def get_all_grouped(self, amount):
+        """ Return all data in at most $amount groups """
+
+    # optional, backends that don't support aggregation by worker processes, progressive rendering or caching
+    # can ignore these
+    def set_aggregator(self, aggregator):
+        logger.debug(f"{type(self).__name__} doesn't support parallel aggregation")
+
+    def set_refiner(self, refiner):
+        logger.debug(f"{type(self).__name__} doesn't support progressive rendering")
+
+    def get_cache_stats(self):
+        return Cache().get_stats()
+
+    def get_bucket_count(self):
+        return 0
+
+    def clear_cache(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class Index(IndexBaseClass):
+    """ Reference index backend, a dict of buckets that is grown by $amount buckets of $spread keys wide when
+        a key doesn't fit. Groups are cached until data changes. """
     def __init__(self, amount, spread):
         # when index is out of bounds, grow this amount of keys
         self._index_grow_amount = amount
@@ -218,11 +379,116 @@ class Index():
 
         # keep the groups cached for efficiency's sake
         self._cache = Cache()
+
+        # when set, groups are aggregated in parallel by worker processes, see set_aggregator()
+        self._aggregator = None
+
+        # when set, expensive views are refined in the background, see set_refiner()
+        self._refiner = None
+
+        # last sampled groups: ((key, last update), groups)
+        self._coarse = (None, None)
         self._last_update = datetime.datetime.utcnow()
 
+        # (last update, amount of points), see get_point_count()
+        self._point_count = (None, 0)
+
+        # is incremented when points are removed from buckets, refinements that ran meanwhile are discarded
+        self._generation = 0
+
+        # is incremented when points are inserted before the last point, aggregator then copies all points again
+        self._backfilled = 0
+
     def has_data(self):
         """ If data is in index, columns is defined """
-        return self._index_start_key != None
+        return self._index_max_key != None
+
+    def get_columns(self):
+        return list(self._columns)
+
+    def get_spread(self):
+        return self._index_spread
+
+    def get_key_range(self):
+        return (self._index_min_key, self._index_max_key)
+
+    def get_version(self):
+        return self._last_update
+
+    def iter_range(self, columns, start_key, end_key):
+        """ Yield points in columns with start_key <= k < end_key """
+        if not self.has_data():
+            return
+
+        bucket_key = self.get_index_key(max(start_key, self._index_start_key))
+        while bucket_key < end_key and bucket_key <= self._index_end_key:
+            bucket = self._index[bucket_key]
+            for col in columns:
+                for k,v in bucket.get(col, {}).items():
+                    if start_key <= k < end_key:
+                        yield v
+            bucket_key += self._index_spread
+
+    # range queries and eviction are not part of IndexBaseClass, Data doesn't use them.
+    # the conformance suite checks them for backends that implement them
+    def get_range_min(self, columns, start_key, end_key, key='min'):
+        """ Return smallest value of attribute $key of points in columns with start_key <= k < end_key """
+        return min((getattr(v, key) for v in self.iter_range(columns, start_key, end_key)), default=None)
+
+    def get_range_max(self, columns, start_key, end_key, key='max'):
+        """ Return biggest value of attribute $key of points in columns with start_key <= k < end_key """
+        return max((getattr(v, key) for v in self.iter_range(columns, start_key, end_key)), default=None)
+
+    def get_last_value(self, col_name):
+        """ Return point with biggest key in column """
+        if not self.has_data() or col_name not in self._columns:
+            return
+
+        # walk back from last bucket until column has data
+        bucket_key = self.get_index_key(self._index_max_key)
+        while bucket_key >= self._index_start_key:
+            col = self._index[bucket_key].get(col_name)
+            if col:
+                return col[max(col)]
+            bucket_key -= self._index_spread
+
+    def evict(self, key):
+        """ Remove all points with a key smaller than $key.
+            Points are removed but buckets stay so positions in index and thus group boundaries don't change """
+        if not self.has_data() or key <= self._index_min_key:
+            return
+
+        last_bucket_key = self.get_index_key(min(key, self._index_end_key))
+        bucket_key = self._index_start_key
+        while bucket_key <= last_bucket_key:
+            bucket = self._index[bucket_key]
+            for col_name, col in bucket.items():
+                if bucket_key + self._index_spread <= key:
+                    col.clear()
+                else:
+                    for k in [k for k in col if k < key]:
+                        del col[k]
+            bucket_key += self._index_spread
+
+        # find new first point
+        self._index_min_key = None
+        bucket_key = last_bucket_key
+        while bucket_key <= self._index_end_key and self._index_min_key == None:
+            keys = [k for col in self._index[bucket_key].values() for k in col]
+            if keys:
+                self._index_min_key = min(keys)
+            bucket_key += self._index_spread
+
+        # everything is evicted
+        if self._index_min_key == None:
+            self._index_max_key = None
+
+        self._generation += 1
+        self._is_updated = True
+        self._last_update = datetime.datetime.utcnow()
+
+        # free groups that hold evicted points
+        self._cache.cleanup(self._last_update)
 
     @timeit
     def build_index(self, start_key, amount, spread):
@@ -263,13 +529,83 @@ class Index():
             ## update last index point
             self._index_end_key = list(self._index)[-1]
 
+    def set_aggregator(self, aggregator):
+        """ Aggregator copies the points to shared memory when fit-all needs them and aggregates groups in parallel """
+        self._aggregator = aggregator
+
+    def use_aggregator(self):
+        return self._aggregator != None and self._aggregator.is_enabled(self.get_point_count())
+
+    def get_point_count(self):
+        """ Amount of points in index, is counted again when data changed """
+        if self._point_count[0] != self._last_update:
+            self._point_count = (self._last_update, sum(len(col) for bucket in self._index.values() for col in bucket.values()))
+        return self._point_count[1]
+
+    def iter_column(self, col_name, from_key=None):
+        """ Yield (key, point) of all points in column, or of points with a key >= $from_key """
+        if from_key == None:
+            for bucket in self._index.values():
+                yield from bucket.get(col_name, {}).items()
+            return
+
+        if not self.has_data():
+            return
+
+        bucket_key = self.get_index_key(max(from_key, self._index_start_key))
+        while bucket_key <= self._index_end_key:
+            for k,v in self._index[bucket_key].get(col_name, {}).items():
+                if k >= from_key:
+                    yield k,v
+            bucket_key += self._index_spread
+
+    def set_refiner(self, refiner):
+        """ RefineThread that computes full resolution groups for expensive views """
+        self._refiner = refiner
+
+    def get_cache_stats(self):
+        return self._cache.get_stats()
+
+    def get_bucket_count(self):
+        return len(self._index)
+
+    def clear_cache(self):
+        self._cache = Cache()
+        if self._aggregator:
+            self._aggregator.clear_cache()
+
+    def shutdown(self):
+        """ Stop worker processes """
+        if self._aggregator:
+            self._aggregator.shutdown()
+
+    def remove_column(self, col_name):
+        """ Remove all data of column from index """
+        if col_name not in self._columns:
+            return
+
+        self._columns.remove(col_name)
+        for bucket in self._index.values():
+            bucket.pop(col_name, None)
+
+        self._generation += 1
+        self._is_updated = True
+        self._last_update = datetime.datetime.utcnow()
+
+        # free groups that hold points of column
+        self._cache.cleanup(self._last_update)
+
     def reset_index(self):
+        generation = self._generation
         Index.__init__(self, self._index_grow_amount, self._index_spread)
+        self._generation = generation + 1
 
     def insert(self, col_name, k, v):
         """ Find the right bucket and insert point into it """
         ## is a mapping between index keys and buckets
         #self._index = self.build_index(start, self._index_grow_amount, self._index_spread)
+        t_start = time.perf_counter() if metrics.enabled else None
+
         if col_name not in self._columns:
             self._columns.append(col_name)
             logger.debug(f"New column detected: {col_name}")
@@ -283,6 +619,8 @@ class Index():
         # if this is the biggest point yet, save it
         if self._index_max_key == None or k > self._index_max_key:
             self._index_max_key = k
+        elif k < self._index_max_key:
+            self._backfilled += 1
         if self._index_min_key == None or k < self._index_min_key:
             self._index_min_key = k
 
@@ -308,6 +646,66 @@ class Index():
         # used for caching of groups
         self._last_update = datetime.datetime.utcnow()
 
+        if t_start != None:
+            metrics.record('index.insert', time.perf_counter() - t_start)
+            metrics.inc('index.points')
+            metrics.set('index.buckets', len(self._index))
+
+    def insert_many(self, col_name, items):
+        """ Insert list of (key, value) tuples in one go.
+            Index bounds are only checked once for the whole batch """
+        if not items:
+            return
+
+        t_start = time.perf_counter() if metrics.enabled else None
+
+        if col_name not in self._columns:
+            self._columns.append(col_name)
+            logger.debug(f"New column detected: {col_name}")
+
+        k_min = min(k for k,_ in items)
+        k_max = max(k for k,_ in items)
+
+        # create index if not exist
+        if not self._index:
+            self._index_start_key = int(k_min)
+            self._index = self.build_index(self._index_start_key, self._index_grow_amount, self._index_spread)
+            self._index_end_key   = list(self._index)[-1]
+
+        if self._index_max_key != None and k_min < self._index_max_key:
+            self._backfilled += 1
+        if self._index_max_key == None or k_max > self._index_max_key:
+            self._index_max_key = k_max
+        if self._index_min_key == None or k_min < self._index_min_key:
+            self._index_min_key = k_min
+
+        # extend index if necessary
+        if k_max > self._index_end_key:
+            self.extend_index_right(k_max)
+        if k_min < self._index_start_key:
+            self.extend_index_left(k_min)
+
+        # NOTE inlined get_index_key() because this is the hot path for big batches
+        index  = self._index
+        start  = self._index_start_key
+        spread = self._index_spread
+
+        for k,v in items:
+            bucket = index[k - ((k-start) % spread)]
+            col = bucket.get(col_name)
+            if col == None:
+                bucket[col_name] = {k: v}
+            else:
+                col[k] = v
+
+        self._is_updated = True
+        self._last_update = datetime.datetime.utcnow()
+
+        if t_start != None:
+            metrics.record('index.insert_many', time.perf_counter() - t_start)
+            metrics.inc('index.points', len(items))
+            metrics.set('index.buckets', len(self._index))
+
     def get_index_key(self, key):
         """ Calculate index key from any given key that exists in index """
         return key - ((key-self._index_start_key) % self._index_spread)
@@ -344,9 +742,9 @@ class Index():
             logger.error(f"spread > group_size, {self._index_spread} > {group_size}")
             return []
 
-        return self.get_grouped_from_last_data(group_size, amount=amount)
+        return self.get_grouped_from_last_data(group_size, amount=amount, parallel=True)
 
-    def get_grouped_from_last_data(self, group_size, amount, offset=0):
+    def get_grouped_from_last_data(self, group_size, amount, offset=0, parallel=False):
         """ Return groups, starting from last data point """
         if not self.has_data():
             logger.debug("Failed to get groups, no data yet in index")
@@ -354,7 +752,7 @@ class Index():
 
         end_key   = int(self.get_index_key(self._index_max_key))
         end_key -= offset
-        return self.get_grouped(group_size, end_key, amount)
+        return self.get_grouped(group_size, end_key, amount, parallel=parallel)
 
     def get_index_by_key(self, key):
         """ Get index number from self._index identified by key """
@@ -363,21 +761,43 @@ class Index():
         keys, _ = self.get_keys_values(updated=self._is_updated)
         return keys.index(key)
 
-    def get_grouped(self, group_size, end_key, amount):
+    def get_group_bounds(self, group_size, end_key, amount):
+        """ Return list of (start index, end index, count) for groups that end at end_key.
+            Indices are positions in sorted index keys and are negative for groups before start of index """
+        last_i = self.get_index_by_key(end_key)
+
+        # size/span of group in index numbers
+        group_index_size = int(group_size/self._index_spread)
+
+        # calculate at which bin the last group starts
+        # NOTE this group may not be complete yet but we want the data to be displayed anyways
+        last_group_i  = last_i - (last_i % group_index_size)
+        first_group_i = last_group_i - ((amount-1) * group_index_size)
+
+        # last group always contains the last bucket, also when that bucket starts a new group
+        return [(i, i + group_index_size, i / group_index_size) for i in range(first_group_i, last_group_i+1, group_index_size)]
+
+    def get_grouped(self, group_size, end_key, amount, parallel=False, priority='normal'):
         """ Return list of group object that contain data
             Groups have a start and end value that corresponds with the index
             $group_size specifies the key spacing, not index spacing
+            If $parallel is True and an aggregator is set, groups are aggregated by worker processes
+            $priority is 'low' when groups are precomputed in idle time, return None when view is too expensive for that
         """
         # TODO remove start_key, is not used anymore
         # use cache if possible
         metadata = {'end_key'   : end_key,
                     'amount'    : amount,
-                    'group_size': group_size}
+                    'group_size': group_size,
+                    'parallel'  : parallel}
 
-        groups = self._cache.get(metadata, dt=self._last_update)
+        # precomputing shouldn't influence the hit rate of views that are drawn
+        groups = self._cache.get(metadata, dt=self._last_update, count=(priority != 'low'))
         if groups:
             return groups
 
+        t_start = time.perf_counter() if metrics.enabled else None
+
         if (group_size % self._index_spread) != 0:
             raise ValueError(f"Group size {group_size} is not compatible with current index spread {self._index_spread}")
         elif not self.has_data():
@@ -389,47 +809,131 @@ class Index():
         keys, values = self.get_keys_values(updated=self._is_updated)
         
         try:
-            last_i = self.get_index_by_key(end_key)
+            bounds = self.get_group_bounds(group_size, end_key, amount)
         except ValueError:
             print(f"End key ({end_key}) out of index bounds [{self._index_start_key}:{self._index_end_key}]")
             return []
 
-        # size/span of group in index numbers
-        group_index_size = int(group_size/self._index_spread)
+        # expensive views are first drawn from sampled buckets and refined in the background
+        if self._refiner:
+            n_buckets = len(bounds) * int(group_size / self._index_spread)
+            sample = self._refiner.get_sample_rate(n_buckets)
+            if sample > 1:
+                if priority == 'low':
+                    return
+
+                key = (id(self), tuple(metadata.items()))
+                self._refiner.submit(key, n_buckets, lambda job: self.refine(group_size, end_key, amount, parallel, job))
+
+                # result of an earlier refinement of this view is better than sampled data, even if it misses the newest points
+                groups = self._refiner.get_result(key)
+                if groups:
+                    return groups
+
+                # sampled groups are not stored in cache, the cache would hide them from the refiner
+                if self._coarse[0] != (key, self._last_update):
+                    self._coarse = ((key, self._last_update), self.build_groups(keys, values, bounds, sample=sample))
+                    if t_start != None:
+                        metrics.record('index.get_grouped.sampled', time.perf_counter() - t_start)
+                return self._coarse[1]
+
+        if parallel and self.use_aggregator():
+            groups = self.get_aggregator_groups(keys, bounds, group_size)
+            self._cache.add(metadata, groups, priority=priority)
+            if t_start != None:
+                metrics.record('index.get_grouped.parallel', time.perf_counter() - t_start)
+            return groups
 
-        # calculate at which bin the last group starts
-        # NOTE this group may not be complete yet but we want the data to be displayed anyways
-        last_group_i  = last_i - (last_i % group_index_size)
-        first_group_i = last_group_i - (amount * group_index_size)
+        groups = self.build_groups(keys, values, bounds)
+
+        #self.display_groups(groups)
+        self._cache.add(metadata, groups, priority=priority)
+        if t_start != None:
+            metrics.record('index.get_grouped', time.perf_counter() - t_start)
+        return groups
+
+    def refine(self, group_size, end_key, amount, parallel, job):
+        """ Build full resolution groups for RefineThread, is called without holding the global lock.
+            The lock is only held to take references to the buckets in view, copying points into groups is done without it
+            so writers don't wait for the copy. When points were removed meanwhile, the copy may be incomplete and None is returned.
+            Return None when job is cancelled """
+        metadata = {'end_key'   : end_key,
+                    'amount'    : amount,
+                    'group_size': group_size,
+                    'parallel'  : parallel}
+
+        with lock.reading(name='RefineThread'):
+            if not self.has_data():
+                return
 
-        # when there is an unfinished group at the end, make sure the amount is correct
-        if last_i > last_i - (last_i % group_index_size):
-            first_group_i  += group_index_size
+            keys, values = self.get_keys_values(updated=self._is_updated)
+            bounds = self.get_group_bounds(group_size, end_key, amount)
+
+            # aggregator copies the points itself
+            if parallel and self.use_aggregator():
+                return self.get_aggregator_groups(keys, bounds, group_size)
+
+            columns = list(self._columns)
+            generation = self._generation
+            last_update = self._last_update
+
+        t_start = time.perf_counter()
+        groups = self.build_groups(keys, values, bounds, job=job, columns=columns)
+        if groups == None:
+            return
+
+        with lock.reading(name='RefineThread'):
+            if self._generation != generation:
+                logger.debug("Points were removed while refining view, discarding result")
+                return
+
+            # groups may miss points that were added while copying, refiner can use them but cache can't
+            if self._last_update == last_update:
+                self._cache.add(metadata, groups)
+
+        if metrics.enabled:
+            metrics.record('index.refine', time.perf_counter() - t_start)
+        return groups
+
+    def get_aggregator_groups(self, keys, bounds, group_size):
+        """ Let worker processes aggregate groups for bounds that are returned by get_group_bounds() """
+        return self._aggregator.get_grouped([(keys[s], keys[s] + group_size, c) if s >= 0 else (None, None, c) for s,e,c in bounds], group_size,
+                                            self._last_update, (self._generation, self._backfilled), list(self._columns), self.iter_column)
+
+    def build_groups(self, keys, values, bounds, sample=1, job=None, columns=None):
+        """ Create group objects for bounds that are returned by get_group_bounds().
+            If $sample > 1, only every nth bucket is used which gives a fast but coarse result.
+            $columns defaults to all columns in index. Return None when $job is cancelled """
+        if columns == None:
+            columns = self._columns
 
         groups = []
 
         # traverse index $group_size sized steps and take slices for every group
-        for group_start_i in range(first_group_i, last_i, group_index_size):
-            group_end_i = group_start_i + group_index_size
-            count = group_start_i / group_index_size
+        for group_start_i, group_end_i, count in bounds:
+            if job and job.is_cancelled():
+                return
 
             if group_start_i < 0 or group_end_i < 0:
                 groups.append(Group(None, None, {}, count))
             else:
+                # last group may not be complete and end past the last bucket of the index
                 group_start_key = keys[group_start_i]
-                group_end_key   = keys[group_end_i]
-                buckets = values[group_start_i:group_end_i]
+                group_end_key   = group_start_key + (group_end_i - group_start_i) * self._index_spread
+                group_end_i     = min(group_end_i, len(values))
+                buckets = values[group_start_i:group_end_i:sample]
+
+                # always use the last bucket so last values are correct
+                if sample > 1 and (group_end_i - 1 - group_start_i) % sample:
+                    buckets.append(values[group_end_i-1])
 
                 # join data in buckets
-                data = {name : {} for name in self._columns}
+                data = {name : {} for name in columns}
                 for bucket in buckets:
-                    for col in self._columns:
+                    for col in columns:
                         data[col].update(bucket.get(col, {}))
 
                 groups.append(Group(group_start_key, group_end_key, data, count))
-
-        #self.display_groups(groups)
-        self._cache.add(metadata, groups)
         return groups
 
     def display_groups(self, groups):
@@ -450,70 +954,3 @@ class Index():
             logger.debug(f"{str(group.count).rjust(3)} {str(group.start).ljust(12)} {str(group.end).ljust(12)} diff: {t_diff}s")
             #logger.debug(pformat(group.data))
         logger.debug(50*'-')
-
-
-""" Below is for testing only """
-class TestPoint():
-    def __init__(self):
-        self.value = self.get_number()
-
-    def get_number(self, length=5):
-        return round(random.randint(1000,9999))
-
-
-class App():
-    def enumerate2(self, xs, start=0, step=1):
-        for x in xs:
-            yield (start, x)
-            start += step
-
-    def get_string(self, length=5):
-        return "".join([ str(chr(round(random.uniform(65,90)))) for i in range(length)])
-
-    def get_number(self, length=5):
-        return round(random.randint(1000,9999))
-
-    def get_object(self):
-        return TestPoint()
-
-    @timeit
-    def insert_points(self, col_name, index, keys, values):
-        logger.debug(f"Inserting {col_name} {len(keys)} points")
-        for i in range(len(keys)):
-            index.insert(col_name, keys[i], values[i])
-
-    @timeit
-    def run(self):
-        index = Index(100_000, 5)
-
-        amount = 100_000
-        start  = 800
-        step   = 3
-
-        keys   = [i for i in range(start, start+(amount*step), step)] 
-        #values = [self.get_number() for x in range(100_000)]
-        #values = [self.get_string() for x in range(100_000)]
-        values = [self.get_object() for x in range(100_000)]
-
-        self.insert_points('col1', index, keys, values)
-
-        values = [self.get_object() for x in range(100_000)]
-        self.insert_points('col2', index, keys, values)
-        #print(index.get('col1', 833))
-        index.insert('col1', 50, 'BEVER')
-        #print(index.get('col1', 833))
-
-        groups = index.get_grouped_from_end(30, 50000, 5)
-        groups = index.get_grouped_from_end(30, 50000, 5)
-        groups = index.get_grouped_from_start(30, start=3000, amount=4)
-        groups = index.get_grouped_from_start(30, start=3000, amount=500)
-        #for group in groups:
-        #    print(group.get_avg('col1'))
-        #groups = index.get_grouped_from_last_data('col1', 30, amount=3)
-
-        for group in groups:
-            print(group.get_avg('col1', key='value'))
-
-if __name__ == "__main__":
-    app = App()
-    app.run()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+
+from complot.backends import BackendBaseClass
+from complot import metrics
+
+logger = logging.getLogger('complot')
+
+
+class Layer(BackendBaseClass):
+    """ Acts as a backend for one actor and records everything that is drawn on it.
+        When the inputs of the actor didn't change (same signature), the recorded chars are composited
+        on the real backend without running the actor again.
+        Dimensions and offsets are read from the real backend. """
+    def __init__(self, name):
+        self.name = name
+
+        # the real backend, is set on render()
+        self._backend = None
+
+        # recorded draw operations: (method name, args, kwargs)
+        self._ops = []
+
+        # represents the inputs that were used to render this layer
+        self._signature = None
+
+        # stats, used to find expensive actors
+        self.render_time = 0
+        self.renders = 0
+
+        # time spent rendering in current frame, 0 when layer was composited from last render
+        self.frame_time = 0
+        self.composites = 0
+
+    def __getattr__(self, name):
+        """ Read dimensions and offsets from the real backend """
+        backend = self.__dict__.get('_backend')
+        if backend == None:
+            raise AttributeError(name)
+        return getattr(backend, name)
+
+    def is_dirty(self, signature):
+        """ Layer needs to be rendered when its inputs have changed """
+        return self._signature == None or signature != self._signature
+
+    def invalidate(self):
+        self._signature = None
+
+    def render(self, backend, signature, draw, *args):
+        """ Run draw callback that draws on this layer, save signature that represents the inputs of callback """
+        self._backend = backend
+        self._ops = []
+
+        t_start = time.perf_counter()
+        draw(self, *args)
+        self.render_time = time.perf_counter() - t_start
+        self.renders += 1
+        metrics.record(f"draw.{self.name}", self.render_time)
+
+        self._signature = signature
+
+    def set_char(self, x, y, char, **kwargs):
+        self._ops.append(('set_char', (x, y, char), kwargs))
+
+    def put_char(self, x, y, char, fg_color, bg_color, reverse=False, dim=False):
+        self._ops.append(('put_char', (x, y, char, fg_color, bg_color), {'reverse': reverse, 'dim': dim}))
+
+    def get_char(self, x, y):
+        return self._backend.get_char(x, y)
+
+    def refresh(self):
+        """ Layers are shown by compositing them on the real backend """
+        pass
+
+    def clear(self):
+        self._ops = []
+
+    def draw_horizontal_line(self, y, *args, **kwargs):
+        # this depends on chars that are drawn by other layers so it's executed when compositing
+        self._ops.append(('draw_horizontal_line', (y,) + args, kwargs))
+
+    def composite(self, backend):
+        """ Draw recorded operations on backend """
+        for method, args, kwargs in self._ops:
+            if method == 'set_char':
+                backend.set_char(*args, **kwargs)
+            else:
+                getattr(backend, method)(*args, **kwargs)
+        self.composites += 1
+
+    def get_size(self):
+        """ Amount of recorded operations """
+        return len(self._ops)
+
+
+class Compositor():
+    """ Holds all layers of a plot and composites them on the backend in the order they were drawn """
+    def __init__(self):
+        self._layers = {}
+
+        # names of layers in the order they're composited in the current frame
+        self._frame = []
+
+    def get_layer(self, name):
+        if name not in self._layers:
+            self._layers[name] = Layer(name)
+        return self._layers[name]
+
+    def get_layers(self):
+        """ Return layers that are part of last frame """
+        return [self._layers[name] for name in self._frame]
+
+    def invalidate(self):
+        """ Force rendering of all layers in next frame """
+        for layer in self._layers.values():
+            layer.invalidate()
+
+    def start_frame(self):
+        self._frame = []
+
+    def draw(self, backend, name, signature, draw, *args):
+        """ Add layer to frame, only render layer if signature changed """
+        layer = self.get_layer(name)
+        if layer.is_dirty(signature):
+            layer.render(backend, signature, draw, *args)
+            layer.frame_time = layer.render_time
+        else:
+            layer.frame_time = 0
+        self._frame.append(name)
+
+    def composite(self, backend):
+        """ Draw all layers of this frame on backend and remove layers that are not used anymore """
+        for name in self._frame:
+            self._layers[name].composite(backend)
+
+        for name in [name for name in self._layers if name not in self._frame]:
+            del self._layers[name]
@@ -39,15 +39,17 @@ class LineBaseClass():
         self.char   = char
         self.icon   = char
         self.color  = next(Line.colors) if not color else color
-        self.name   = "".join([ str(chr(round(random.uniform(65,90)))) for i in range(10)]) if not name else name
+        self._random_name = "".join([ str(chr(round(random.uniform(65,90)))) for i in range(10)]) if not name else None
+        self.name   = self._random_name if not name else name
         self._is_enabled = enabled
         self._default_enabled = enabled
 
         # if enabled, line will not show in legend and last values
         self._hidden = hidden
 
-        # holds point objects belonging to this line
-        self._points = []
+        # points are held by the index, line only keeps count and the last added point
+        self._point_count = 0
+        self._last_point = None
 
         # Data() object stores all data. bins that represent one column are retrieved by using the get_bins() method
         # they represent one column in matrix
@@ -56,13 +58,43 @@ class LineBaseClass():
         # indicate if new data is available
         self._is_updated = False
 
+        # set by plot when frames are over budget, expensive lines will skip work
+        self._degraded = False
+
+        # FrameScheduler of plot, is notified when new data is added
+        self._scheduler = None
+
+        # when plot has ingestion enabled, points are buffered and added to the index in batches by IngestThread
+        self._ingester = None
+
+        # when plot is recording, added points are written to a Recorder so they can be replayed
+        self._recorder = None
+
+        # when plot has a store, added points are persisted so they're loaded again on restart, see complot.store
+        self._store = None
+
+        # incremented on every change so plot knows when this line needs to be drawn again
+        self._version = 0
+
         LineBaseClass.counter += 1
         self._line_number = LineBaseClass.counter
 
+    def has_name(self):
+        """ False when line still has the random name it got because no name was given """
+        return self.name != self._random_name
+
     def is_hidden(self):
         """ Don't show line in legend et al """
         return self._hidden
 
+    def get_version(self):
+        """ Changes when line data changes """
+        return self._version
+
+    def set_degraded(self, state):
+        """ When plot can't keep up with its frame rate, skip expensive drawing """
+        self._degraded = state
+
     def toggle_enabled(self):
         self._is_enabled = not self._is_enabled
 
@@ -83,15 +115,43 @@ class LineBaseClass():
         """ Add the Bins object to line object so Line can access indexed data, this is done in the Plot.add_line() method """
         self._data = data
 
+    def set_scheduler(self, scheduler):
+        """ Plot scheduler is notified on new data so the plot is redrawn immediately, this is done in the Plot.add_line() method """
+        self._scheduler = scheduler
+
+    def set_ingester(self, ingester):
+        """ Buffer new points in ingester instead of adding them directly, this is done in the Plot.add_line() method """
+        self._ingester = ingester
+
+    def set_recorder(self, recorder):
+        """ Record new points, this is done by Recorder.add_line() """
+        self._recorder = recorder
+
+    def set_store(self, store):
+        """ Persist new points, this is done by Store.add_line() """
+        self._store = store
+
+    def request_frame(self):
+        if self._scheduler:
+            self._scheduler.request('data')
+
     def reset(self):
         """ Reset line data """
-        self._points = []
+        self._point_count = 0
+        self._last_point = None
         self._is_updated = True
+        self._version += 1
         self.set_default_enabled()
 
     def is_populated(self):
         """ Check if points exist in this line """
-        return len(self._points)
+        return self._point_count
+
+    def get_point_count(self):
+        return self._point_count
+
+    def get_last_point(self):
+        return self._last_point
 
     def is_updated(self):
         """ Check updated flag, is set in add_point() method """
@@ -193,29 +253,73 @@ class LineBaseClass():
         # Convert the 0-1 range into a value in the right range.
         return b_min + (value_scaled * b_span)
 
+    def make_point(self, x, y, name=None):
+        return Point(x, y, self, name=name)
+
     def add_point(self, x, y, name=None):
         """ Add point to line, this will trigger a Plot.draw() action by UpdateThread """
-        lock.wait_for_lock(name='add_point')
+        if self._recorder:
+            self._recorder.record(self, (x, y, name))
+        if self._store:
+            self._store.append(self, [(x, y, name)])
+
+        if self._ingester:
+            self._ingester.put(self, (x, y, name))
+            return
+
+        with lock.writing(name='add_point'):
+            point = self.make_point(x, y, name=name)
+
+            self._point_count += 1
+            self._last_point = point
+            self._data.add_point(point)
 
-        point = Point(x, y, self, name=name)
+            # set new data flag
+            self._is_updated = True
+            self._version += 1
 
-        self._points.append(point)
-        self._data.add_point(point)
+        self.request_frame()
+
+        if self._point_count % 500 == 0:
+            logger.debug(f"[{self.name}] Processed {self._point_count} points")
+
+    def add_points(self, rows):
+        """ Add list of points to line in one go, rows are tuples containing the add_point() arguments """
+        if self._recorder:
+            self._recorder.record_many(self, rows)
+        if self._store:
+            self._store.append(self, rows)
+
+        with lock.writing(name='add_points'):
+            self.insert_rows(rows)
+
+        self.request_frame()
+
+    def insert_rows(self, rows, is_history=False):
+        """ Create points from rows and add them to the index, caller must hold the write lock.
+            When $is_history is True, rows are older than the points that were already added """
+        points = [self.make_point(*row) for row in rows]
+        if not points:
+            return
+
+        self._point_count += len(points)
+        if not is_history or self._last_point == None:
+            self._last_point = points[-1]
+        self._data.add_points(points)
 
         # set new data flag
         self._is_updated = True
+        self._version += 1
 
-        lock.release_lock()
-
-        if len(self._points) % 500 == 0:
-            logger.debug(f"[{self.name}] Processed {len(self._points)} points")
+        if self._point_count // 500 != (self._point_count - len(points)) // 500:
+            logger.debug(f"[{self.name}] Processed {self._point_count} points")
 
     def get_last_value(self):
         """ used by LastValues actor to display last values """
-        if not len(self._points):
+        if self._last_point == None:
             return {}
 
-        return self._points[-1].get_values()
+        return self._last_point.get_values()
 
 
 class Line(LineBaseClass):
@@ -240,7 +344,8 @@ class Line(LineBaseClass):
             # scale b1_y to plot rows
             y1 = self.get_scaled_y(b1_y, y_min, y_max, backend.get_plot_rows())
 
-            if not self._interpolate:
+            # interpolation is skipped when plot is degraded
+            if not self._interpolate or self._degraded:
                 if backend.is_in_plot_area(y1):
                     backend.set_point_in_plot(x1, y1, self.char, fg_color=self.color)
                 continue
@@ -306,6 +411,9 @@ class CurrentValueLine(LineBaseClass):
     def is_populated(self):
         return True
 
+    def get_version(self):
+        return (self._version, self._line.get_version())
+
     def draw(self, backend, data, y_min, y_max):
         bins = data.get_bins(1, offset=0)
 
@@ -345,12 +453,15 @@ class HorizontalLine(LineBaseClass):
 
     def set_y(self, y):
         self._y = float(y)
+        self._version += 1
 
     def move_up(self, step):
         self._y += step
+        self._version += 1
 
     def move_down(self, step):
         self._y -= step
+        self._version += 1
 
     def draw(self, backend, bin_containers, y_min, y_max):
         if self._y == None:
@@ -376,6 +487,9 @@ class PeaksDetect(LineBaseClass):
     def is_populated(self):
         return True
 
+    def get_version(self):
+        return (self._version, self._line.get_version())
+
     def find_peaks(self, bins, line=None, smoothing=5):
         """ Find peaks and valleys in denoised data.
             To denoise data a savgol filter is used.
@@ -450,6 +564,10 @@ class PeaksDetect(LineBaseClass):
         return peaks, valleys, ys_filtered
 
     def draw(self, backend, data, y_min, y_max):
+        # finding peaks is expensive, skip when plot is degraded
+        if self._degraded:
+            return
+
         # find and draw peaks
         peaks, valleys, smooth = self.find_peaks(data.get_bins(backend.get_plot_cols()),
                                                  line = self._line,
@@ -514,21 +632,35 @@ class CandleStickLine(LineBaseClass):
         self._char_upper_half = '▀'
         self._char_lower_half = '▄'
 
+    def make_point(self, x, Open, High, Low, Close):
+        return CandleStickPoint(x, Open, High, Low, Close, self)
+
     def add_point(self, x, Open, High, Low, Close):
         """ Add point to line, this will trigger an action in watch thread """
-        lock.wait_for_lock(name='CandleStickLine')
+        if self._recorder:
+            self._recorder.record(self, (x, Open, High, Low, Close))
+        if self._store:
+            self._store.append(self, [(x, Open, High, Low, Close)])
 
-        point = CandleStickPoint(x, Open, High, Low, Close, self)
+        if self._ingester:
+            self._ingester.put(self, (x, Open, High, Low, Close))
+            return
 
-        self._points.append(point)
-        self._data.add_point(point)
+        with lock.writing(name='CandleStickLine'):
+            point = self.make_point(x, Open, High, Low, Close)
 
-        # set new data flag
-        self._is_updated = True
-        lock.release_lock()
+            self._point_count += 1
+            self._last_point = point
+            self._data.add_point(point)
+
+            # set new data flag
+            self._is_updated = True
+            self._version += 1
+
+        self.request_frame()
 
-        if len(self._points) % 500 == 0:
-            logger.debug(f"[{self.name}] Processed {len(self._points)} points")
+        if self._point_count % 500 == 0:
+            logger.debug(f"[{self.name}] Processed {self._point_count} points")
 
     def draw(self, backend, data, y_min, y_max):
         for x,b in enumerate(data.get_bins(backend.get_plot_cols())):
@@ -602,6 +734,10 @@ class PointBaseClass():
 
 
 class Point(PointBaseClass):
+    # numeric attributes, and attributes that return one of them, used when points are aggregated
+    fields = ('y',)
+    aliases = {'value': 'y', 'min': 'y', 'max': 'y', 'high': 'y'}
+
     def __init__(self, x, y, line, name=None):
         PointBaseClass.__init__(self, x, line)
         self.y = y
@@ -630,6 +766,9 @@ class Point(PointBaseClass):
 
 
 class CandleStickPoint(PointBaseClass):
+    fields = ('open', 'high', 'low', 'close')
+    aliases = {'value': 'close', 'min': 'low', 'max': 'high'}
+
     def __init__(self, x, Open, High, Low, Close, line):
         PointBaseClass.__init__(self, x, line)
         self.y = None
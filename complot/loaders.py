@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import time
+import logging
+import datetime
+
+logger = logging.getLogger('complot')
+
+# formats that are tried when a key is not in ISO format, eg. 2021-2-09 10:23:59.999000+00:00 or 01/02/2021 15:45
+KEY_FORMATS = ['%Y-%m-%d %H:%M:%S.%f%z', '%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d',
+               '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d']
+
+
+def parse_key(value):
+    """ Convert key to datetime, or to float when it isn't a date.
+        Datetimes without timezone are UTC, like pandas does when parsing dates """
+    try:
+        # fast path, the Datetime column of our csv files: 2021-01-01 00:00:59.999000+00:00
+        dt = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        for fmt in KEY_FORMATS:
+            try:
+                dt = datetime.datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return float(value)
+
+    if dt.tzinfo == None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+def parse_value(value):
+    """ Empty fields and fields that aren't numbers are None """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class Chunk():
+    """ Rows that were parsed in one go, values are stored per column """
+    def __init__(self, keys, columns):
+        self.keys = keys
+
+        # {column name: [float or None, ...]}
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_rows(self, columns):
+        """ Return list of (key, value, ...) for $columns, rows that miss a value are skipped.
+            Rows can be passed to Line.add_points() """
+        if any(col not in self.columns for col in columns):
+            return []
+        values = [self.columns[col] for col in columns]
+        return [row for row in zip(self.keys, *values) if None not in row]
+
+
+class CSVLoader():
+    """ Reads a csv file in chunks of $chunk_size rows so big files are loaded with bounded memory,
+        and data can be shown after the first chunk.
+        The position in file is remembered, reading again only returns rows that were appended since.
+        A line that doesn't end with a newline is still being written and is read next time.
+        The key column $index_col is parsed with parse_key(), other columns with parse_value() """
+    def __init__(self, path, index_col='Datetime', chunk_size=10_000):
+        self.path = path
+        self._index_col = index_col
+        self._chunk_size = chunk_size
+
+        # header, is read on first call to read_chunks()
+        self._columns = None
+        self._key_i = None
+
+        # byte offset of first line that is not read yet
+        self._offset = 0
+
+        # stats
+        self.rows = 0
+        self.chunks = 0
+        self.errors = 0
+        self.parse_time = 0
+
+    def get_columns(self):
+        """ Return column names without key column, None if header isn't read yet """
+        if self._columns == None:
+            return
+        return [col for i,col in enumerate(self._columns) if i != self._key_i]
+
+    def reset(self):
+        self._columns = None
+        self._key_i = None
+        self._offset = 0
+
+    def read_header(self, f):
+        line = f.readline()
+        if not line.endswith(b'\n'):
+            return False
+
+        self._columns = next(csv.reader([line.decode()]))
+        if self._index_col not in self._columns:
+            raise ValueError(f"No {self._index_col} column in: {self.path}")
+
+        self._key_i = self._columns.index(self._index_col)
+        self._offset = len(line)
+        return True
+
+    def split(self, line):
+        """ Split line in fields, only lines with quotes need the csv module """
+        if '"' in line:
+            return next(csv.reader([line]))
+        return line.rstrip('\r\n').split(',')
+
+    def parse(self, lines):
+        """ Parse list of lines into a Chunk """
+        names = self.get_columns()
+        n_fields = len(self._columns)
+        key_i = self._key_i
+
+        keys = []
+        columns = [[] for _ in names]
+        for line in lines:
+            fields = self.split(line.decode())
+            if len(fields) != n_fields:
+                self.errors += 1
+                continue
+
+            try:
+                k = parse_key(fields.pop(key_i))
+            except ValueError:
+                self.errors += 1
+                continue
+
+            keys.append(k)
+            for col, value in zip(columns, fields):
+                col.append(parse_value(value))
+
+        return Chunk(keys, dict(zip(names, columns)))
+
+    def read_chunks(self):
+        """ Yield Chunks of rows that were appended since last call """
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"File doesn't exist: {self.path}")
+
+        # file was replaced by a shorter one, start over
+        if os.path.getsize(self.path) < self._offset:
+            logger.debug(f"File was truncated, reading from start: {self.path}")
+            self.reset()
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            if self._columns == None and not self.read_header(f):
+                return
+
+            while True:
+                lines = []
+                size = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    size += len(line)
+                    if line.strip():
+                        lines.append(line)
+                    if len(lines) >= self._chunk_size:
+                        break
+
+                if not lines:
+                    self._offset += size
+                    return
+
+                t_start = time.perf_counter()
+                chunk = self.parse(lines)
+                self.parse_time += time.perf_counter() - t_start
+                self._offset += size
+
+                self.rows += len(chunk)
+                self.chunks += 1
+                yield chunk
+
+                # iterating may have stopped at a line that is still being written, seek back so it's read again
+                f.seek(self._offset)
+
+    def get_stats(self):
+        return { 'rows'       : self.rows,
+                 'chunks'     : self.chunks,
+                 'errors'     : self.errors,
+                 'offset'     : self._offset,
+                 'parse time' : self.parse_time }
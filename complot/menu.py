@@ -43,11 +43,12 @@ class MenuItemBaseClass():
 
 class OptionsMenuItem(MenuItemBaseClass):
     """ Menu item that holds a defined set op options """
-    def __init__(self, win, *args, default=None, options=None, **kwargs):
+    def __init__(self, win, *args, default=None, options=None, backend=None, **kwargs):
         MenuItemBaseClass.__init__(self, *args, **kwargs)
         self.options = options if options != None else []
         self.choice = None
         self.win = win
+        self.backend = backend
         self.default = default
 
         # update name and status field lengths used for justifying the output of __str__
@@ -71,7 +72,7 @@ class OptionsMenuItem(MenuItemBaseClass):
             return self.choice.menu_entry
 
     def on_activated(self):
-        menu = Menu(self.win)
+        menu = Menu(self.win, backend=self.backend)
         choice = menu.run(self.options)
         if choice in self.options:
             self.choice = choice
@@ -101,11 +102,12 @@ class OptionsMenuItem(MenuItemBaseClass):
 
 
 class EditableMenuItem(MenuItemBaseClass):
-    def __init__(self, win, *args, dtype=int, default=None, **kwargs):
+    def __init__(self, win, *args, dtype=int, default=None, backend=None, **kwargs):
         MenuItemBaseClass.__init__(self, *args, **kwargs)
         self._state = default
         self.default = default
         self.win = win
+        self.backend = backend
         self._dtype = dtype
 
         # update name and status field lengths used for justifying the output of __str__
@@ -126,7 +128,7 @@ class EditableMenuItem(MenuItemBaseClass):
         self.default = default
 
     def on_activated(self):
-        menu = Menu(self.win)
+        menu = Menu(self.win, backend=self.backend)
         state = menu.input_mode(self.name)
         if state == None:
             return
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import time
+import json
+import logging
+import threading
+import functools
+from contextlib import nullcontext
+
+from complot.utils import Histogram
+
+logger = logging.getLogger('complot')
+
+
+class Counter():
+    """ Value that only goes up, eg. amount of inserted points, is increased from different threads """
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def get_stats(self):
+        return self.value
+
+
+class Gauge():
+    """ Value that can go up and down, eg. size of index """
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get_stats(self):
+        return self.value
+
+
+class MetricTimer():
+    """ Context manager that records the time spent in its block in a histogram """
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._t_start = None
+
+    def __enter__(self):
+        self._t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.record(time.perf_counter() - self._t_start)
+
+
+class Metrics():
+    """ Registry of counters, gauges and latency histograms that instrument the hot paths.
+        Metrics are created on first use and identified by a dotted name, eg. 'index.insert'.
+        Recording is disabled by default. Instrumented code checks self.enabled before doing anything,
+        so when disabled the cost is one attribute lookup per call. Counters and histograms have a lock
+        that is only taken when a value is recorded, so it costs nothing when disabled.
+        Latencies are recorded in seconds. """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+        # metrics are created from different threads
+        self._lock = threading.Lock()
+
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+        self._null_timer = nullcontext()
+
+    def set_enabled(self, state):
+        logger.debug(f"Metrics {'enabled' if state else 'disabled'}")
+        self.enabled = state
+
+    def is_enabled(self):
+        return self.enabled
+
+    def get_metric(self, metrics, name, cls):
+        metric = metrics.get(name)
+        if metric == None:
+            with self._lock:
+                metric = metrics.setdefault(name, cls())
+        return metric
+
+    def counter(self, name):
+        return self.get_metric(self._counters, name, Counter)
+
+    def gauge(self, name):
+        return self.get_metric(self._gauges, name, Gauge)
+
+    def histogram(self, name):
+        return self.get_metric(self._histograms, name, Histogram)
+
+    def inc(self, name, amount=1):
+        if self.enabled:
+            self.counter(name).inc(amount)
+
+    def set(self, name, value):
+        if self.enabled:
+            self.gauge(name).set(value)
+
+    def record(self, name, value):
+        if self.enabled:
+            self.histogram(name).record(value)
+
+    def timer(self, name):
+        """ Return context manager that records the time spent in its block """
+        if not self.enabled:
+            return self._null_timer
+        return MetricTimer(self.histogram(name))
+
+    def timed(self, name=None):
+        """ Decorator that records execution time of function, name defaults to function name """
+        def decorator(func):
+            metric_name = name if name else func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                t_start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.histogram(metric_name).record(time.perf_counter() - t_start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+
+    def get_stats(self, prefix=None):
+        """ Return all metrics, optionally only the ones that start with $prefix """
+        def select(metrics):
+            return { name : metric.get_stats() for name, metric in sorted(metrics.items()) if prefix == None or name.startswith(prefix) }
+
+        with self._lock:
+            return { 'counters'   : select(self._counters),
+                     'gauges'     : select(self._gauges),
+                     'histograms' : select(self._histograms) }
+
+    def dump(self, path=None):
+        """ Return metrics as JSON string, write to file if $path is given """
+        out = json.dumps(self.get_stats(), indent=4)
+        if path:
+            with open(path, 'w') as f:
+                f.write(out)
+            logger.debug(f"Wrote metrics to: {path}")
+        return out
+
+
+# global registry, is also available as complot.metrics
+metrics = Metrics()
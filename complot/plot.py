@@ -10,20 +10,28 @@ import curses
 import traceback
 from queue import Queue
 import threading
+import asyncio
+import signal
 from dataclasses import dataclass
 
-from complot.actors import Grid, Legend, StatusLine, LastValues
+from complot.actors import Grid, Legend, StatusLine, LastValues, Hud
 from complot.lines import Line, CandleStickLine
 from complot.axis import VerticalAxis, HorizontalDatetimeAxis, HorizontalAxis
 from complot.data import Data
-from complot.threads import WatchThread, ListenInputThread, UpdateThread
+from complot.threads import WatchThread, ListenInputThread, UpdateThread, IngestThread, RefineThread, StoreLoadThread
 from complot.user_input import InputCallbacks
 from complot.menu import Menu, OptionsMenuItem, ToggleMenuItem, MenuItem, MenuItemBaseClass, EditableMenuItem
-from complot.backends import CursesBackend
+from complot.backends import CursesBackend, AnsiBackend, HeadlessBackend
+from complot.scheduler import FrameScheduler
+from complot.layers import Compositor
+from complot.sources import Source, SourceScheduler
+from complot.recorder import Recorder
+from complot.store import Store
+from complot.utils import format_ms, format_bytes, get_memory_usage
 
 
 # import global lock
-from complot import lock
+from complot import lock, terminal_lock, metrics, profiler
 
 logger = logging.getLogger('complot')
 
@@ -33,22 +41,35 @@ logger = logging.getLogger('complot')
 #      this would need unicode half blocks with wicks as well, and i don't think they exist
 # TODO index spread should maybe adaptable or something
 
-# NOTE watch thread and line.add_point are the only ways to change datastructures, they use a Lock class
+# NOTE line.add_point is the only way to change datastructures, it holds the write side of the global reader/writer lock
+#      while rendering holds the read side
 
 class Plot(InputCallbacks):
     """ Stores all objects and coordinates drawing of plot """
     def __init__(self, stdscr, window=None, bin_window=None, left_decimals=2, right_decimals=2, paused=False, fit_all=False,
                  autorange_left_y=True, autorange_right_y=True, x_pan_steps=10, show_grid=True, show_legend=True, show_statusline=True, show_last_values=True,
-                 x_axis_type='datetime', x_decimals=1):
+                 x_axis_type='datetime', x_decimals=1, backend='curses', max_fps=20,
+                 ingest=False, ingest_latency=0.05, ingest_buffer=100_000, ingest_policy='block', source_workers=8,
+                 fit_all_workers=None, progressive=False, precompute=True, show_hud=False, record=None,
+                 index_class=None, index_options=None, store=None):
+
+        # drawing backend, 'ansi' writes directly to the tty and only sends changed cells
+        # 'headless' renders like 'ansi' without a terminal, use it with a HeadlessScreen
+        if backend == 'ansi':
+            self._backend = AnsiBackend(stdscr)
+        elif backend == 'headless':
+            self._backend = HeadlessBackend(stdscr)
+        else:
+            self._backend = CursesBackend(stdscr)
 
-        # drawing backend
-        self._backend = CursesBackend(stdscr)
+        # all redraws go through the scheduler so bursts of updates are coalesced into max_fps frames per second
+        self._scheduler = FrameScheduler(max_fps=max_fps)
 
         # handles callbacks and changing of state when keys are pressed. Can also change state through menu.
-        self._menu = Menu(stdscr, refresh_callback=self.draw)
+        self._menu = Menu(stdscr, refresh_callback=self.redraw, backend=self._backend)
 
         if x_axis_type == 'datetime':
-            zoom_menu = OptionsMenuItem(stdscr, 'X zoom unit', default='Minutes', buttons=[ord('z')], button_name='z')
+            zoom_menu = OptionsMenuItem(stdscr, 'X zoom unit', default='Minutes', buttons=[ord('z')], button_name='z', backend=self._backend)
             zoom_menu.add_option(MenuItem('Seconds', state=self.get_td_timestamp(datetime.timedelta(seconds=1)), buttons=[ord('S')], button_name='S'))
             zoom_menu.add_option(MenuItem('Minutes', state=self.get_td_timestamp(datetime.timedelta(minutes=1)), buttons=[ord('M')], button_name='M'))
             zoom_menu.add_option(MenuItem('Hours',   state=self.get_td_timestamp(datetime.timedelta(hours=1)),   buttons=[ord('U')], button_name='U'))
@@ -56,9 +77,9 @@ class Plot(InputCallbacks):
             zoom_menu.reset()
             self._menu.add_item(zoom_menu)
         else:
-            self._menu.add_item(EditableMenuItem(stdscr, 'X zoom unit', default=0.1, dtype=float, buttons=[ord('e')], button_name='e'))
+            self._menu.add_item(EditableMenuItem(stdscr, 'X zoom unit', default=0.1, dtype=float, buttons=[ord('e')], button_name='e', backend=self._backend))
 
-        self._menu.add_item(EditableMenuItem(stdscr, 'X pan steps', default=x_pan_steps,  buttons=[ord('e')], button_name='e'))
+        self._menu.add_item(EditableMenuItem(stdscr, 'X pan steps', default=x_pan_steps,  buttons=[ord('e')], button_name='e', backend=self._backend))
 
         self._menu.add_item(MenuItem('X zoom in',  callback=self.zoom_x,   buttons=[ord('L')], button_name='L'))
         self._menu.add_item(MenuItem('X zoom out', callback=self.unzoom_x, buttons=[ord('H')], button_name='H'))
@@ -76,9 +97,14 @@ class Plot(InputCallbacks):
         self._menu.add_item(ToggleMenuItem('Show grid',        default=show_grid,        buttons=[ord('g')], button_name='g'))
         self._menu.add_item(ToggleMenuItem('Show last values', default=show_last_values, buttons=[ord('v')], button_name='v'))
         self._menu.add_item(ToggleMenuItem('Show statusline',  default=show_statusline,  buttons=[ord('s')], button_name='s'))
+        self._menu.add_item(ToggleMenuItem('Show HUD',         default=show_hud,         buttons=[ord('o')], button_name='o'))
 
         self._menu.add_item(MenuItem('Show log',    callback=self.show_log,    buttons=[ord('x')], button_name='x'))
         self._menu.add_item(MenuItem('Show status', callback=self.show_status, buttons=[ord('?')], button_name='?'))
+        self._menu.add_item(ToggleMenuItem('Lock stats', callback=self.toggle_lock_stats, default=False))
+        self._menu.add_item(ToggleMenuItem('Metrics',    callback=self.toggle_metrics,    default=metrics.is_enabled()))
+        self._menu.add_item(MenuItem('Dump metrics',     callback=self.dump_metrics))
+        self._menu.add_item(MenuItem('Profile',          callback=self.start_profile, buttons=[ord('p')], button_name='p'))
         self._menu.add_item(MenuItem('Draw line',   callback=self.draw_line,   buttons=[ord('d')], button_name='d'))
 
         self._menu.add_item(ToggleMenuItem('Paused', callback=self.pause, default=False, buttons=[ord(' ')], button_name='SPACE'))
@@ -105,7 +131,24 @@ class Plot(InputCallbacks):
 
         # create Data object and set initial screen width
         # this object holds all the bins that represent screen cols
-        self._data = Data()
+        # when fit_all_workers is set, fit all is aggregated in parallel by worker processes
+        # index_class can be any implementation of IndexBaseClass, see complot.indexer, index_options are passed to it
+        self._fit_all_workers = fit_all_workers
+        self._index_class = index_class
+        self._index_options = index_options
+        self._data = Data(workers=fit_all_workers, index_class=index_class, index_options=index_options)
+
+        # when drawing a view takes longer than a frame, draw it from sampled data first and refine it in the background
+        # off by default, sampled frames are not exact
+        self._refine_thread = None
+        if progressive:
+            self._refine_thread = RefineThread(callback=lambda: self._scheduler.request('refine'), budget=self._scheduler.get_frame_budget())
+            self._refine_thread.start()
+            self._data.set_refiner(self._refine_thread)
+
+        # when idle, build groups for the views that are one pan or zoom step away so keys are handled from cache
+        self._precompute = precompute
+        self._precompute_pending = False
 
         # create x axis
         if x_axis_type == 'datetime':
@@ -136,20 +179,55 @@ class Plot(InputCallbacks):
         self._legend       = Legend()
         self._last_values  = LastValues()
         self._status_line  = StatusLine()
+        self._hud          = Hud()
+
+        # composites the layers that are drawn by actors
+        self._compositor = Compositor()
 
         # hold a copy of all line objects
         self._lines = []
+        self._orientations = {}
 
         # watch for new data and call self.draw()
         self._watch_thread = WatchThread(self)
 
         # listen to queue for user input events
         self.event_queue = Queue()
-        self._input_thread = ListenInputThread(stdscr, self._menu_items, self.event_queue)
+        self._input_thread = ListenInputThread(stdscr, self._menu_items, self.event_queue, callback=self._scheduler.notify)
+        self._backend.set_input_thread(self._input_thread)
+
+        # when enabled, line.add_point() only buffers the point and this thread adds points to the index in batches
+        self._ingest_thread = None
+        if ingest:
+            self._ingest_thread = IngestThread(max_latency=ingest_latency, max_size=ingest_buffer, policy=ingest_policy)
+            self._ingest_thread.start()
+
+        # runs data sources that are added with add_source(), is started when first source is added
+        self._source_scheduler = SourceScheduler(max_workers=source_workers)
+
+        # set by stop_workers(), threads can only be started once so plot can't be started or fed by sources anymore
+        self._workers_stopped = False
+
+        # when recording, all points that are added to lines are written to file so they can be replayed, see complot.recorder
+        self._recorder = None
+        if record:
+            self.start_recording(record)
+
+        # when a store is opened, points of lines are persisted and loaded again when a line with the same name is added, see complot.store
+        # older stored points are loaded in the background by StoreLoadThread
+        self._store = None
+        self._store_loader = None
+
+        # {line: key of newest stored point when line was loaded from store}, new points don't change it
+        self._stored_last_keys = {}
+        if store:
+            self.open_store(store)
 
     def reset_data(self):
         """ Reset all lines, points and bins """
-        self._data = Data()
+        self._data.shutdown()
+        self._data = Data(workers=self._fit_all_workers, index_class=self._index_class, index_options=self._index_options)
+        self._data.set_refiner(self._refine_thread)
         self._data.set_bin_window(self._state_x_bin_window)
 
         for line in self._lines:
@@ -165,6 +243,8 @@ class Plot(InputCallbacks):
         """ Create a new line object """
         # create and return a line object
         line.set_data_obj(self._data)
+        line.set_scheduler(self._scheduler)
+        line.set_ingester(self._ingest_thread)
 
         # x axis contains all lines because the axis is shared
         self._x_axis.add_line(line)
@@ -177,14 +257,128 @@ class Plot(InputCallbacks):
         self._legend.add_line(line, orientation)
         self._last_values.add_line(line, orientation)
         self._lines.append(line)
+        self._orientations[line] = orientation
+
+        if self._recorder:
+            self._recorder.add_line(line, orientation)
+        if self._store:
+            self.load_from_store(line)
         return line
 
+    def open_store(self, path):
+        """ Persist points of all lines in directory $path, points that are already stored are loaded into lines """
+        self.close_store()
+        self._store = Store(path)
+        self._store_loader = StoreLoadThread(self._store)
+        self._store_loader.start()
+        for line in self._lines:
+            self.load_from_store(line)
+
+    def close_store(self):
+        if self._store:
+            self._store_loader.stop()
+            self._store_loader.join()
+            self._store_loader = None
+            for line in self._lines:
+                line.set_store(None)
+            self._store.close()
+            self._store = None
+            self._stored_last_keys = {}
+
+    def load_from_store(self, line):
+        """ Add stored points to line, they're not stored or recorded again.
+            Only the newest points are added before returning so the first frame can be drawn right away """
+        count = self._store.add_line(line)
+        self._stored_last_keys[line] = self._store.get_last_key(line.name) if count else None
+        if not count:
+            return
+
+        start = max(0, count - self._store_loader.chunk_size)
+        rows = self._store.load(line, start, count)
+        with lock.writing(name='load_from_store'):
+            line.insert_rows(rows)
+        line.request_frame()
+
+        logger.debug(f"[{line.name}] Loaded {len(rows)} of {count} stored points")
+        if start:
+            self._store_loader.load(line, start)
+
+    def wait_for_store(self, timeout=None):
+        """ Block until all stored points are loaded into lines, return False on timeout """
+        if self._store_loader:
+            return self._store_loader.wait(timeout=timeout)
+        return True
+
+    def get_stored_last_key(self, line):
+        """ Return key of newest point that was stored when line was loaded from store, so caller only has to fetch newer data.
+            Points that are added after that don't change it, so data that is fetched in parts can be compared against it """
+        return self._stored_last_keys.get(line)
+
+    def start_recording(self, path):
+        """ Record points of all lines to file at $path """
+        self.stop_recording()
+        self._recorder = Recorder(path)
+        for line in self._lines:
+            self._recorder.add_line(line, self._orientations[line])
+
+    def stop_recording(self):
+        if self._recorder:
+            self._recorder.close()
+            for line in self._lines:
+                line.set_recorder(None)
+            self._recorder = None
+
+    def add_source(self, callback, interval, lines, name=None, jitter=0.1):
+        """ Run callback every $interval seconds to get new data for line(s), see Source() for return values """
+        self.check_workers('add source')
+        if not self._source_scheduler.is_alive():
+            self._source_scheduler.start()
+        return self._source_scheduler.add_source(Source(callback, interval, lines, name=name, jitter=jitter))
+
+    def remove_source(self, source):
+        self._source_scheduler.remove_source(source)
+
+    def check_workers(self, action):
+        """ Raise RuntimeError when stop_workers() was called, stopped threads can't be started again """
+        if self._workers_stopped:
+            raise RuntimeError(f"Can't {action}, plot workers are stopped, create a new plot instead")
+
+    def stop_workers(self):
+        """ Stop threads that feed data into plot, plot can't be started again after this """
+        self._workers_stopped = True
+        if self._source_scheduler.is_alive():
+            self._source_scheduler.stop()
+        if self._ingest_thread:
+            self._ingest_thread.stop()
+        if self._refine_thread:
+            self._refine_thread.stop()
+        self.stop_recording()
+        self.close_store()
+        self._data.shutdown()
+
     def remove_line(self, line):
+        """ Remove line from plot, all references to line are removed so it can be freed """
         self._x_axis.remove_line(line)
+        self._left_y_axis.remove_line(line)
+        self._right_y_axis.remove_line(line)
+        self._legend.remove_line(line)
+        self._last_values.remove_line(line)
         self._lines.remove(line)
+        self._orientations.pop(line, None)
+
+        # data is stored by line name, lines like PeaksDetect use the data of the line they follow
+        if line.name not in [l.name for l in self._lines]:
+            with lock.writing(name='remove_line'):
+                self._data.remove_column(line.name)
+
+        if self._recorder:
+            self._recorder.remove_line(line)
+        if self._store:
+            self._store.remove_line(line)
 
     def start_threads(self):
         """ Start watch and input threads """
+        self.check_workers('start threads')
         #self._watch_thread.start()
         self._input_thread.start()
 
@@ -193,6 +387,7 @@ class Plot(InputCallbacks):
         logger.debug("Stopping threads")
         self._watch_thread.stop()
         self._input_thread.stop()
+        self.stop_workers()
 
         #logger.debug("Waiting for watch thread to join")
         #self._watch_thread.join()
@@ -202,19 +397,43 @@ class Plot(InputCallbacks):
 
     def handle_input_queue(self, queue):
         """ Check queue for events created by input thread.
+            All events are handled before requesting one frame.
             Return True is there were events. """
         has_input = not queue.empty()
         while not queue.empty():
             inp_opt = queue.get()
             inp_opt.on_activated()
-            self.draw()
+
+        if has_input:
+            self._scheduler.request('input')
         return has_input
 
     def has_new_data(self):
         return True in [line.is_updated() for line in self._lines]
 
+    def redraw(self):
+        """ Draw a frame now, is used when input is handled outside of the main loop eg. in menus """
+        self._scheduler.request('input')
+        if self._scheduler.frame_due():
+            with lock.reading(name='redraw'):
+                self.draw_layers()
+            self.show_frame()
+
     def draw(self):
         """ Draw plot on screen """
+        self.draw_layers()
+        self.show_frame()
+
+    def draw_layers(self):
+        """ Draw data on layers, caller holds read lock so points can't be added meanwhile.
+            Layers hold a copy of the drawn frame, show_frame() puts them on screen without the lock """
+        self._scheduler.start_frame()
+
+        # when we can't keep up with the frame rate, expensive lines will skip some work
+        degraded = self._scheduler.is_degraded()
+        for line in self._lines:
+            line.set_degraded(degraded)
+
         self._backend.clear()
 
         # recalculate y data dimensions
@@ -236,17 +455,27 @@ class Plot(InputCallbacks):
         self._backend.update_ry_col_width(self._right_y_axis.get_col_width(self._backend, self._data))
         self._backend.init_display()
 
+        # actors draw on their own layer, layers are only rendered again when their inputs have changed
+        self._compositor.start_frame()
+        view = self.get_view_signature()
+
         if self.state['show grid'].state:
-            self._grid.draw(self._backend, self._data)
+            self._compositor.draw(self._backend, 'grid', view, self._grid.draw, self._data)
+
+        for axis in [self._left_y_axis, self._right_y_axis]:
+            for line in axis.get_lines():
+                signature = (view, axis.get_range(), line.name, line.get_version(), line.is_enabled(), degraded)
+                self._compositor.draw(self._backend, f"line {line.line_number}", signature, axis.draw_line, self._data, line)
+
+        self._compositor.draw(self._backend, 'x axis', view, self._x_axis.draw, self._data)
 
-        self._left_y_axis.draw_lines(self._backend, self._data)
-        self._right_y_axis.draw_lines(self._backend, self._data)
-        self._x_axis.draw(self._backend, self._data)
-        self._left_y_axis.draw(self._backend, self._data)
-        self._right_y_axis.draw(self._backend, self._data)
+        # last values of lines are highlighted on axis
+        for name, axis in [('left y axis', self._left_y_axis), ('right y axis', self._right_y_axis)]:
+            signature = (view, axis.get_range(), tuple(line.get_version() for line in axis.get_lines()))
+            self._compositor.draw(self._backend, name, signature, axis.draw, self._data)
 
         if self.state['show legend'].state:
-            self._legend.draw(self._backend)
+            self._compositor.draw(self._backend, 'legend', (view, self._legend.get_signature()), self._legend.draw)
 
         if self.state['show statusline'].state:
             self._status_line.clear()
@@ -257,36 +486,138 @@ class Plot(InputCallbacks):
             self._status_line.set('fit_all',     self.state['fit all'].state)
             self._status_line.set('autorange_left_y', self.state['autorange left y'].state)
             self._status_line.set('autorange_right_y', self.state['autorange right y'].state)
+            self._status_line.set('fps', self._scheduler.get_fps())
+            self._status_line.set('dropped', self._scheduler.get_dropped())
             if self.state['paused'].state:
                 self._status_line.set(None, 'paused')
-            self._status_line.draw(self._backend)
+            if degraded:
+                self._status_line.set(None, 'degraded')
+            if self._refine_thread and self._refine_thread.is_refining():
+                self._status_line.set(None, 'refining')
+            self._compositor.draw(self._backend, 'status', (view, self._status_line.get_signature()), self._status_line.draw)
 
         if self.state['show last values'].state:
-            self._last_values.draw(self._backend)
+            self._compositor.draw(self._backend, 'last values', (view, self._last_values.get_signature()), self._last_values.draw)
+
+        # performance overlay is drawn on top of everything
+        if self.state['show hud'].state:
+            self.update_hud()
+            self._compositor.draw(self._backend, 'hud', (view, self._hud.get_signature()), self._hud.draw)
+
+    def show_frame(self):
+        """ Composite layers and write them to terminal, only reads layers so it doesn't need the read lock """
+        with terminal_lock:
+            with metrics.timer('draw.composite'):
+                self._compositor.composite(self._backend)
+            with metrics.timer('backend.refresh'):
+                self._backend.refresh()
+        self._scheduler.end_frame()
+        metrics.record('frame', self._scheduler.get_frame_time())
+
+        if self._refine_thread:
+            self._refine_thread.end_frame()
+
+        # view may have changed, neighbours have to be checked again
+        self._precompute_pending = self._precompute
+
+    def update_hud(self):
+        """ Collect performance stats for the HUD, stats are only collected every HUD interval """
+        now = time.perf_counter()
+        if not self._hud.is_due(now):
+            return
+
+        rows = []
+        rows.append(f"frame {format_ms(self._scheduler.get_frame_time())}  fps {self._scheduler.get_fps()}  dropped {self._scheduler.get_dropped()}")
+
+        # layers that were drawn in this frame so far, cached layers cost nothing
+        for layer in self._compositor.get_layers():
+            frame_time = format_ms(layer.frame_time) if layer.frame_time else 'cached'
+            rows.append(f"  {layer.name}: {frame_time}  (last {format_ms(layer.render_time)})")
 
-        self._backend.refresh()
+        stats = self._data.get_cache_stats()
+        hits   = self._hud.get_rate('cache hits', stats['hits'], now)
+        misses = self._hud.get_rate('cache misses', stats['misses'], now)
+        hit_rate = f"{round(100 * hits / (hits + misses))}%" if hits + misses else '-'
+        rows.append(f"cache: hit rate {hit_rate}  items {stats['items']}  precomputed hits {stats['precomputed hits']}")
+
+        points = sum(line.get_point_count() for line in self._lines)
+        rows.append(f"index: {self._data.get_bucket_count()} buckets  {points} points")
+        rows.append(f"memory: {format_bytes(get_memory_usage())}")
+
+        for line in self._lines:
+            rate = self._hud.get_rate(f"line {line.line_number}", line.get_point_count(), now)
+            rows.append(f"  {line.name}: {round(rate, 1)} points/s")
+
+        if lock.stats_enabled():
+            for name, lock_stats in lock.get_stats().items():
+                rows.append(f"lock {name}: wait p99 {format_ms(lock_stats['wait']['p99'])}  max {format_ms(lock_stats['wait']['max'])}")
+        else:
+            rows.append("lock: stats disabled")
+
+        self._hud.set_rows(rows, now)
+
+    def get_view_signature(self):
+        """ Represents the dimensions of the plot and the part of the data that is on screen.
+            When this changes, all layers have to be rendered again """
+        bins = self._data.get_bins(self._backend.get_plot_cols())
+        if bins:
+            window = (bins[0].start, bins[0].count, bins[-1].start, bins[-1].count, len(bins))
+        else:
+            window = None
+
+        return (self._backend.get_cols(),
+                self._backend.get_rows(),
+                self._backend._l_offset,
+                self._backend._r_offset,
+                id(self._data),
+                window,
+                self._refine_thread.version if self._refine_thread else None)
+
+    def get_idle_timeout(self):
+        """ Seconds the render loop should wait before precompute() is called, None when there is no idle work """
+        return self._scheduler.get_frame_budget() if self._precompute_pending else None
+
+    def precompute(self):
+        """ Is called by render loop when there was nothing to draw for get_idle_timeout() seconds """
+        if not self._precompute_pending:
+            return
+
+        with lock.reading(name='precompute'):
+            self._precompute_pending = self._data.precompute(self._backend.get_plot_cols(),
+                                                             int(self.state['x pan steps'].state),
+                                                             float(self.state['x zoom unit'].state))
 
     def plot(self):
+        """ Collect redraw requests and draw a frame when the scheduler says so """
         # handle user input queue
-        if self.handle_input_queue(self._input_thread.queue):
-            lock.wait_for_lock(name='input queue draw')
-            self.draw()
-            lock.release_lock()
-
-        lock.wait_for_lock(name='plot')
-        # redraw if terminal is resized
-        if self._backend.check_resized():
-            self.draw()
-
-        if self.state['paused'].state:
-            lock.release_lock()
-            return
+        self.handle_input_queue(self._input_thread.queue)
 
-        if self.has_new_data():
-            self.draw()
-        else:
-            self._backend.refresh()
-        lock.release_lock()
+        # points can't be added while the frame is drawn on layers, writing them to terminal is done without lock
+        frame_due = False
+        with lock.reading(name='plot'):
+            # redraw if terminal is resized
+            if self._backend.check_resized():
+                self._scheduler.request('resize')
+
+            if self.state['paused'].state:
+                self._scheduler.discard('data')
+            elif self.has_new_data():
+                self._scheduler.request('data')
+
+            if self._scheduler.frame_due():
+                frame_due = True
+                with profiler.capture('render'):
+                    self.draw_layers()
+
+        if frame_due:
+            with profiler.capture('render'):
+                self.show_frame()
+            profiler.end_frame()
+
+        # show result when a profile capture is done
+        report = profiler.get_report()
+        if report:
+            self.show_profile(report)
 
 
 class PlotApp(Plot):
@@ -311,18 +642,25 @@ class PlotApp(Plot):
 
     def quit_callback(self, inp_opt, args):
         self._stopped = True
+        self._scheduler.notify()
 
     def sleep(self, seconds):
-        """ Sleep that will not blocking program flow """
-        t_last = datetime.datetime.utcnow()
-        while (t_last + datetime.timedelta(seconds=seconds)) > datetime.datetime.utcnow():
-            if self._stopped:
+        """ Sleep that will not blocking program flow.
+            Wakes up on new data, user input or resize, blocks without using cpu otherwise """
+        t_end = time.perf_counter() + seconds
+        while not self._stopped:
+            remaining = t_end - time.perf_counter()
+            if remaining <= 0:
                 return
 
-            self.plot()
-            time.sleep(0.1)
+            idle_timeout = self.get_idle_timeout()
+            if self._scheduler.wait(timeout=remaining if idle_timeout == None else min(remaining, idle_timeout)):
+                self.plot()
+            else:
+                self.precompute()
 
     def start(self):
+        self.check_workers('start')
         self._input_thread.start()
         self._update_thread.start()
 
@@ -334,8 +672,166 @@ class PlotApp(Plot):
 
         self._input_thread.stop()
         self._update_thread.stop()
+        self.stop_workers()
 
     def check_update(self):
         #lock.wait_for_lock(name='plotapp update', debug=True)
         self.update()
         #lock.release_lock()
+
+
+class AsyncPlotApp(Plot):
+    """ Runs rendering, user input and data feeds on one asyncio event loop.
+        Feeds are coroutine functions that are awaited every $interval seconds, see add_feed().
+        Override update() to get new data every self._update_interval """
+    def __init__(self, stdscr, *args, update_interval=5, update_timeout=None, **kwargs):
+        Plot.__init__(self, stdscr, *args, **kwargs)
+        self._stdscr = stdscr
+
+        # interval between calls to update coroutine
+        self._update_interval = update_interval
+        self._update_timeout = update_timeout
+
+        # indicate stopped state
+        self._stopped = False
+        self._menu.add_item(MenuItem('Quit', callback=self.quit_callback, buttons=[ord('q')], button_name='q'))
+
+        # feeds are added as (name, coroutine function, interval, timeout)
+        self._feeds = []
+        self._tasks = []
+
+        # set when render loop should wake up, is created when loop is running
+        self._loop = None
+        self._wakeup = None
+        self._quit = None
+
+        # prevents waking up the loop for every request from another thread
+        self._wakeup_pending = False
+        self._scheduler.add_listener(self.wakeup)
+
+    def is_stopped(self):
+        """ Check if status is stopped """
+        return self._stopped
+
+    def quit_callback(self, inp_opt, args):
+        self._stopped = True
+        if self._quit != None:
+            self._quit.set()
+
+    def add_feed(self, callback, interval, timeout=None, name=None):
+        """ Await coroutine function callback every $interval seconds.
+            Calls that take longer than $timeout seconds are cancelled """
+        name = name if name else getattr(callback, '__name__', 'feed')
+        self._feeds.append((name, callback, interval, timeout))
+
+        # feeds can also be added when app is running
+        if self._loop != None:
+            self._tasks.append(self._loop.create_task(self.run_feed(name, callback, interval, timeout)))
+
+    async def update(self):
+        """ Override to get new data every self._update_interval """
+        pass
+
+    async def sleep(self, seconds):
+        """ Sleep that returns immediately on quit, return False in that case """
+        try:
+            await asyncio.wait_for(self._quit.wait(), timeout=max(0, seconds))
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    def wakeup(self):
+        """ Wake up render loop, is called by scheduler on new requests which can come from any thread """
+        if self._loop == None or self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def read_input(self):
+        """ Is called by event loop when stdin is readable, input thread is not started but used to queue all pending keys """
+        if self._input_thread.read_input():
+            self._wakeup.set()
+
+    def on_resize(self):
+        self._input_thread.resize()
+        self._wakeup.set()
+
+    async def run_feed(self, name, callback, interval, timeout):
+        """ Await callback every interval seconds, next run is scheduled relative to the previous start so feeds don't drift """
+        logger.debug(f"Starting feed: {name}")
+        t_next = self._loop.time()
+
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(callback(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Feed {name} timed out after {timeout}s")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Feed {name} failed: {e}")
+                logger.debug(traceback.format_exc())
+
+            # when a run took longer than interval, skip missed runs
+            t_next = max(t_next + interval, self._loop.time())
+            if not await self.sleep(t_next - self._loop.time()):
+                break
+
+        logger.debug(f"Stopping feed: {name}")
+
+    async def render(self):
+        """ Draw a frame when the scheduler says so, waits without using cpu otherwise """
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.get_idle_timeout())
+            except asyncio.TimeoutError:
+                self.precompute()
+                continue
+
+            self._wakeup.clear()
+            self._wakeup_pending = False
+
+            # coalesce data requests into one frame per frame budget
+            if self._scheduler.is_dirty() and not self._scheduler.frame_due():
+                if not await self.sleep(self._scheduler.get_wait_time()):
+                    break
+
+            self.plot()
+
+    async def main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._quit = asyncio.Event()
+
+        self._loop.add_reader(sys.stdin.fileno(), self.read_input)
+        self._loop.add_signal_handler(signal.SIGWINCH, self.on_resize)
+
+        self._tasks = [self._loop.create_task(self.run_feed(*feed)) for feed in self._feeds]
+        self._tasks.append(self._loop.create_task(self.run_feed('update', self.update, self._update_interval, self._update_timeout)))
+
+        # draw first frame
+        self._scheduler.request('input')
+
+        render = self._loop.create_task(self.render())
+        quit = self._loop.create_task(self._quit.wait())
+        try:
+            await asyncio.wait([render, quit], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._stopped = True
+            self._loop.remove_reader(sys.stdin.fileno())
+            self._loop.remove_signal_handler(signal.SIGWINCH)
+            self.stop_workers()
+
+            # cancel feeds that are still waiting for data
+            tasks = self._tasks + [render, quit]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop = None
+
+    def start(self):
+        self.check_workers('start')
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import time
+import pstats
+import logging
+import cProfile
+import datetime
+import threading
+from contextlib import nullcontext
+
+logger = logging.getLogger('complot')
+
+
+class ProfileRegion():
+    """ Context manager that profiles its block in the current thread, is returned by Profiler.capture() """
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._entry = None
+
+    def __enter__(self):
+        self._entry = self._profiler.enter(self._name)
+        return self
+
+    def __exit__(self, *args):
+        self._profiler.exit(self._entry)
+
+
+class Profiler():
+    """ Captures cProfile stats of the render loop and ingestion threads for the next $frames frames or $seconds seconds.
+        Threads mark the code that should be profiled with:
+
+            with profiler.capture('render'):
+                ...
+
+        When not capturing, capture() returns a shared no-op context manager so regions cost one method call.
+        cProfile only profiles the thread that enabled it, so every thread gets its own profile.
+        Since python 3.12 only one profiler can be active at a time, threads that enter a region while another thread
+        is profiling are not profiled, they are listed in the report.
+        Profiles are merged and written to a .pstats file next to complot.log when the capture is done. """
+    def __init__(self, top=40):
+        self.capturing = False
+
+        # amount of functions in report
+        self._top = top
+
+        self._lock = threading.Lock()
+        self._null_region = nullcontext()
+
+        # capture state by thread id: {'name', 'profile', 'depth', 'enabled'}
+        self._threads = {}
+
+        self._frames_left = None
+        self._t_end = None
+
+        # (path, lines) of last finished capture, is picked up by the plot to show it
+        self._report = None
+
+    def start(self, frames=50, seconds=10):
+        """ Profile until $frames frames are drawn or $seconds seconds have passed """
+        with self._lock:
+            if self.capturing:
+                return
+            self._threads = {}
+            self._frames_left = frames
+            self._t_end = time.perf_counter() + seconds
+            self.capturing = True
+        logger.debug(f"Started profiling for {frames} frames or {seconds}s")
+
+    def capture(self, name):
+        """ Return context manager that profiles its block when a capture is running """
+        if not self.capturing:
+            return self._null_region
+        return ProfileRegion(self, name)
+
+    def enter(self, name):
+        ident = threading.get_ident()
+        with self._lock:
+            if not self.capturing:
+                return
+
+            entry = self._threads.get(ident)
+            if entry == None:
+                entry = self._threads[ident] = {'name': name, 'profile': cProfile.Profile(), 'depth': 0, 'enabled': False, 'blocked': 0}
+
+            entry['depth'] += 1
+            if entry['depth'] > 1:
+                return entry
+
+        try:
+            entry['profile'].enable()
+            entry['enabled'] = True
+        except ValueError:
+            # since python 3.12 only one profiler can be active, this region is not profiled
+            entry['blocked'] += 1
+        return entry
+
+    def exit(self, entry):
+        if entry == None:
+            return
+
+        with self._lock:
+            entry['depth'] -= 1
+            if entry['depth']:
+                return
+            if entry['enabled']:
+                entry['profile'].disable()
+                entry['enabled'] = False
+
+    def end_frame(self):
+        """ Is called by render loop after a frame, outside of a profiled region """
+        if not self.capturing:
+            return
+
+        self._frames_left -= 1
+        if self._frames_left <= 0 or time.perf_counter() > self._t_end:
+            self.stop()
+
+    def get_path(self):
+        """ Profiles are written next to log file """
+        directory = os.getcwd()
+        for handler in logger.handlers:
+            if isinstance(handler, logging.FileHandler):
+                directory = os.path.dirname(handler.baseFilename)
+                break
+        return os.path.join(directory, f"complot_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pstats")
+
+    def stop(self):
+        """ Merge profiles of all threads, write them to file and create report.
+            Must not be called from within a profiled region, collecting stats disables profiling in calling thread """
+        with self._lock:
+            if not self.capturing:
+                return
+            self.capturing = False
+            threads = list(self._threads.values())
+            self._threads = {}
+
+        stats = None
+        names = []
+
+        # {name: amount of regions} of threads that couldn't profile because another profiler was active
+        blocked = {}
+        for entry in threads:
+            if entry['blocked']:
+                blocked[entry['name']] = blocked.get(entry['name'], 0) + entry['blocked']
+
+            # thread is still in a region, its profile can't be collected from this thread
+            if entry['depth']:
+                logger.debug(f"Skipping profile of thread {entry['name']}, it is still running")
+                continue
+
+            try:
+                if stats == None:
+                    stats = pstats.Stats(entry['profile'])
+                else:
+                    stats.add(entry['profile'])
+                names.append(entry['name'])
+            except TypeError:
+                # profile didn't record anything
+                pass
+
+        if blocked:
+            logger.error(f"Threads were not (fully) profiled, another profiler was active: {blocked}")
+
+        if stats == None:
+            logger.error("Profiler didn't capture anything")
+            return
+
+        path = self.get_path()
+        stats.dump_stats(path)
+        logger.debug(f"Wrote profile of threads {names} to: {path}")
+
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(self._top)
+
+        lines = [f"profile: {path}", f"threads: {', '.join(names)}"]
+        if blocked:
+            lines.append("not profiled, only one profiler can be active since python 3.12:")
+            lines += [f"    {name}: {amount} regions" for name, amount in blocked.items()]
+        lines.append("")
+        lines += [line for line in out.getvalue().split('\n') if line.strip()]
+        self._report = (path, lines)
+
+    def get_report(self):
+        """ Return (path, lines) of last capture once, None if there is none """
+        report, self._report = self._report, None
+        return report
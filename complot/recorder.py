@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+import math
+import time
+import struct
+import inspect
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger('complot')
+
+# file format, all numbers are little endian:
+#   header:  magic, version, start time (unix timestamp)
+#   line:    b'L', line id, source line id, orientation, type, name
+#   flags:   b'F', line id, flags, is written before the first point of a line
+#   points:  b'P', line id, time (seconds since start), amount of values, values...
+MAGIC = b'CPREC'
+VERSION = 2
+
+# version 1 recordings don't have flags records
+SUPPORTED_VERSIONS = [1, 2]
+
+HEADER = struct.Struct('<5sBd')
+LINE   = struct.Struct('<cHHBB')
+FLAGS  = struct.Struct('<cHB')
+POINT  = struct.Struct('<cHdB')
+
+# line flags
+FLAG_DATETIME = 1
+
+# source id of lines that don't follow another line
+NO_SOURCE = 0xFFFF
+
+ORIENTATIONS = ['left', 'right']
+
+
+def get_row_size(line):
+    """ Return amount of values that are stored per point: the make_point() arguments that don't have a default, eg. not the name of a point """
+    parameters = inspect.signature(line.make_point).parameters.values()
+    return len([p for p in parameters if p.default == inspect.Parameter.empty])
+
+
+def to_doubles(row):
+    """ Convert row of add_point() arguments to floats, datetimes become timestamps and None becomes NaN """
+    x, *values = row
+    if hasattr(x, 'timestamp'):
+        x = x.timestamp()
+    return [float(x)] + [math.nan if v == None else float(v) for v in values]
+
+
+class Recorder():
+    """ Records every point that is added to a line, with the time it was added, so a live feed can be replayed later by Replayer.
+        Lines are recorded with their type, name and orientation, lines like PeaksDetect are recorded with the line they follow.
+        Values are stored as doubles, x values that are datetimes are stored as timestamps and None is stored as NaN.
+        When the first point of a line has a datetime x value, the line is flagged so x values are replayed as datetimes.
+        Point names are not recorded. """
+    def __init__(self, path):
+        self._path = path
+
+        # lines are added from different threads
+        self._lock = threading.Lock()
+
+        # line ids and the amount of values that are recorded per point
+        self._ids = {}
+        self._fields = {}
+        self._next_id = 0
+
+        # lines that have their flags recorded
+        self._flagged = set()
+
+        self._points = 0
+        self._t_start = time.perf_counter()
+
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        logger.debug(f"Recording points to: {path}")
+
+    def add_line(self, line, orientation='left'):
+        """ Start recording line, is called by Plot.add_line() """
+        fields = get_row_size(line)
+
+        source = getattr(line, '_line', None)
+        with self._lock:
+            line_id = self._next_id
+            self._next_id += 1
+            self._ids[line] = line_id
+            self._fields[line] = fields
+
+            line_type = type(line).__name__.encode()
+            name = (line.name or '').encode()
+            self._file.write(LINE.pack(b'L', line_id, self._ids.get(source, NO_SOURCE), ORIENTATIONS.index(orientation), len(line_type)) + line_type)
+            self._file.write(struct.pack('<H', len(name)) + name)
+
+        line.set_recorder(self)
+
+    def remove_line(self, line):
+        """ Stop recording line, points that were recorded stay in recording """
+        with self._lock:
+            self._ids.pop(line, None)
+            self._fields.pop(line, None)
+            self._flagged.discard(line)
+        line.set_recorder(None)
+
+    def get_values(self, line, row):
+        return to_doubles(row[:self._fields[line]])
+
+    def record(self, line, row, t=None):
+        """ Record row containing the add_point() arguments, $t defaults to now """
+        self.record_many(line, [row], t=t)
+
+    def record_many(self, line, rows, t=None):
+        """ Record rows that were added in one go, $t defaults to now """
+        if t == None:
+            t = time.perf_counter() - self._t_start
+
+        data = bytearray()
+        for row in rows:
+            values = self.get_values(line, row)
+            data += POINT.pack(b'P', self._ids[line], t, len(values))
+            data += struct.pack(f'<{len(values)}d', *values)
+
+        with self._lock:
+            if self._file.closed:
+                return
+            if line not in self._flagged and rows:
+                flags = FLAG_DATETIME if hasattr(rows[0][0], 'timestamp') else 0
+                self._file.write(FLAGS.pack(b'F', self._ids[line], flags))
+                self._flagged.add(line)
+            self._file.write(data)
+            self._points += len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+        logger.debug(f"Recorded {self._points} points to: {self._path}")
+
+    def get_stats(self):
+        return { 'path'   : self._path,
+                 'lines'  : self._next_id,
+                 'points' : self._points }
+
+
+def read_recording(path):
+    """ Read recording made by Recorder. Yields ('line', line_id, source_id, orientation, type, name) when a line is defined,
+        ('flags', line_id, flags) before the first point of a line and ('points', line_id, t, values) for every point.
+        Source id is None when line doesn't follow another line """
+    with open(path, 'rb') as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a complot recording: {path}")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported recording version: {version}")
+
+        while True:
+            tag = f.read(1)
+            if not tag:
+                return
+
+            if tag == b'L':
+                _, line_id, source_id, orientation, length = LINE.unpack(tag + f.read(LINE.size-1))
+                line_type = f.read(length).decode()
+                length, = struct.unpack('<H', f.read(2))
+                name = f.read(length).decode()
+                yield ('line', line_id, None if source_id == NO_SOURCE else source_id, ORIENTATIONS[orientation], line_type, name)
+
+            elif tag == b'F':
+                _, line_id, flags = FLAGS.unpack(tag + f.read(FLAGS.size-1))
+                yield ('flags', line_id, flags)
+
+            elif tag == b'P':
+                _, line_id, t, amount = POINT.unpack(tag + f.read(POINT.size-1))
+                values = struct.unpack(f'<{amount}d', f.read(amount * 8))
+                yield ('points', line_id, t, [None if math.isnan(v) else v for v in values])
+
+            else:
+                raise ValueError(f"Corrupt recording: {path}, unknown record at byte {f.tell()-1}")
+
+
+class Replayer():
+    """ Feeds a recording back into a plot.
+        $speed: 1 is real time, 2 is twice as fast, 0 replays as fast as possible.
+        Points that were added in one go are added in one go again.
+        When $on_batch is given, it is called with (line, amount of points) after points are added """
+    def __init__(self, plot, path, speed=1, on_batch=None):
+        self._plot = plot
+        self._path = path
+        self._speed = speed
+        self._on_batch = on_batch
+        self._stopped = False
+
+        # lines by id in recording
+        self._lines = {}
+
+        # ids of lines that have datetime x values
+        self._datetime_lines = set()
+
+        # stats
+        self._points = 0
+        self._batches = 0
+        self._lag = 0
+        self._t_start = None
+        self._t_end = None
+
+    def stop(self):
+        self._stopped = True
+
+    def add_line(self, line_id, source_id, orientation, line_type, name):
+        """ Create line that is defined in recording and add it to plot """
+        # line types are looked up by name so the module isn't needed to read recordings
+        from complot import lines
+
+        cls = getattr(lines, line_type, None)
+        if cls == None:
+            raise ValueError(f"Unknown line type in recording: {line_type}")
+
+        if source_id == None:
+            line = cls(name=name)
+        else:
+            line = cls(self._lines[source_id], name=name)
+
+        self._lines[line_id] = self._plot.add_line(line, orientation=orientation)
+
+    def create_lines(self):
+        """ Add lines that are defined before the first point to plot so they can be set up before replaying, return list of lines.
+            Lines that are defined later are added by run() """
+        for record in read_recording(self._path):
+            if record[0] != 'line':
+                break
+            self.add_line(*record[1:])
+        return list(self._lines.values())
+
+    def set_flags(self, line_id, flags):
+        if flags & FLAG_DATETIME:
+            self._datetime_lines.add(line_id)
+
+    def add_batch(self, line_id, rows):
+        line = self._lines[line_id]
+
+        # x values were recorded as timestamps
+        if line_id in self._datetime_lines:
+            rows = [[datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc)] + row[1:] for row in rows]
+
+        # single points go through add_point() so they are buffered when plot has ingestion enabled
+        if len(rows) == 1:
+            line.add_point(*rows[0])
+        else:
+            line.add_points(rows)
+
+        self._points += len(rows)
+        self._batches += 1
+        if self._on_batch:
+            self._on_batch(line, len(rows))
+
+    def run(self):
+        """ Replay points, blocks until recording is done or stop() is called """
+        logger.debug(f"Replaying {self._path} at {self._speed if self._speed else 'max'}x speed")
+        self._t_start = time.perf_counter()
+
+        # consecutive points with the same time and line were added in one go
+        batch = []
+        batch_key = None
+
+        for record in read_recording(self._path):
+            if self._stopped:
+                break
+
+            if record[0] == 'line':
+                if record[1] not in self._lines:
+                    self.add_line(*record[1:])
+                continue
+
+            if record[0] == 'flags':
+                self.set_flags(*record[1:])
+                continue
+
+            _, line_id, t, values = record
+            if (line_id, t) != batch_key:
+                if batch:
+                    self.add_batch(batch_key[0], batch)
+                    batch = []
+
+                if self._speed:
+                    wait = self._t_start + t / self._speed - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                    else:
+                        self._lag = max(self._lag, -wait)
+
+            batch_key = (line_id, t)
+            batch.append(values)
+
+        if batch and not self._stopped:
+            self.add_batch(batch_key[0], batch)
+
+        self._t_end = time.perf_counter()
+        logger.debug(f"Replayed {self._points} points in {round(self._t_end - self._t_start, 3)}s")
+
+    def get_stats(self):
+        t_end = self._t_end if self._t_end else time.perf_counter()
+        duration = t_end - self._t_start if self._t_start else 0
+        return { 'points'   : self._points,
+                 'batches'  : self._batches,
+                 'duration' : duration,
+                 'rate'     : self._points / duration if duration else 0,
+                 'max lag'  : self._lag }
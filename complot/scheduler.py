@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('complot')
+
+
+class FrameScheduler():
+    """ Coordinates all redraw requests of a plot.
+        Requests are coalesced into at most $max_fps frames per second, input requests are drawn immediately
+        so the plot feels responsive. When frames overrun their budget, the plot is put in degraded mode
+        so expensive actors can skip work until we're catching up again.
+        The render loop blocks in wait() until there is something to draw, so an idle plot uses no CPU """
+    def __init__(self, max_fps=20, degrade_after=3, recover_after=20):
+        self._max_fps = max_fps
+
+        # time in seconds one frame may take
+        self._frame_budget = 1 / max_fps
+
+        # requests come from different threads, waiting render loop is notified on new requests
+        self._cond = threading.Condition(threading.Lock())
+
+        # set by notify() to wake up render loop without requesting a frame
+        self._woken = False
+
+        # reasons for pending requests: 'data', 'input', 'resize', 'refine'
+        self._requests = set()
+
+        # amount of requests since last frame, used to count coalesced frames
+        self._request_count = 0
+
+        # frames that would have been drawn without coalescing
+        self._dropped = 0
+
+        # start time of last frame and timestamps of recent frames to calculate fps
+        self._last_frame = 0
+        self._frame_start = None
+        self._frame_history = deque(maxlen=200)
+        self._frame_time = 0
+
+        # amount of consecutive frames that were over/under budget
+        self._degrade_after = degrade_after
+        self._recover_after = recover_after
+        self._overruns = 0
+        self._on_time = 0
+        self._degraded = False
+
+        # callbacks that are called on new requests, used to wake up render loops that don't block in wait()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def notify_listeners(self):
+        for callback in self._listeners:
+            callback()
+
+    def request(self, reason='data'):
+        """ Mark plot dirty, a frame will be drawn when frame_due() says so """
+        with self._cond:
+            self._requests.add(reason)
+            self._request_count += 1
+            self._cond.notify_all()
+        self.notify_listeners()
+
+    def discard(self, reason):
+        """ Forget about requests for reason, eg. new data while plot is paused """
+        with self._cond:
+            self._requests.discard(reason)
+
+    def notify(self):
+        """ Wake up render loop without requesting a frame, eg. when there is user input to handle """
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+        self.notify_listeners()
+
+    def wait(self, timeout=None):
+        """ Block until a frame is due or notify() is called.
+            Return False on timeout """
+        deadline = time.perf_counter() + timeout if timeout != None else None
+
+        with self._cond:
+            while not self._woken:
+                if self._requests and self.is_due():
+                    break
+
+                # when requests are waiting for their frame budget, wake up when the frame is due
+                wait = self.get_wait_time() if self._requests else None
+
+                if deadline != None:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait == None else min(wait, remaining)
+
+                self._cond.wait(wait)
+
+            self._woken = False
+        return True
+
+    def is_dirty(self):
+        return len(self._requests) > 0
+
+    def get_frame_budget(self):
+        return self._frame_budget
+
+    def get_wait_time(self):
+        """ Seconds until next frame may be drawn """
+        return max(0, self._last_frame + self._frame_budget - time.perf_counter())
+
+    def is_due(self):
+        """ Input and resize frames don't wait for the frame budget, must be called while holding self._cond """
+        if not self._requests:
+            return False
+
+        if 'input' in self._requests or 'resize' in self._requests:
+            return True
+
+        return self.get_wait_time() == 0
+
+    def frame_due(self):
+        """ Check if a frame should be drawn now """
+        with self._cond:
+            return self.is_due()
+
+    def start_frame(self):
+        """ Called by Plot.draw() before drawing, all pending requests are handled by this frame """
+        with self._cond:
+            if self._request_count > 1:
+                self._dropped += self._request_count - 1
+            self._requests = set()
+            self._request_count = 0
+
+        self._frame_start = time.perf_counter()
+        self._last_frame = self._frame_start
+        self._frame_history.append(self._frame_start)
+
+    def end_frame(self):
+        """ Called by Plot.draw() after drawing, checks if frame was drawn within budget """
+        if self._frame_start == None:
+            return
+
+        self._frame_time = time.perf_counter() - self._frame_start
+        self._frame_start = None
+
+        if self._frame_time > self._frame_budget:
+            self._overruns += 1
+            self._on_time = 0
+        elif self._frame_time < self._frame_budget / 2:
+            self._on_time += 1
+            self._overruns = 0
+
+        if not self._degraded and self._overruns >= self._degrade_after:
+            logger.debug(f"Frame time {round(self._frame_time, 3)}s is over budget, disabling expensive actors")
+            self._degraded = True
+        elif self._degraded and self._on_time >= self._recover_after:
+            logger.debug("Frame time is within budget, enabling expensive actors")
+            self._degraded = False
+
+    def is_degraded(self):
+        return self._degraded
+
+    def get_fps(self):
+        """ Frames drawn in the last second """
+        now = time.perf_counter()
+        return sum(1 for t in self._frame_history if t > now - 1)
+
+    def get_dropped(self):
+        return self._dropped
+
+    def get_frame_time(self):
+        return self._frame_time
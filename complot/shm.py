@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import time
+import struct
+import logging
+import datetime
+from multiprocessing import shared_memory, resource_tracker
+
+logger = logging.getLogger('complot')
+
+
+def attach_shared_memory(name):
+    """ Attach to existing shared memory without taking ownership """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 every attached process registers the memory with its resource tracker,
+        # which unlinks it when the process exits, so unregister it again
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedMemoryRing():
+    """ Columnar ring buffer of floats in shared memory, one producer process writes and any number of viewer processes read.
+        Layout:
+            header:  magic, version, capacity, amount of columns, seq, head  (8 byte unsigned ints)
+            names:   32 bytes per column name
+            data:    one array of $capacity doubles per column
+        A seqlock protects the data. The producer increments seq before and after writing, seq is odd while writing.
+        Readers copy data and retry when seq changed while copying. head is the total amount of rows written,
+        row n is stored at n % capacity. """
+    magic = int.from_bytes(b'COMPLOT', 'little')
+    version = 1
+    header_fmt = '8Q'
+    name_size = 32
+
+    # header field indices
+    CAPACITY = 2
+    COLUMNS = 3
+    SEQ = 4
+    HEAD = 5
+
+    def __init__(self, shm, owner=False):
+        self._shm = shm
+        self._owner = owner
+
+        self._header = shm.buf[:struct.calcsize(self.header_fmt)].cast('Q')
+        if self._header[0] != self.magic or self._header[1] != self.version:
+            raise ValueError(f"Shared memory {shm.name} is not a complot ring buffer")
+
+        self.capacity = self._header[self.CAPACITY]
+        n_columns = self._header[self.COLUMNS]
+
+        offset = struct.calcsize(self.header_fmt)
+        self.columns = [bytes(shm.buf[offset+i*self.name_size:offset+(i+1)*self.name_size]).rstrip(b'\0').decode() for i in range(n_columns)]
+
+        offset += n_columns * self.name_size
+        self._data = [shm.buf[offset+i*self.capacity*8:offset+(i+1)*self.capacity*8].cast('d') for i in range(n_columns)]
+
+    @classmethod
+    def get_size(cls, columns, capacity):
+        return struct.calcsize(cls.header_fmt) + len(columns) * cls.name_size + len(columns) * capacity * 8
+
+    @classmethod
+    def create(cls, name, columns, capacity=100_000):
+        """ Create ring buffer in shared memory, this process becomes the producer """
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.get_size(columns, capacity))
+
+        header = shm.buf[:struct.calcsize(cls.header_fmt)].cast('Q')
+        header[0] = cls.magic
+        header[1] = cls.version
+        header[cls.CAPACITY] = capacity
+        header[cls.COLUMNS] = len(columns)
+        header[cls.SEQ] = 0
+        header[cls.HEAD] = 0
+        header.release()
+
+        offset = struct.calcsize(cls.header_fmt)
+        for i,column in enumerate(columns):
+            encoded = column.encode()[:cls.name_size]
+            shm.buf[offset+i*cls.name_size:offset+i*cls.name_size+len(encoded)] = encoded
+
+        logger.debug(f"Created shared memory ring buffer: {name}, columns: {columns}, capacity: {capacity}")
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """ Attach to existing ring buffer as a viewer """
+        return cls(attach_shared_memory(name))
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def get_head(self):
+        return self._header[self.HEAD]
+
+    def write(self, row):
+        return self.write_many([row])
+
+    def write_many(self, rows):
+        """ Write rows of floats, rows must contain a value for every column.
+            When there are more rows than the ring holds, only the last $capacity rows are written. head still moves by
+            the amount of rows that was passed so viewers count the skipped rows as lost.
+            Return amount of rows that were written """
+        if not self._owner:
+            raise RuntimeError("Only the process that created the ring buffer can write to it")
+
+        header = self._header
+        head = header[self.HEAD]
+        amount = len(rows)
+
+        skipped = max(0, amount - self.capacity)
+        if skipped:
+            logger.error(f"Got {amount} rows for ring buffer {self.name} with capacity {self.capacity}, skipped oldest {skipped} rows")
+            rows = rows[skipped:]
+
+        header[self.SEQ] += 1
+        for i,row in enumerate(rows, head + skipped):
+            slot = i % self.capacity
+            for column, value in zip(self._data, row):
+                column[slot] = value
+        header[self.HEAD] = head + amount
+        header[self.SEQ] += 1
+        return len(rows)
+
+    def read(self, cursor, max_rows=None, retries=100):
+        """ Read rows from cursor up to head.
+            Return (rows, new cursor, amount of rows that were overwritten before we could read them) """
+        for _ in range(retries):
+            seq = self._header[self.SEQ]
+            if seq % 2:
+                # producer is writing, give it some time
+                time.sleep(0)
+                continue
+
+            head = self._header[self.HEAD]
+
+            # rows older than head - capacity are overwritten
+            start = max(cursor, head - self.capacity)
+            end = head if max_rows == None else min(head, start + max_rows)
+
+            columns = []
+            for column in self._data:
+                i_start, i_end = start % self.capacity, end % self.capacity
+                if end - start == 0:
+                    columns.append([])
+                elif i_start < i_end:
+                    columns.append(column[i_start:i_end].tolist())
+                else:
+                    columns.append(column[i_start:].tolist() + column[:i_end].tolist())
+
+            # data changed while copying, try again
+            if self._header[self.SEQ] != seq:
+                continue
+
+            return list(zip(*columns)), end, start - cursor
+
+        logger.error(f"Failed to read from ring buffer {self.name}, producer keeps writing")
+        return [], cursor, 0
+
+    def close(self):
+        self._header.release()
+        for column in self._data:
+            column.release()
+        self._shm.close()
+
+    def unlink(self):
+        """ Remove shared memory, is done by producer """
+        self._shm.unlink()
+
+
+class SharedMemorySource():
+    """ Callable that can be passed to plot.add_source() to read new rows from a SharedMemoryRing.
+        Every call returns the rows that were written since last call.
+        If $x_type is 'datetime', the first column is converted from timestamp to datetime """
+    def __init__(self, name, x_type='datetime', max_rows=100_000):
+        self._ring = SharedMemoryRing.attach(name)
+        self._x_type = x_type
+        self._max_rows = max_rows
+
+        # start with all data that is still in the ring
+        self._cursor = max(0, self._ring.get_head() - self._ring.capacity)
+
+        self.lost = 0
+        self.__name__ = f"shm:{name}"
+
+    @property
+    def columns(self):
+        return self._ring.columns
+
+    def __call__(self):
+        rows, self._cursor, lost = self._ring.read(self._cursor, max_rows=self._max_rows)
+
+        if lost:
+            self.lost += lost
+            logger.error(f"Viewer is too slow, lost {lost} rows from {self._ring.name}")
+
+        if self._x_type == 'datetime':
+            rows = [(datetime.datetime.fromtimestamp(row[0]),) + row[1:] for row in rows]
+        return rows
+
+    def close(self):
+        self._ring.close()
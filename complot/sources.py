@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import time
+import math
+import heapq
+import random
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from complot.utils import Histogram
+from complot import profiler
+
+logger = logging.getLogger('complot')
+
+
+class Source():
+    """ A callable that is run every $interval seconds to get data for one or more lines.
+        When callback returns rows, they are added to the lines:
+            one line:       list of tuples containing the add_point() arguments
+            list of lines:  list containing a list of rows for every line
+        When callback returns None, callback is expected to add the points itself """
+    def __init__(self, callback, interval, lines, name=None, jitter=0.1):
+        self.callback = callback
+        self.interval = interval
+        self.lines = lines
+        self.name = name if name else getattr(callback, '__name__', 'source')
+
+        # max random deviation from schedule as fraction of interval, spreads out sources with the same interval
+        self._jitter = jitter
+
+        # runs are scheduled at: t_start + phase + n*interval, so timing doesn't drift when runs are slow
+        self._t_start = None
+        self._phase = random.uniform(0, jitter * interval)
+        self._run = 0
+
+        # indicate that callback is running in a worker
+        self.is_running = False
+
+        # stats
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_error = None
+        self.latency = Histogram()
+
+    def get_next_run(self, now):
+        """ Calculate next run time on the fixed schedule, runs that were missed are skipped """
+        if self._t_start == None:
+            self._t_start = now
+            return now + self._phase
+
+        self._run += 1
+        t_next = self._t_start + self._phase + self._run * self.interval
+
+        if t_next < now:
+            missed = math.ceil((now - t_next) / self.interval)
+            self._run += missed
+            t_next += missed * self.interval
+
+        # jitter is not accumulated, it's only applied to this run
+        return t_next + random.uniform(0, self._jitter * self.interval)
+
+    def add_rows(self, rows):
+        """ Add rows that were returned by callback to lines """
+        if rows == None:
+            return
+
+        if type(self.lines) in (list, tuple):
+            for line, line_rows in zip(self.lines, rows):
+                line.add_points(line_rows)
+        else:
+            self.lines.add_points(rows)
+
+    def run(self):
+        """ Is called in a worker thread """
+        t_start = time.perf_counter()
+        try:
+            with profiler.capture(f"source {self.name}"):
+                self.add_rows(self.callback())
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            logger.error(f"Source {self.name} failed: {e}")
+            logger.debug(traceback.format_exc())
+        finally:
+            self.latency.record(time.perf_counter() - t_start)
+            self.runs += 1
+            self.is_running = False
+
+    def get_stats(self):
+        return { 'interval'   : self.interval,
+                 'runs'       : self.runs,
+                 'errors'     : self.errors,
+                 'skipped'    : self.skipped,
+                 'last error' : self.last_error,
+                 'latency'    : self.latency.get_stats() }
+
+
+class SourceScheduler(threading.Thread):
+    """ Runs sources on a bounded pool of worker threads.
+        Sources are kept in a heap sorted by their next run time so one thread can drive many sources.
+        When a source is still running when its next run is due, that run is skipped """
+    def __init__(self, max_workers=8):
+        threading.Thread.__init__(self, daemon=True)
+        self._stopped = False
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='complot-source')
+
+        # heap of (next run, counter, source), counter makes sure sources are never compared
+        self._queue = []
+        self._counter = 0
+        self._cond = threading.Condition()
+
+        self._sources = []
+
+    def add_source(self, source):
+        with self._cond:
+            self._sources.append(source)
+            self.schedule(source, time.monotonic())
+            self._cond.notify()
+        return source
+
+    def remove_source(self, source):
+        """ Source is not scheduled again, a run that is in progress will finish """
+        with self._cond:
+            self._sources.remove(source)
+
+    def get_sources(self):
+        return list(self._sources)
+
+    def schedule(self, source, now):
+        """ Must be called while holding self._cond """
+        self._counter += 1
+        heapq.heappush(self._queue, (source.get_next_run(now), self._counter, source))
+
+    def stop(self):
+        logger.debug("Stopping SourceScheduler")
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        logger.debug("Starting SourceScheduler")
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+
+                t_next, _, source = self._queue[0]
+                now = time.monotonic()
+                if t_next > now:
+                    self._cond.wait(t_next - now)
+                    continue
+
+                heapq.heappop(self._queue)
+
+                # source was removed
+                if source not in self._sources:
+                    continue
+
+                if source.is_running:
+                    source.skipped += 1
+                    logger.debug(f"Source {source.name} is still running, skipping run")
+                else:
+                    source.is_running = True
+                    self._pool.submit(source.run)
+
+                self.schedule(source, now)
+
+        logger.debug("Stopping SourceScheduler... done")
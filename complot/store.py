@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import time
+import struct
+import logging
+import datetime
+import threading
+import itertools
+from array import array
+from urllib.parse import quote
+
+from complot.recorder import get_row_size, to_doubles
+
+logger = logging.getLogger('complot')
+
+# every column has a file in the store directory, all numbers are little endian doubles:
+#   NAME.dat:  header, rows of: key, values...
+MAGIC = b'CPSTO'
+VERSION = 1
+
+# magic, version, values per row, flags
+HEADER = struct.Struct('<5sBHB')
+
+# header flags
+FLAG_DATETIME = 1
+
+
+class ColumnFile():
+    """ Append-only file that holds all points of one column, points are read back through a memory map.
+        Points that replace a point with the same key, or that are older than the last point, are appended too.
+        The file is then rewritten in order of key before it is loaded, see compact(). """
+    def __init__(self, path, row_size, is_datetime=False):
+        self.path = path
+        self.row_size = row_size
+        self.is_datetime = is_datetime
+
+        self._last_key = None
+        self._is_sorted = None
+
+        self._data_file = None
+
+    @classmethod
+    def open(cls, path):
+        """ Open existing column file, return None when it doesn't exist """
+        if not os.path.isfile(path + '.dat'):
+            return
+
+        with open(path + '.dat', 'rb') as f:
+            magic, version, row_size, flags = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a complot store: {path}.dat")
+        if version != VERSION:
+            raise ValueError(f"Unsupported store version: {version}")
+
+        return cls(path, row_size, is_datetime=bool(flags & FLAG_DATETIME))
+
+    def get_header(self):
+        return HEADER.pack(MAGIC, VERSION, self.row_size, FLAG_DATETIME if self.is_datetime else 0)
+
+    def get_row_count(self):
+        return max(0, os.path.getsize(self.path + '.dat') - HEADER.size) // (self.row_size * 8)
+
+    def open_for_append(self):
+        if self._data_file:
+            return
+
+        if not os.path.isfile(self.path + '.dat'):
+            with open(self.path + '.dat', 'wb') as f:
+                f.write(self.get_header())
+
+        # drop half written row when process died while appending
+        size = HEADER.size + self.get_row_count() * self.row_size * 8
+        if os.path.getsize(self.path + '.dat') != size:
+            logger.error(f"Store {self.path} has an incomplete last row, truncating")
+            os.truncate(self.path + '.dat', size)
+
+        self._data_file = open(self.path + '.dat', 'ab')
+        self.get_last_key()
+
+    def close(self):
+        if self._data_file:
+            self._data_file.close()
+        self._data_file = None
+
+    def map(self):
+        """ Return (mmap, memoryview of doubles) of all rows, caller must release both """
+        with open(self.path + '.dat', 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        n = self.get_row_count() * self.row_size
+        return mm, memoryview(mm)[HEADER.size:HEADER.size + n * 8].cast('d')
+
+    def is_sorted(self):
+        """ Return True when every key is bigger than the key before it """
+        if self._is_sorted == None:
+            mm, view = self.map()
+            try:
+                keys = view[::self.row_size].tolist()
+            finally:
+                view.release()
+                mm.close()
+            self._is_sorted = all(a < b for a,b in zip(keys, keys[1:]))
+        return self._is_sorted
+
+    def compact(self):
+        """ Rewrite file in order of key, when a key is stored more than once the last one wins """
+        self.close()
+
+        mm, view = self.map()
+        try:
+            values = view.tolist()
+        finally:
+            view.release()
+            mm.close()
+
+        latest = {values[i] : values[i:i+self.row_size] for i in range(0, len(values), self.row_size)}
+        logger.debug(f"Store {self.path} is not in order, compacting {len(values) // self.row_size} rows to {len(latest)}")
+
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(self.get_header())
+            for k in sorted(latest):
+                f.write(struct.pack(f'<{self.row_size}d', *latest[k]))
+        os.replace(self.path + '.tmp', self.path + '.dat')
+        self._is_sorted = True
+
+    def load(self, start=0, end=None):
+        """ Return rows $start:$end as tuples of add_point() arguments, file must be sorted, see compact() """
+        mm, view = self.map()
+        try:
+            values = view[start * self.row_size:(end * self.row_size if end != None else None)].tolist()
+        finally:
+            view.release()
+            mm.close()
+
+        columns = [values[i::self.row_size] for i in range(self.row_size)]
+
+        # NaN is stored for None
+        for col in columns[1:]:
+            if any(v != v for v in col):
+                col[:] = [None if v != v else v for v in col]
+
+        if self.is_datetime:
+            columns[0] = [datetime.datetime.fromtimestamp(k, datetime.timezone.utc) for k in columns[0]]
+
+        return list(zip(*columns))
+
+    def append(self, rows):
+        """ Append rows of floats """
+        self.open_for_append()
+
+        for row in rows:
+            if self._last_key != None and row[0] <= self._last_key:
+                self._is_sorted = False
+            else:
+                self._last_key = row[0]
+
+        data = array('d', itertools.chain.from_iterable(rows))
+        self._data_file.write(data.tobytes())
+        self._data_file.flush()
+
+    def get_last_key(self):
+        if self._last_key == None and self.get_row_count():
+            mm, view = self.map()
+            try:
+                self._last_key = max(view[::self.row_size])
+            finally:
+                view.release()
+                mm.close()
+        return self._last_key
+
+
+class Store():
+    """ Persistent store, keeps all points of every line in append-only files in directory $path.
+        When a line is added to a plot that has a store, points that were stored by an earlier run can be loaded
+        from a memory map and only new points have to be fetched or parsed. Lines are stored by name, lines
+        that were not given a name get a random one so they are not stored.
+        New points are buffered and written when $flush_rows are buffered or the oldest buffered point
+        is $flush_interval seconds old, so points that were buffered when the process died are not stored.
+        When no points are added, buffered points are written by flush_due(), StoreLoadThread calls it every
+        $flush_interval seconds. """
+    def __init__(self, path, flush_rows=1_000, flush_interval=1):
+        self._path = path
+        self._flush_rows = flush_rows
+        self._flush_interval = flush_interval
+
+        # points are added from different threads
+        self._lock = threading.Lock()
+
+        # {line name: ColumnFile}
+        self._columns = {}
+
+        # {line: line name}, lines are stored under the name they had when they were added
+        self._lines = {}
+
+        # {line name: [(line, rows), ...]}, rows are converted and written on flush
+        self._buffer = {}
+        self._buffered = 0
+        self._t_buffered = None
+
+        self._loaded = 0
+        self._appended = 0
+
+        os.makedirs(path, exist_ok=True)
+        logger.debug(f"Using store: {path}")
+
+    def get_path(self, name):
+        return os.path.join(self._path, quote(name, safe=''))
+
+    def get_column(self, name):
+        """ Return ColumnFile of line name, None when there is no data yet """
+        if name not in self._columns:
+            column = ColumnFile.open(self.get_path(name))
+            if column == None:
+                return
+            self._columns[name] = column
+        return self._columns[name]
+
+    def add_line(self, line):
+        """ Start storing points of line, return amount of stored points that can be loaded with load() """
+        if not line.has_name():
+            logger.debug(f"[{line.name}] Line has no name, not storing points")
+            return 0
+
+        row_size = get_row_size(line)
+        with self._lock:
+            column = self.get_column(line.name)
+            if column == None:
+                count = 0
+            elif column.row_size != row_size:
+                raise ValueError(f"Stored column {line.name} has {column.row_size} values per point, line has {row_size}")
+            else:
+                self.flush(line.name)
+                if not column.is_sorted():
+                    column.compact()
+                count = column.get_row_count()
+            self._lines[line] = line.name
+
+        line.set_store(self)
+        return count
+
+    def remove_line(self, line):
+        """ Stop storing points of line, stored points stay in store """
+        with self._lock:
+            name = self._lines.pop(line, None)
+            if name != None:
+                self.flush(name)
+        line.set_store(None)
+
+    def load(self, line, start=0, end=None):
+        """ Return stored rows $start:$end of line as tuples of add_point() arguments,
+            the rows that were counted by add_line() are in order of key """
+        with self._lock:
+            name = self._lines.get(line)
+            column = self.get_column(name) if name != None else None
+            if column == None:
+                return []
+            rows = column.load(start, end)
+            self._loaded += len(rows)
+        return rows
+
+    def append(self, line, rows):
+        """ Buffer rows of add_point() arguments, they are written when buffer is flushed """
+        if not rows:
+            return
+
+        with self._lock:
+            name = self._lines.get(line)
+            if name == None:
+                return
+
+            self._buffer.setdefault(name, []).append((line, rows))
+            self._buffered += len(rows)
+            if self._t_buffered == None:
+                self._t_buffered = time.monotonic()
+
+            if self._buffered >= self._flush_rows or time.monotonic() - self._t_buffered >= self._flush_interval:
+                self.flush()
+
+    def flush(self, name=None):
+        """ Write buffered rows of line name, or of all lines when name is None, caller must hold the lock """
+        names = [name] if name != None else list(self._buffer)
+        for name in names:
+            buffered = self._buffer.pop(name, [])
+            if not buffered:
+                continue
+
+            line, rows = buffered[0]
+            column = self.get_column(name)
+            if column == None:
+                is_datetime = hasattr(rows[0][0], 'timestamp')
+                column = self._columns[name] = ColumnFile(self.get_path(name), get_row_size(line), is_datetime=is_datetime)
+
+            rows = [to_doubles(row[:column.row_size]) for _, rows in buffered for row in rows]
+            column.append(rows)
+            self._buffered -= len(rows)
+            self._appended += len(rows)
+
+        if not self._buffer:
+            self._buffered = 0
+            self._t_buffered = None
+
+    def flush_due(self):
+        """ Write buffered rows when the oldest buffered point is $flush_interval seconds old """
+        with self._lock:
+            if self._t_buffered != None and time.monotonic() - self._t_buffered >= self._flush_interval:
+                self.flush()
+
+    def get_flush_interval(self):
+        return self._flush_interval
+
+    def get_last_key(self, name):
+        """ Return key of newest stored point of line name, None when nothing is stored """
+        with self._lock:
+            self.flush(name)
+            column = self.get_column(name)
+            return column.get_last_key() if column else None
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for column in self._columns.values():
+                column.close()
+            self._columns = {}
+
+    def get_stats(self):
+        with self._lock:
+            return { 'path'     : self._path,
+                     'columns'  : len(self._columns),
+                     'rows'     : sum(column.get_row_count() for column in self._columns.values()),
+                     'buffered' : self._buffered,
+                     'loaded'   : self._loaded,
+                     'appended' : self._appended }
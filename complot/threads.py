@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
+import os, sys
 import logging
 import threading
+import signal
+import selectors
 import time
+import math
 import curses
-import datetime
+from collections import deque
 
 # import global lock
-from complot import lock
+from complot import lock, terminal_lock, profiler
 
 logger = logging.getLogger('complot')
 
@@ -19,20 +23,23 @@ class WatchThread(threading.Thread):
         self._plot = plot
         self._stopped = False
 
-        # how often to check for new data
-        self._wait_time = .05
-
     def stop(self):
         self._stopped = True
+        self._plot._scheduler.notify()
         logger.debug("Stopping WatchThread")
 
     def run(self):
         logger.debug("Starting WatchThread")
         while not self._stopped:
-            lock.wait_for_lock(name='WatchThread')
-            self._plot.plot()
-            lock.release_lock()
-            time.sleep(self._wait_time)
+            # block until there is something to draw, use idle time to precompute views
+            if not self._plot._scheduler.wait(timeout=self._plot.get_idle_timeout()):
+                self._plot.precompute()
+                continue
+            if self._stopped:
+                break
+
+            with lock.reading(name='WatchThread'):
+                self._plot.plot()
 
 
 class UpdateThread(threading.Thread):
@@ -43,18 +50,17 @@ class UpdateThread(threading.Thread):
         self._interval = interval
         self._stopped = False
 
+        # is set on stop so sleep returns immediately
+        self._stop_event = threading.Event()
+
     def stop(self):
         self._stopped = True
+        self._stop_event.set()
         logger.debug("Stopping UpdateThread")
 
     def non_blocking_sleep(self, seconds):
-        """ Sleep that will not blocking program flow """
-        t_last = datetime.datetime.utcnow()
-        while (t_last + datetime.timedelta(seconds=seconds)) > datetime.datetime.utcnow():
-            if self._stopped:
-                return
-
-            time.sleep(0.1)
+        """ Sleep that returns immediately when thread is stopped """
+        self._stop_event.wait(seconds)
 
     def run(self):
         logger.debug("Starting UpdateThread")
@@ -64,43 +70,528 @@ class UpdateThread(threading.Thread):
         logger.debug("Stopping UpdateThread... done")
 
 
+class IngestThread(threading.Thread):
+    """ Decouples producers from the index.
+        Points are appended to a buffer without taking the global lock, this thread adds them to the index
+        in batches at most every $max_latency seconds so the write lock is taken once per batch.
+        When producers outrun this thread and buffer is full, $policy decides what happens:
+            block:       wait until there is space in buffer
+            drop_oldest: discard oldest buffered point
+            drop_newest: discard new point """
+    policies = ['block', 'drop_oldest', 'drop_newest']
+
+    def __init__(self, max_latency=0.05, max_size=100_000, policy='block'):
+        threading.Thread.__init__(self, daemon=True)
+        if policy not in self.policies:
+            raise ValueError(f"Unknown ingest policy: {policy}, choose from: {', '.join(self.policies)}")
+
+        self._max_latency = max_latency
+        self._max_size = max_size
+        self._policy = policy
+        self._stopped = False
+
+        # appending to a deque is atomic so producers don't need a lock, items are (line, row)
+        self._buffer = deque()
+
+        # set by producers when first point arrives after a drain, set by worker after a drain
+        self._has_data = threading.Event()
+        self._drained = threading.Event()
+
+        # stats
+        self._received = 0
+        self._dropped = 0
+        self._batches = 0
+        self._last_batch = 0
+
+    def stop(self):
+        """ Stop thread after adding remaining buffered points """
+        self._stopped = True
+        self._has_data.set()
+        logger.debug("Stopping IngestThread")
+
+    def put(self, line, row):
+        """ Add row to buffer, is called by line.add_point() """
+        if len(self._buffer) >= self._max_size:
+            if self._policy == 'drop_newest':
+                self._dropped += 1
+                return
+            elif self._policy == 'drop_oldest':
+                try:
+                    self._buffer.popleft()
+                    self._dropped += 1
+                except IndexError:
+                    pass
+            else:
+                while len(self._buffer) >= self._max_size and not self._stopped:
+                    self._drained.clear()
+                    self._has_data.set()
+                    self._drained.wait(self._max_latency)
+
+        self._buffer.append((line, row))
+
+        # only wake up worker when it is waiting
+        if not self._has_data.is_set():
+            self._has_data.set()
+
+    def get_stats(self):
+        return { 'received'   : self._received,
+                 'dropped'    : self._dropped,
+                 'batches'    : self._batches,
+                 'last batch' : self._last_batch,
+                 'buffered'   : len(self._buffer),
+                 'policy'     : self._policy }
+
+    def drain(self):
+        """ Add all buffered points to index, points are grouped by line so every line inserts one batch """
+        amount = len(self._buffer)
+        if not amount:
+            return
+
+        lines = {}
+        for _ in range(amount):
+            line, row = self._buffer.popleft()
+            lines.setdefault(line, []).append(row)
+
+        with lock.writing(name='IngestThread'):
+            for line, rows in lines.items():
+                line.insert_rows(rows)
+
+        for line in lines:
+            line.request_frame()
+
+        self._received += amount
+        self._batches += 1
+        self._last_batch = amount
+        self._drained.set()
+
+    def run(self):
+        logger.debug("Starting IngestThread")
+        while not self._stopped:
+            self._has_data.wait()
+
+            # points that arrive after clearing will set the event again so they're picked up by the next drain
+            self._has_data.clear()
+
+            # give producers some time to fill up the batch
+            if not self._stopped and len(self._buffer) < self._max_size:
+                time.sleep(self._max_latency)
+
+            with profiler.capture('IngestThread'):
+                self.drain()
+
+        self.drain()
+        logger.debug("Stopping IngestThread... done")
+
+
+class StoreLoadThread(threading.Thread):
+    """ Loads points that were stored by an earlier run into lines, see complot.store.
+        Points are loaded newest first in batches of $chunk_size so the write lock is only held for a short time
+        and plot is drawn while older points are still loading.
+        Points that are buffered by the store are written every flush interval, see Store.flush_due() """
+    def __init__(self, store, chunk_size=5_000):
+        threading.Thread.__init__(self, daemon=True)
+        self._store = store
+        self._stopped = False
+        self.chunk_size = chunk_size
+
+        self._cond = threading.Condition()
+
+        # (line, end), stored rows up to $end still have to be loaded
+        self._pending = deque()
+        self._loading = False
+
+        # stats
+        self.loaded = 0
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        logger.debug("Stopping StoreLoadThread")
+
+    def load(self, line, end):
+        """ Load stored rows :$end of line """
+        with self._cond:
+            self._pending.append((line, end))
+            self._cond.notify_all()
+
+    def is_loading(self):
+        return len(self._pending) > 0 or self._loading
+
+    def wait(self, timeout=None):
+        """ Block until all pending lines are loaded, return False on timeout """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._stopped or not self.is_loading(), timeout=timeout)
+
+    def load_line(self, line, end):
+        while end > 0 and not self._stopped:
+            start = max(0, end - self.chunk_size)
+
+            # returns nothing when line was removed from store
+            rows = self._store.load(line, start, end)
+            if not rows:
+                return
+
+            with lock.writing(name='StoreLoadThread'):
+                line.insert_rows(rows, is_history=True)
+            line.request_frame()
+
+            self.loaded += len(rows)
+            end = start
+
+            self._store.flush_due()
+
+    def run(self):
+        logger.debug("Starting StoreLoadThread")
+        while True:
+            with self._cond:
+                if not self._pending and not self._stopped:
+                    self._cond.wait(timeout=self._store.get_flush_interval())
+                if self._stopped:
+                    break
+                job = self._pending.popleft() if self._pending else None
+                self._loading = job != None
+
+            # buffered points of a feed that stopped adding points are written too
+            if job == None:
+                try:
+                    self._store.flush_due()
+                except Exception as e:
+                    logger.error(f"Failed to write buffered points to store: {e}")
+                continue
+
+            line, end = job
+
+            try:
+                self.load_line(line, end)
+            except Exception as e:
+                logger.error(f"[{line.name}] Failed to load points from store: {e}")
+            finally:
+                with self._cond:
+                    self._loading = False
+                    self._cond.notify_all()
+        logger.debug("Stopping StoreLoadThread... done")
+
+
+class RefineJob():
+    """ Computes full resolution groups for one view, is cancelled when view changes.
+        $callback is called without holding the global lock, see Index.refine() """
+    def __init__(self, key, n_buckets, callback):
+        self.key = key
+        self.n_buckets = n_buckets
+        self.callback = callback
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+
+class RefineThread(threading.Thread):
+    """ Progressive rendering for expensive views.
+        When building groups for a view would take longer than $budget seconds, Index draws the view from sampled
+        buckets and submits a job to this thread that builds the full resolution groups and calculates
+        their aggregates. When done, $callback is called so plot is redrawn with the full result.
+        Jobs for views that were not requested in the last frame are cancelled, see end_frame(). """
+    def __init__(self, callback=None, budget=0.05, max_results=8):
+        threading.Thread.__init__(self, daemon=True)
+        self._callback = callback
+        self._budget = budget
+        self._stopped = False
+
+        self._cond = threading.Condition()
+
+        # jobs by key, in order of submission
+        self._pending = {}
+        self._running = None
+
+        # keys of views that were requested in current frame
+        self._requested = set()
+
+        # finished results by job key, oldest are removed when there are more than $max_results
+        self._results = {}
+        self._max_results = max_results
+
+        # measured seconds per bucket to build and aggregate groups, used to estimate cost of a view
+        # before anything is measured we assume 2000 buckets fit in budget
+        self._bucket_time = budget / 2_000
+
+        # incremented on every finished job so plot knows layers need to be drawn again
+        self.version = 0
+
+        # stats
+        self.refined = 0
+        self.cancelled = 0
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            if self._running:
+                self._running.cancel()
+            self._cond.notify()
+        logger.debug("Stopping RefineThread")
+
+    def get_sample_rate(self, n_buckets):
+        """ Use every nth bucket so building the view takes at most $budget seconds, 1 means full resolution """
+        max_buckets = max(1, int(self._budget / self._bucket_time))
+        return math.ceil(n_buckets / max_buckets)
+
+    def is_refining(self):
+        return len(self._pending) > 0 or self._running != None
+
+    def get_result(self, key):
+        return self._results.get(key)
+
+    def submit(self, key, n_buckets, callback):
+        """ Refine view identified by key """
+        with self._cond:
+            self._requested.add(key)
+            if self._running and self._running.key == key and not self._running.is_cancelled():
+                return
+            if key in self._pending:
+                return
+
+            self._pending[key] = RefineJob(key, n_buckets, callback)
+            self._cond.notify()
+
+    def end_frame(self):
+        """ Is called by plot after drawing a frame, cancel jobs for views that are not shown anymore """
+        with self._cond:
+            for key in [key for key in self._pending if key not in self._requested]:
+                del self._pending[key]
+                self.cancelled += 1
+
+            if self._running and self._running.key not in self._requested and not self._running.is_cancelled():
+                self._running.cancel()
+                self.cancelled += 1
+
+            self._requested = set()
+
+    def refine(self, job):
+        t_start = time.perf_counter()
+
+        # callback only holds the global lock while it takes references to the data, so writers don't wait for the refinement
+        groups = job.callback(job)
+
+        # groups are a snapshot of the index so aggregates can be calculated without the lock
+        if groups == None or not all(group.warm(job) for group in groups):
+            return
+
+        elapsed = time.perf_counter() - t_start
+        self._bucket_time = 0.7 * self._bucket_time + 0.3 * (elapsed / max(1, job.n_buckets))
+
+        self._results.pop(job.key, None)
+        self._results[job.key] = groups
+        while len(self._results) > self._max_results:
+            del self._results[next(iter(self._results))]
+
+        self.refined += 1
+        self.version += 1
+        logger.debug(f"Refined view with {job.n_buckets} buckets in {round(elapsed, 3)}s")
+
+        if self._callback:
+            self._callback()
+
+    def run(self):
+        logger.debug("Starting RefineThread")
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+                self._running = self._pending.pop(next(iter(self._pending)))
+
+            try:
+                self.refine(self._running)
+            except Exception as e:
+                logger.error(f"Failed to refine view: {e}")
+            finally:
+                with self._cond:
+                    self._running = None
+        logger.debug("Stopping RefineThread... done")
+
+
 class ListenInputThread(threading.Thread):
-    """ Listen for user input """
-    def __init__(self, stdscr, input_opts, queue):
+    """ Listen for user input.
+        Blocks on stdin until keys are available, all pending keys are read at once so held down keys don't lose steps.
+        A pipe is used to wake up the thread on stop and on terminal resize.
+        The pipe, selector and SIGWINCH handler are set up in start() and cleaned up when thread stops.
+        Widgets that read keys themselves pause this thread so keys are not consumed twice, see pause() """
+    def __init__(self, stdscr, input_opts, queue, callback=None, fd=None):
         threading.Thread.__init__(self)
         self._stopped = False
         self._stdscr = stdscr
         self.queue = queue
         self._input_opts = input_opts
 
+        # is called when there is input to handle, wakes up render loop
+        self._callback = callback
+
         # don't block
         self._stdscr.nodelay(1)
 
-        # TODO this may cause flickering but makes sure we don't have to press an
-        #      extra key to exit
+        # wait for stdin or wakeup pipe to become readable, see start()
+        self._fd = sys.stdin.fileno() if fd == None else fd
+        self._wakeup_r, self._wakeup_w = None, None
+        self._selector = None
+
+        # pipe is closed by this thread while other threads may write to it
+        self._pipe_lock = threading.Lock()
+
+        # set by SIGWINCH handler
+        self._resized = False
+
+        # SIGWINCH handler that was installed before ours, is put back on stop
+        self._old_sigwinch = None
+        self._has_sigwinch = False
+
+        # when we can't handle SIGWINCH, check for KEY_RESIZE every once in a while
+        self._timeout = None
+
+        # cleared while a widget reads keys, pause() takes _read_lock so it waits for a read that is in progress
+        self._active = threading.Event()
+        self._active.set()
+        self._read_lock = threading.Lock()
+
+    def start(self):
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+        # stdin may not be pollable, eg. when it is redirected from a file, fall back to polling
+        try:
+            self._selector.register(self._fd, selectors.EVENT_READ)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Failed to wait for input on fd {self._fd}, polling instead: {e}")
+            self._timeout = 0.1
+
+        # signal handlers can only be installed from main thread
+        try:
+            self._old_sigwinch = signal.signal(signal.SIGWINCH, self.on_resize)
+            self._has_sigwinch = True
+        except ValueError:
+            logger.debug("Failed to install SIGWINCH handler, not in main thread")
+            self._timeout = self._timeout or 1
+        threading.Thread.start(self)
 
     def stop(self):
         logger.debug("Stopping ListenInputThread")
         self._stopped = True
-
-    def run(self):
-        logger.debug("Starting ListenInputThread")
-        while not self._stopped:
-            lock.wait_for_lock(name='ListenInputThread')
-            c = self._stdscr.getch() 
-            lock.release_lock()
-
+        self._active.set()
+        self.wakeup()
+        self.restore_sigwinch()
+
+    def pause(self):
+        """ Stop reading keys, when this returns no keys are being read by this thread """
+        with self._read_lock:
+            self._active.clear()
+
+    def resume(self):
+        self._active.set()
+        self.wakeup()
+
+    def restore_sigwinch(self):
+        """ Put back SIGWINCH handler that was installed before start() """
+        if not self._has_sigwinch:
+            return
+
+        # None means previous handler was not installed from python
+        old = self._old_sigwinch if self._old_sigwinch != None else signal.SIG_DFL
+        try:
+            signal.signal(signal.SIGWINCH, old)
+        except ValueError:
+            logger.debug("Failed to restore SIGWINCH handler, not in main thread")
+            return
+        self._has_sigwinch = False
+        self._old_sigwinch = None
+
+    def wakeup(self):
+        with self._pipe_lock:
+            if self._wakeup_w == None:
+                return
+            try:
+                os.write(self._wakeup_w, b'x')
+            except BlockingIOError:
+                # pipe is full so thread will wake up anyways
+                pass
+
+    def on_resize(self, signum, frame):
+        """ Runs in main thread, only wake up input thread to do the resizing """
+        self._resized = True
+        self.wakeup()
+
+    def resize(self):
+        """ We replaced the curses SIGWINCH handler so tell curses about the new terminal size """
+        try:
+            cols, rows = os.get_terminal_size(self._fd)
+        except OSError as e:
+            logger.error(f"Failed to get terminal size: {e}")
+            return
+        curses.resizeterm(rows, cols)
+
+    def read_input(self):
+        """ Read all pending keys and put corresponding input options on queue, return amount of keys read """
+        # curses is not thread safe, make sure we're not drawing while reading input
+        with lock.writing(name='ListenInputThread'), terminal_lock, self._read_lock:
+            if not self._active.is_set():
+                return 0
+
+            keys = []
+            while (c := self._stdscr.getch()) != -1:
+                keys.append(c)
+
+        for c in keys:
             for inp_opt in self._input_opts:
                 if c in inp_opt.buttons:
                     logger.debug(f"Received input: {inp_opt.name}")
                     self.queue.put(inp_opt)
                     break
+        return len(keys)
+
+    def run(self):
+        logger.debug("Starting ListenInputThread")
+        while not self._stopped:
+            for key,_ in self._selector.select(timeout=self._timeout):
+                if key.fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 1024)
+
+            if self._stopped:
+                break
 
-            curses.flushinp()
-            time.sleep(0.1)
+            # widget is reading keys, stdin stays readable so wait until it's done
+            if not self._active.is_set():
+                self._active.wait()
+                continue
 
+            if self._resized:
+                self._resized = False
+                with lock.writing(name='ListenInputThread'), terminal_lock:
+                    self.resize()
+                if self._callback:
+                    self._callback()
+
+            # also wakes up render loop on KEY_RESIZE
+            if self.read_input() and self._callback:
+                self._callback()
+
+        self.close()
         logger.debug("Stopping ListenInputThread... done")
 
+    def close(self):
+        """ Close selector and wakeup pipe """
+        with self._pipe_lock:
+            if self._selector == None:
+                return
+            self._selector.close()
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._selector = None
+            self._wakeup_r, self._wakeup_w = None, None
+
 
 class UpdateStatusWindowThread(threading.Thread):
     """ Watch data for changes, update plot on change """
@@ -110,18 +601,17 @@ class UpdateStatusWindowThread(threading.Thread):
         self._interval = interval
         self._stopped = False
 
+        # is set on stop so sleep returns immediately
+        self._stop_event = threading.Event()
+
     def stop(self):
         self._stopped = True
+        self._stop_event.set()
         logger.debug("Stopping UpdateStatusWindowThread")
 
     def non_blocking_sleep(self, seconds):
-        """ Sleep that will not blocking program flow """
-        t_last = datetime.datetime.utcnow()
-        while (t_last + datetime.timedelta(seconds=seconds)) > datetime.datetime.utcnow():
-            if self._stopped:
-                return
-
-            time.sleep(0.1)
+        """ Sleep that returns immediately when thread is stopped """
+        self._stop_event.wait(seconds)
 
     def update(self, win):
         out = []
@@ -134,9 +624,9 @@ class UpdateStatusWindowThread(threading.Thread):
         out.append("LINES")
         for line in self._plot._lines:
             out.append(f"name:   {line.name}")
-            out.append(f"points: {len(line._points)}")
+            out.append(f"points: {line.get_point_count()}")
             out.append(f"")
-        out.append(f"total points in plot: {sum(len(line._points) for line in self._plot._lines)}")
+        out.append(f"total points in plot: {sum(line.get_point_count() for line in self._plot._lines)}")
 
         win.erase()
 
@@ -155,11 +645,14 @@ class UpdateStatusWindowThread(threading.Thread):
         win = curses.newwin(height, width, window_y_pos, 0)
         #win.nodelay(100)
 
-        while not self._stopped:
-            self.update(win)
-            self.non_blocking_sleep(self._interval)
-            key = win.getch()
-            if key != -1:
-                break
+        with self._plot._backend.reading_input():
+            while not self._stopped:
+                self.update(win)
+                self.non_blocking_sleep(self._interval)
+                key = win.getch()
+                if key != -1:
+                    break
 
+        # window was drawn over plot
+        self._plot._backend.invalidate()
         logger.debug("Stopping UpdateStatusWindowThread... done")
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+
+import os
+import math
+import time
+import shutil
+import pickle
+import logging
+import datetime
+import tempfile
+import threading
+from array import array
+
+from complot.indexer import Index
+from complot.aggregate import AggregatedGroup, ColumnStore, merge_aggregate
+from complot import metrics, lock
+
+logger = logging.getLogger('complot')
+
+# when there are more points in memory than the budget, spill until this part of the budget is left
+SPILL_TARGET = 0.8
+
+# max amount of points in one segment, as part of the budget
+SEGMENT_SIZE = 0.1
+
+
+def to_float(value):
+    return math.nan if value == None else float(value)
+
+
+def get_template(point):
+    """ Return (class, attributes, aliases, fields) that are needed to recreate points like $point from key and field values.
+        Aliases are (alias, field) pairs of aliases that are stored as attribute, like Point.high """
+    attrs = { k:v for k,v in vars(point).items() if k not in point.fields and k != 'x' }
+    aliases = [(alias, field) for alias, field in point.aliases.items() if alias in attrs]
+    for alias, _ in aliases:
+        attrs.pop(alias)
+    if 'name' in attrs:
+        attrs['name'] = None
+    return (type(point), attrs, aliases, point.fields)
+
+
+def aggregate_column(col, fields):
+    """ Aggregate {key: point} like aggregate_partition(): [count, first key, first row, last key, last row, sums, mins, maxs] """
+    agg = None
+    for k, point in col.items():
+        row = [to_float(getattr(point, field)) for field in fields]
+        if agg == None:
+            agg = [1, k, row, k, row, list(row), list(row), list(row)]
+            continue
+
+        agg[0] += 1
+        if k < agg[1]:
+            agg[1], agg[2] = k, row
+        if k >= agg[3]:
+            agg[3], agg[4] = k, row
+        agg[5] = [a+b for a,b in zip(agg[5], row)]
+        agg[6] = [min(a,b) for a,b in zip(agg[6], row)]
+        agg[7] = [max(a,b) for a,b in zip(agg[7], row)]
+    return agg
+
+
+class Segment():
+    """ Points of a range of buckets that are spilled to a file. Points are stored as arrays of doubles per column,
+        aggregates of every bucket stay in memory as one flat array per column:
+            bucket key, count, first key, last key, first row, last row, sums, mins, maxs """
+    def __init__(self, path, start_key, end_key):
+        self.path = path
+
+        # segment spans buckets: start_key <= bucket key < end_key
+        self.start_key = start_key
+        self.end_key = end_key
+
+        self.size = 0
+
+        # {column: (class, attributes, aliases, fields)}, see get_template()
+        self.templates = {}
+
+        # {column: amount of points}
+        self.counts = {}
+
+        # {column: array of aggregates}
+        self.aggregates = {}
+
+    @property
+    def points(self):
+        return sum(self.counts.values())
+
+    def write(self, buckets):
+        """ Write points of {bucket key: bucket} to file and keep aggregates """
+        data = {}
+        for bucket_key, bucket in buckets.items():
+            for col_name, col in bucket.items():
+                if not col:
+                    continue
+
+                if col_name not in self.templates:
+                    template = self.templates[col_name] = get_template(next(iter(col.values())))
+                    self.counts[col_name] = 0
+                    self.aggregates[col_name] = array('d')
+                    data[col_name] = ([], [[] for _ in template[3]], [])
+
+                fields = self.templates[col_name][3]
+                keys, values, names = data[col_name]
+                for k, point in col.items():
+                    keys.append(k)
+                    for field_values, field in zip(values, fields):
+                        field_values.append(to_float(getattr(point, field)))
+                    names.append(getattr(point, 'name', None))
+
+                count, first_key, first, last_key, last, sums, mins, maxs = aggregate_column(col, fields)
+                self.aggregates[col_name].extend([bucket_key, count, first_key, last_key] + first + last + sums + mins + maxs)
+                self.counts[col_name] += count
+
+        # names are only stored when points have them
+        payload = { col_name : (array('d', keys).tobytes(),
+                                [array('d', field_values).tobytes() for field_values in values],
+                                names if any(name != None for name in names) else None)
+                    for col_name, (keys, values, names) in data.items() }
+
+        with open(self.path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.size = os.path.getsize(self.path)
+
+    def read(self):
+        """ Yield (column, key, point) for all points in segment """
+        with open(self.path, 'rb') as f:
+            payload = pickle.load(f)
+
+        for col_name, (keys, values, names) in payload.items():
+            # column is removed
+            if col_name not in self.templates:
+                continue
+
+            cls, attrs, aliases, fields = self.templates[col_name]
+            keys = array('d', keys)
+            values = [array('d', field_values) for field_values in values]
+
+            for i,k in enumerate(keys):
+                point = cls.__new__(cls)
+                point.__dict__.update(attrs)
+                point.x = k
+                for field, field_values in zip(fields, values):
+                    v = field_values[i]
+                    setattr(point, field, None if v != v else v)
+                for alias, field in aliases:
+                    setattr(point, alias, getattr(point, field))
+                if names:
+                    point.name = names[i]
+                yield col_name, k, point
+
+    def iter_aggregates(self, col_name):
+        """ Yield (bucket key, aggregate) in the format of aggregate_column() """
+        n = len(self.templates[col_name][3])
+        size = 4 + 5*n
+        aggregates = self.aggregates[col_name]
+        for i in range(0, len(aggregates), size):
+            a = aggregates[i:i+size].tolist()
+            yield a[0], [int(a[1]), a[2], a[4:4+n], a[3], a[4+n:4+2*n], a[4+2*n:4+3*n], a[4+3*n:4+4*n], a[4+4*n:4+5*n]]
+
+    def get_first_key(self):
+        return min((agg[1] for col_name in self.templates for _, agg in self.iter_aggregates(col_name)), default=None)
+
+    def get_last_key(self, col_name=None):
+        columns = [col_name] if col_name else list(self.templates)
+        return max((agg[3] for col in columns if col in self.templates for _, agg in self.iter_aggregates(col)), default=None)
+
+    def remove_column(self, col_name):
+        self.templates.pop(col_name, None)
+        self.counts.pop(col_name, None)
+        self.aggregates.pop(col_name, None)
+
+    def delete(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class TieredIndex(Index):
+    """ Index that keeps about $max_points points in memory. When there are more, points in the oldest buckets are spilled
+        to segment files in directory $path. Buckets themselves stay so group boundaries don't change.
+        Spilled points are paged in again when a view, range query or insert needs them, the buckets of the view that
+        was drawn last are never spilled. Fit all views are built from the aggregates of spilled buckets that stay in memory.
+        When $path is None, a temporary directory is used that is removed on shutdown """
+    def __init__(self, amount, spread, max_points=1_000_000, path=None):
+        Index.__init__(self, amount, spread)
+        self._max_points = max_points
+        self._segment_points = max(1, int(max_points * SEGMENT_SIZE))
+
+        self._is_temporary = path == None
+        self._path = path if path else tempfile.mkdtemp(prefix='complot-segments-')
+        os.makedirs(self._path, exist_ok=True)
+
+        # spilled segments, sorted by start key
+        self._segments = []
+        self._segment_counter = 0
+
+        # estimate of the amount of points in memory, is counted again before spilling
+        self._hot_points = 0
+
+        # arguments of last view that was drawn: (group size, end key, amount), its buckets are not spilled
+        self._view = None
+
+        # {(group size, end key, amount): view range}, finding bounds is too slow to do on every frame
+        self._view_ranges = {}
+        self._view_ranges_version = None
+
+        # readers like the render thread and RefineThread only hold the global read lock, but page in and spill change buckets.
+        # paging in, building groups from the buckets and spilling is done while holding this lock
+        self._tier_lock = threading.RLock()
+
+        # stats
+        self._spilled = 0
+        self._paged_in = 0
+
+    def insert(self, col_name, k, v):
+        with self._tier_lock:
+            self.page_in(k, k+1)
+            Index.insert(self, col_name, k, v)
+            self._hot_points += 1
+            if self._hot_points > self._max_points:
+                self.spill()
+
+    def insert_many(self, col_name, items):
+        if not items:
+            return
+
+        with self._tier_lock:
+            self.page_in(min(k for k,_ in items), max(k for k,_ in items) + 1)
+            Index.insert_many(self, col_name, items)
+            self._hot_points += len(items)
+            if self._hot_points > self._max_points:
+                self.spill()
+
+    def get_view_range(self, group_size, end_key, amount):
+        """ Return (start key, end key) of buckets in view, None when view is outside index """
+        if self._view_ranges_version != self._last_update:
+            self._view_ranges = {}
+            self._view_ranges_version = self._last_update
+
+        view = (group_size, end_key, amount)
+        if view in self._view_ranges:
+            return self._view_ranges[view]
+
+        keys, _ = self.get_keys_values(updated=self._is_updated)
+        try:
+            bounds = self.get_group_bounds(group_size, end_key, amount)
+        except ValueError:
+            return
+
+        starts = [keys[s] for s,_,_ in bounds if s >= 0]
+        self._view_ranges[view] = (starts[0], starts[-1] + group_size) if starts else None
+        return self._view_ranges[view]
+
+    def is_cold(self, start_key, end_key):
+        """ Check if any bucket in range is spilled """
+        return any(s.start_key < end_key and start_key < s.end_key for s in self._segments)
+
+    def page_in(self, start_key, end_key):
+        """ Load segments that contain keys: start_key <= k < end_key back into their buckets """
+        if not self._segments or start_key >= self._segments[-1].end_key:
+            return
+
+        with self._tier_lock:
+            for segment in [s for s in self._segments if s.start_key < end_key and start_key < s.end_key]:
+                t_start = time.perf_counter()
+                for col_name, k, point in segment.read():
+                    bucket = self._index[self.get_index_key(k)]
+                    col = bucket.get(col_name)
+                    if col == None:
+                        col = bucket[col_name] = {}
+
+                    # points that were inserted after segment was spilled are newer
+                    col.setdefault(k, point)
+
+                self._segments.remove(segment)
+                segment.delete()
+                self._hot_points += segment.points
+
+                # points are back before the last point
+                self._backfilled += 1
+                self._paged_in += 1
+
+                if metrics.enabled:
+                    metrics.record('index.page_in', time.perf_counter() - t_start)
+                logger.debug(f"Paged in {segment.points} points [{segment.start_key}:{segment.end_key}]")
+
+    def spill(self):
+        """ Spill points in oldest buckets to segments until enough memory is left.
+            Buckets in view and the last bucket, that receives new points, stay in memory """
+        with self._tier_lock:
+            self._hot_points = sum(len(col) for bucket in self._index.values() for col in bucket.values())
+            if self._hot_points <= self._max_points:
+                return
+
+            t_start = time.perf_counter()
+            target = int(self._max_points * SPILL_TARGET)
+            keys, values = self.get_keys_values(updated=self._is_updated)
+            last_key = self.get_index_key(self._index_max_key)
+            view = self.get_view_range(*self._view) if self._view else None
+
+            # segments don't overlap and are sorted, so walk them along with the buckets to find spilled buckets
+            spilled = [(s.start_key, s.end_key) for s in self._segments]
+            spilled_i = 0
+
+            run = {}
+            run_points = 0
+            for bucket_key, bucket in zip(keys, values):
+                if self._hot_points - run_points <= target:
+                    break
+
+                while spilled_i < len(spilled) and spilled[spilled_i][1] <= bucket_key:
+                    spilled_i += 1
+
+                in_view = view != None and view[0] <= bucket_key < view[1]
+                is_spilled = spilled_i < len(spilled) and spilled[spilled_i][0] <= bucket_key
+
+                if in_view or is_spilled or bucket_key >= last_key:
+                    if run_points:
+                        self.write_segment(run, run_points)
+                    run, run_points = {}, 0
+                    continue
+
+                run[bucket_key] = bucket
+                run_points += sum(len(col) for col in bucket.values())
+                if run_points >= self._segment_points:
+                    self.write_segment(run, run_points)
+                    run, run_points = {}, 0
+
+            self.write_segment(run, run_points)
+
+            # cached groups hold on to spilled points
+            self._cache.cleanup(datetime.datetime.utcnow())
+            self._coarse = (None, None)
+
+            if metrics.enabled:
+                metrics.record('index.spill', time.perf_counter() - t_start)
+            logger.debug(f"Spilled to {len(self._segments)} segments, {self._hot_points} points in memory")
+
+    def write_segment(self, run, run_points):
+        """ Spill {bucket key: bucket} to a new segment """
+        if not run_points:
+            return
+
+        bucket_keys = list(run)
+        segment = Segment(os.path.join(self._path, f"segment-{self._segment_counter}.seg"), bucket_keys[0], bucket_keys[-1] + self._index_spread)
+        self._segment_counter += 1
+        segment.write(run)
+
+        # empty buckets in place so sorted index values stay valid
+        for bucket in run.values():
+            bucket.clear()
+
+        # Index.refine() copies buckets without holding a lock, copies that were made while spilling are discarded
+        self._generation += 1
+
+        self._segments.append(segment)
+        self._segments.sort(key=lambda s: s.start_key)
+        self._hot_points -= run_points
+        self._spilled += 1
+
+    def get_grouped(self, group_size, end_key, amount, parallel=False, priority='normal'):
+        with self._tier_lock:
+            if self._segments and self.has_data() and (group_size % self._index_spread) == 0:
+                view = self.get_view_range(group_size, end_key, amount)
+                if view and self.is_cold(*view):
+                    # aggregator only sees points in memory
+                    if parallel:
+                        return self.get_aggregated(group_size, end_key, amount)
+                    self.page_in(*view)
+
+            # view that is drawn stays in memory
+            if not parallel and priority != 'low':
+                self._view = (group_size, end_key, amount)
+
+            if self._hot_points > self._max_points:
+                self.spill()
+
+            return Index.get_grouped(self, group_size, end_key, amount, parallel=parallel, priority=priority)
+
+    def refine(self, group_size, end_key, amount, parallel, job):
+        """ Page in view before Index.refine() takes references to its buckets """
+        with lock.reading(name='RefineThread'), self._tier_lock:
+            if self.has_data():
+                view = self.get_view_range(group_size, end_key, amount)
+                if view and self.is_cold(*view):
+                    self.page_in(*view)
+
+            # aggregator iterates over all buckets while the lock is held
+            if parallel and self.use_aggregator():
+                return Index.refine(self, group_size, end_key, amount, parallel, job)
+
+        return Index.refine(self, group_size, end_key, amount, parallel, job)
+
+    def get_aggregated(self, group_size, end_key, amount):
+        """ Return AggregatedGroups for view, spilled buckets are aggregated from the aggregates that are kept in memory """
+        metadata = {'end_key'   : end_key,
+                    'amount'    : amount,
+                    'group_size': group_size,
+                    'parallel'  : True}
+
+        # spilling changes segments and buckets
+        with self._tier_lock:
+            groups = self._cache.get(metadata, dt=self._last_update)
+            if groups:
+                return groups
+
+            t_start = time.perf_counter()
+            keys, values = self.get_keys_values(updated=self._is_updated)
+            bounds = self.get_group_bounds(group_size, end_key, amount)
+            starts = [keys[s] for s,_,_ in bounds if s >= 0]
+            base_key = starts[0]
+
+            stores = {}
+            merged = {}
+
+            # buckets in memory
+            for s,e,_ in bounds:
+                if s < 0:
+                    continue
+                g = int((keys[s] - base_key) // group_size)
+                for bucket in values[s:e]:
+                    for col_name, col in bucket.items():
+                        if not col:
+                            continue
+                        if col_name not in stores:
+                            point = next(iter(col.values()))
+                            stores[col_name] = ColumnStore(point.fields, point.aliases)
+                        merge_aggregate(merged.setdefault(col_name, {}), g, aggregate_column(col, stores[col_name].fields))
+
+            # spilled buckets
+            for segment in list(self._segments):
+                if segment.end_key <= base_key or segment.start_key >= starts[-1] + group_size:
+                    continue
+                for col_name, (cls, attrs, aliases, fields) in segment.templates.items():
+                    if col_name not in stores:
+                        stores[col_name] = ColumnStore(fields, cls.aliases)
+                    for bucket_key, agg in segment.iter_aggregates(col_name):
+                        g = int((bucket_key - base_key) // group_size)
+                        if 0 <= g < len(starts):
+                            merge_aggregate(merged.setdefault(col_name, {}), g, agg)
+
+            groups = []
+            g = 0
+            for s,_,count in bounds:
+                if s < 0:
+                    groups.append(AggregatedGroup(None, None, count, stores, {}))
+                    continue
+                aggregates = {col_name : columns[g] for col_name, columns in merged.items() if g in columns}
+                groups.append(AggregatedGroup(keys[s], keys[s] + group_size, count, stores, aggregates))
+                g += 1
+
+            self._cache.add(metadata, groups)
+            if metrics.enabled:
+                metrics.record('index.get_grouped.aggregated', time.perf_counter() - t_start)
+            return groups
+
+    def iter_range(self, columns, start_key, end_key):
+        # points are collected before another reader can spill them
+        with self._tier_lock:
+            self.page_in(start_key, end_key)
+            return iter(list(Index.iter_range(self, columns, start_key, end_key)))
+
+    def get_last_value(self, col_name):
+        with self._tier_lock:
+            value = Index.get_last_value(self, col_name)
+
+            # column may have newer points in a spilled segment
+            segments = [s for s in self._segments if col_name in s.templates]
+            if segments:
+                segment = max(segments, key=lambda s: s.end_key)
+                if value == None or segment.get_last_key(col_name) > value.x:
+                    self.page_in(segment.start_key, segment.end_key)
+                    value = Index.get_last_value(self, col_name)
+            return value
+
+    def evict(self, key):
+        with self._tier_lock:
+            for segment in list(self._segments):
+                if segment.end_key <= key:
+                    self._segments.remove(segment)
+                    segment.delete()
+                elif segment.start_key < key:
+                    self.page_in(segment.start_key, segment.end_key)
+
+            Index.evict(self, key)
+
+            # first and last point may be spilled
+            if self._segments:
+                first = min(s.get_first_key() for s in self._segments)
+                last = max(s.get_last_key() for s in self._segments)
+                if self._index_min_key == None or first < self._index_min_key:
+                    self._index_min_key = first
+                if self._index_max_key == None or last > self._index_max_key:
+                    self._index_max_key = last
+
+    def remove_column(self, col_name):
+        with self._tier_lock:
+            for segment in list(self._segments):
+                segment.remove_column(col_name)
+                if not segment.templates:
+                    self._segments.remove(segment)
+                    segment.delete()
+            Index.remove_column(self, col_name)
+
+    def reset_index(self):
+        with self._tier_lock:
+            for segment in self._segments:
+                segment.delete()
+            self._segments = []
+            self._hot_points = 0
+            Index.reset_index(self)
+
+    def shutdown(self):
+        Index.shutdown(self)
+        with self._tier_lock:
+            for segment in self._segments:
+                segment.delete()
+            self._segments = []
+        if self._is_temporary:
+            shutil.rmtree(self._path, ignore_errors=True)
+
+    def get_tier_stats(self):
+        segments = list(self._segments)
+        return { 'hot points'  : self._hot_points,
+                 'cold points' : sum(s.points for s in segments),
+                 'segments'    : len(segments),
+                 'disk bytes'  : sum(s.size for s in segments),
+                 'spilled'     : self._spilled,
+                 'paged in'    : self._paged_in }
@@ -6,7 +6,8 @@ import logging
 import time
 from pprint import pprint, pformat
 
-from complot import errors_list, lock
+from complot import errors_list, lock, metrics, profiler
+from complot.utils import format_ms
 from complot.widgets import ScrollableWindow, MenuWidget
 from complot.threads import UpdateStatusWindowThread
 from complot.lines import Line
@@ -75,6 +76,7 @@ class InputCallbacks():
         self.state['show grid'].reset()
         self.state['show last values'].reset()
         self.state['show legend'].reset()
+        self.state['show hud'].reset()
 
         self._state_x_bin_window = self._default_x_bin_window
 
@@ -93,10 +95,31 @@ class InputCallbacks():
                 line.toggle_enabled()
                 break
 
+    def toggle_lock_stats(self, item, args):
+        lock.set_stats_enabled(item.state)
+
+    def toggle_metrics(self, item, args):
+        metrics.set_enabled(item.state)
+
+    def dump_metrics(self, item, args):
+        metrics.dump('complot_metrics.json')
+
+    def start_profile(self, item, args):
+        """ Profile the next frames, result is shown when done """
+        profiler.start()
+        self._scheduler.request('input')
+
+    def show_profile(self, report):
+        path, lines = report
+        win = ScrollableWindow(self._backend._stdscr, backend=self._backend)
+        width = self._backend.get_cols() - 16
+        win.run([line[:width] for line in reversed(lines)])
+        self._scheduler.request('input')
+
     def show_log(self, item, args):
         out = errors_list.getvalue().split('\n')
         out = [f"{len(out)-i}  {l}" for i,l in enumerate(reversed(out)) if l]
-        menu = MenuWidget(self._backend._stdscr)
+        menu = MenuWidget(self._backend._stdscr, backend=self._backend)
         menu.run(out)
 
     def show_status(self, item, args):
@@ -107,15 +130,59 @@ class InputCallbacks():
         out.append(f"plot cols: {self._backend.get_plot_cols()}")
         out.append(f"plot rows: {self._backend.get_plot_rows()}")
         out.append("")
+        out.append("BACKEND")
+        out.append(f"type: {self._backend.__class__.__name__}")
+        for k,v in self._backend.get_stats().items():
+            out.append(f"{k}: {v}")
+        out.append("")
         out.append("LINES")
         for line in self._lines:
             out.append(f"name:   {line.name}")
-            out.append(f"points: {len(line._points)}")
+            out.append(f"points: {line.get_point_count()}")
             out.append(f"")
-        out.append(f"total points in plot: {sum(len(line._points) for line in self._lines)}")
+        out.append(f"total points in plot: {sum(line.get_point_count() for line in self._lines)}")
+        out.append("")
+        if self._source_scheduler.get_sources():
+            out.append("SOURCES")
+            for source in self._source_scheduler.get_sources():
+                stats = source.get_stats()
+                latency = stats['latency']
+                out.append(f"{source.name}: every {stats['interval']}s, runs {stats['runs']}, errors {stats['errors']}, skipped {stats['skipped']}")
+                out.append(f"    latency: p50 {format_ms(latency['p50'])}  p99 {format_ms(latency['p99'])}  max {format_ms(latency['max'])}")
+                if stats['last error']:
+                    out.append(f"    last error: {stats['last error']}")
+            out.append("")
+        if self._ingest_thread:
+            out.append("INGEST")
+            for k,v in self._ingest_thread.get_stats().items():
+                out.append(f"{k}: {v}")
+            out.append("")
+        out.append("CACHE")
+        for k,v in self._data.get_cache_stats().items():
+            out.append(f"{k}: {v}")
+        out.append("")
+        out.append("METRICS")
+        if not metrics.is_enabled():
+            out.append("metrics are disabled, enable with 'Metrics' in menu")
+        stats = metrics.get_stats()
+        for name, value in stats['counters'].items():
+            out.append(f"{name}: {value}")
+        for name, value in stats['gauges'].items():
+            out.append(f"{name}: {value}")
+        for name, hist in stats['histograms'].items():
+            out.append(f"{name}: n {hist['count']}  p50 {format_ms(hist['p50'])}  p95 {format_ms(hist['p95'])}  p99 {format_ms(hist['p99'])}")
+        out.append("")
+        out.append("LOCK")
+        if not lock.stats_enabled():
+            out.append("stats are disabled, enable with 'Lock stats' in menu")
+        for name, stats in lock.get_stats().items():
+            wait, hold = stats['wait'], stats['hold']
+            out.append(f"{name}: contended {stats['contended']}/{wait['count']}")
+            out.append(f"    wait: p50 {format_ms(wait['p50'])}  p99 {format_ms(wait['p99'])}  max {format_ms(wait['max'])}")
+            out.append(f"    hold: p50 {format_ms(hold['p50'])}  p99 {format_ms(hold['p99'])}  max {format_ms(hold['max'])}")
 
         out = list(reversed(out))
-        menu = MenuWidget(self._backend._stdscr)
+        menu = MenuWidget(self._backend._stdscr, backend=self._backend)
         menu.run(out)
 
     def draw_line(self, item, args):
@@ -126,7 +193,7 @@ class InputCallbacks():
         line = Line()
 
         options = ['Left Y axis', 'Right Y axis']
-        menu = MenuWidget(self._backend._stdscr)
+        menu = MenuWidget(self._backend._stdscr, backend=self._backend)
         result = menu.run(options)
 
         if result == 'Left Y axis':
@@ -140,10 +207,9 @@ class InputCallbacks():
 
 
         while cursor:
-            lock.wait_for_lock(debug=True, name='draw_line')
-            cursor = self._backend.select_point(*cursor, callback=self.draw)
-            bins = self._data.get_bins(self._backend.get_plot_cols())
-            lock.release_lock()
+            with lock.reading(name='draw_line'):
+                cursor = self._backend.select_point(*cursor, callback=self.draw)
+                bins = self._data.get_bins(self._backend.get_plot_cols())
 
             if cursor:
                 b = bins[cursor[X]]
@@ -168,5 +234,5 @@ class InputCallbacks():
                 self.draw()
 
         logger.debug(f"exzit")
-        logger.debug(f"points: {line._points}")
+        logger.debug(f"points: {line.get_point_count()}")
 
@@ -1,69 +1,400 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import time
 import logging
 import math
-import inspect
+import threading
+from contextlib import contextmanager
 
 logger = logging.getLogger('complot')
 
 
 def timeit(func):
-    """ Decorator that displays execution time """
-    def function_wrapper(*args, **kwargs):
-        t_start = time.time()
-        res = func(*args, **kwargs)
-        logger.debug(f"[{func.__name__}] exec time: {round(time.time()-t_start, 4)} s")
-        return res
-    return function_wrapper
+    """ Decorator that records execution time in the metrics registry under the function name.
+        Nothing is recorded while metrics are disabled """
+    # imported here because metrics module depends on this module
+    from complot.metrics import metrics
+    return metrics.timed()(func)
+
+
+def format_ms(seconds, decimals=2):
+    """ Format seconds as milliseconds string """
+    if seconds == None:
+        return '-'
+    return f"{round(seconds * 1000, decimals)}ms"
+
+
+def get_memory_usage():
+    """ Return resident memory of this process in bytes, falls back to peak memory when current memory is not available """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+    # linux reports kilobytes, macos bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def format_bytes(amount):
+    """ Format amount of bytes as human readable string """
+    if amount == None:
+        return '-'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if amount < 1024:
+            return f"{round(amount, 1)}{unit}"
+        amount /= 1024
+    return f"{round(amount, 1)}TB"
 
 
 class Timer():
-    def __init__(self):
+    """ Records the time between two check() calls with the same name in the metrics registry as 'timer.<name>' """
+    def __init__(self, registry=None):
+        self._registry = registry
         self._timers = {}
-        self._counter = 0
 
     def check(self, name='default'):
-        if not name in self._timers.keys():
-            self.set(name)
+        if self._registry == None or not self._registry.enabled:
+            return
 
-        logger.debug(f"{self._counter}: {time.time() - self._timers[name]} sec")
-        self._counter += 1
-        self.set(name)
+        now = time.perf_counter()
+        if name in self._timers:
+            self._registry.record(f"timer.{name}", now - self._timers[name])
+        self._timers[name] = now
 
     def set(self, name='default'):
-        self._timers[name] = time.time()
+        self._timers[name] = time.perf_counter()
+
+
+class Histogram():
+    """ Log-linear (HDR style) histogram, values are counted in buckets that have a fixed relative precision.
+        Recording is cheap and memory doesn't grow with the amount of recorded values.
+        Values are recorded from different threads, updates and reads hold a lock """
+    def __init__(self, sub_buckets=16):
+        # amount of buckets per power of two, determines precision
+        self._sub_buckets = sub_buckets
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._buckets = {}
+
+        # values <= 0 don't fit in a log scale
+        self._zeros = 0
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        if value > 0:
+            # value = m * 2**e where 0.5 <= m < 1
+            m, e = math.frexp(value)
+            key = e * self._sub_buckets + int((m - 0.5) * 2 * self._sub_buckets)
+
+        with self._lock:
+            self.count += 1
+            self.total += value
+
+            if self.min == None or value < self.min:
+                self.min = value
+            if self.max == None or value > self.max:
+                self.max = value
+
+            if value <= 0:
+                self._zeros += 1
+            else:
+                self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def get_bucket_upper(self, key):
+        """ Return highest value that fits in bucket """
+        e, sub = divmod(key, self._sub_buckets)
+        return math.ldexp(0.5 + (sub+1) / (2*self._sub_buckets), e)
+
+    def get_percentile(self, percentile):
+        """ Return value at percentile, value is accurate within bucket precision, caller must hold the lock
+            when values are recorded meanwhile, see get_stats() """
+        if not self.count:
+            return None
+
+        target = self.count * percentile / 100
+        seen = self._zeros
+        if seen >= target:
+            return min(0, self.max)
+
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if seen >= target:
+                return min(self.get_bucket_upper(key), self.max)
+        return self.max
+
+    def get_mean(self):
+        return self.total / self.count if self.count else None
+
+    def merge(self, histogram):
+        """ Add values of other histogram to this one """
+        with histogram._lock:
+            buckets = dict(histogram._buckets)
+            zeros, count, total = histogram._zeros, histogram.count, histogram.total
+            h_min, h_max = histogram.min, histogram.max
+
+        with self._lock:
+            for key, n in buckets.items():
+                self._buckets[key] = self._buckets.get(key, 0) + n
+            self._zeros += zeros
+            self.count += count
+            self.total += total
+
+            if h_min != None and (self.min == None or h_min < self.min):
+                self.min = h_min
+            if h_max != None and (self.max == None or h_max > self.max):
+                self.max = h_max
+
+    def reset(self):
+        with self._lock:
+            self.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return { 'count' : self.count,
+                     'mean'  : self.get_mean(),
+                     'min'   : self.min,
+                     'max'   : self.max,
+                     'p50'   : self.get_percentile(50),
+                     'p95'   : self.get_percentile(95),
+                     'p99'   : self.get_percentile(99) }
 
 
 class Lock():
-    """ Does lock things """
+    """ Reader/writer lock that is shared by the threads that change and draw the data.
+        Readers (rendering) can hold the lock at the same time, writers (adding points) get exclusive access.
+        Waiting writers have preference over new readers so a busy render loop can't starve ingestion.
+        A thread that holds the lock can lock again without blocking itself.
+        When stats are enabled, wait and hold times are recorded per lock holder name.
+        NOTE readers don't get a snapshot of the data. A render holds the read lock while the frame is drawn on
+             layers, the layers are then written to terminal without it, see Plot.draw_layers() """
     def __init__(self):
-        self._locked = False
-        self._holder = None
+        self._cond = threading.Condition(threading.Lock())
+
+        # amount of threads holding a read lock
+        self._readers = 0
+
+        # thread id of writer that holds the lock and its lock depth
+        self._writer = None
+        self._writer_depth = 0
+
+        # amount of writers that are waiting, new readers wait for them
+        self._writers_waiting = 0
+
+        # keep track of read lock depth per thread
+        self._local = threading.local()
+
+        # names of current lock holders by thread id
+        self._holders = {}
         self._debugging = False
 
-    def is_locked(self):
-        return self._locked
+        # wait/hold time histograms by holder name, None when disabled
+        self._stats = None
 
-    def do_lock(self):
-        self._locked = True
+        # time and name of current write lock holder, used for hold time stats
+        self._write_start = None
+        self._write_name = None
 
-    def release_lock(self):
-        self._locked = False
-        self._holder = None
+    def is_locked(self):
+        return self._writer != None or self._readers > 0
+
+    def get_holders(self):
+        return list(self._holders.values())
 
     def set_debugging(self, state):
         self._debugging = state
 
-    def wait_for_lock(self, name='default', debug=False):
-        if debug or self._debugging:
-            class_name = inspect.stack()[1][0].f_locals['self'].__class__.__name__
-            method_name = inspect.stack()[1][3]
+    def set_stats_enabled(self, state):
+        """ Start/stop recording wait and hold times """
+        with self._cond:
+            if state and self._stats == None:
+                self._stats = {}
+            elif not state:
+                self._stats = None
+
+    def stats_enabled(self):
+        return self._stats != None
+
+    def reset_stats(self):
+        with self._cond:
+            if self._stats != None:
+                self._stats = {}
+
+    def get_stats(self):
+        """ Return wait and hold time statistics in seconds by lock holder name """
+        with self._cond:
+            if self._stats == None:
+                return {}
+
+            return { name : { 'contended' : stats['contended'],
+                              'wait'      : stats['wait'].get_stats(),
+                              'hold'      : stats['hold'].get_stats() }
+                     for name, stats in self._stats.items() }
+
+    def record_wait(self, name, t_start, contended):
+        """ Record time it took to acquire the lock, must be called while holding self._cond """
+        stats = self._stats.get(name)
+        if stats == None:
+            stats = { 'wait' : Histogram(), 'hold' : Histogram(), 'contended' : 0 }
+            self._stats[name] = stats
+
+        stats['wait'].record(time.perf_counter() - t_start)
+        if contended:
+            stats['contended'] += 1
+
+    def record_hold(self, name, t_start):
+        """ Record time lock was held, must be called while holding self._cond """
+        stats = self._stats.get(name)
+        if stats != None and t_start != None:
+            stats['hold'].record(time.perf_counter() - t_start)
+
+    def get_read_depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    def acquire_read(self, name='default', debug=False):
+        """ Wait until there are no writers and acquire a shared lock """
+        ident = threading.get_ident()
+
+        # already holding a lock in this thread
+        if self._writer == ident:
+            self._writer_depth += 1
+            return
+        if self.get_read_depth():
+            self._local.depth += 1
+            return
+
+        t_start = time.perf_counter() if self._stats != None else None
+
+        with self._cond:
+            contended = False
+            while self._writer != None or self._writers_waiting:
+                if debug or self._debugging:
+                    logger.debug(f"[{name}] is waiting for read lock that is held by {self.get_holders()}...")
+                contended = True
+                self._cond.wait()
+
+            self._readers += 1
+            self._holders[ident] = name
+
+            if self._stats != None and t_start != None:
+                self.record_wait(name, t_start, contended)
+                self._local.start = time.perf_counter()
+            else:
+                self._local.start = None
+
+        self._local.depth = 1
+        self._local.name = name
+
+    def release_read(self):
+        ident = threading.get_ident()
+
+        if self._writer == ident:
+            self.release_write()
+            return
+
+        depth = self.get_read_depth()
+        if not depth:
+            raise RuntimeError("Can't release a read lock that is not held by this thread")
 
-        while self.is_locked():
-            if debug or self._debugging:
-                logger.debug(f"[{class_name}.{method_name}] is waiting for lock that is held by {self._holder}...")
-            time.sleep(0.01)
+        self._local.depth = depth - 1
+        if self._local.depth:
+            return
 
-        self._holder = name
-        self.do_lock()
+        with self._cond:
+            if self._stats != None:
+                self.record_hold(self._local.name, self._local.start)
+
+            self._readers -= 1
+            self._holders.pop(ident, None)
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self, name='default', debug=False):
+        """ Wait until all readers and writers are done and acquire an exclusive lock """
+        ident = threading.get_ident()
+
+        if self._writer == ident:
+            self._writer_depth += 1
+            return
+
+        if self.get_read_depth():
+            raise RuntimeError(f"[{name}] Can't upgrade a read lock to a write lock")
+
+        t_start = time.perf_counter() if self._stats != None else None
+
+        with self._cond:
+            contended = False
+            self._writers_waiting += 1
+            while self._writer != None or self._readers:
+                if debug or self._debugging:
+                    logger.debug(f"[{name}] is waiting for write lock that is held by {self.get_holders()}...")
+                contended = True
+                self._cond.wait()
+            self._writers_waiting -= 1
+
+            self._writer = ident
+            self._writer_depth = 1
+            self._holders[ident] = name
+
+            if self._stats != None and t_start != None:
+                self.record_wait(name, t_start, contended)
+                self._write_start = time.perf_counter()
+            else:
+                self._write_start = None
+            self._write_name = name
+
+    def release_write(self):
+        if self._writer != threading.get_ident():
+            raise RuntimeError("Can't release a write lock that is held by another thread")
+
+        self._writer_depth -= 1
+        if self._writer_depth:
+            return
+
+        with self._cond:
+            if self._stats != None:
+                self.record_hold(self._write_name, self._write_start)
+
+            self._holders.pop(self._writer, None)
+            self._writer = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def reading(self, name='default', debug=False):
+        """ Context manager that holds a read lock """
+        self.acquire_read(name=name, debug=debug)
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self, name='default', debug=False):
+        """ Context manager that holds a write lock """
+        self.acquire_write(name=name, debug=debug)
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    def wait_for_lock(self, name='default', debug=False):
+        """ Acquire an exclusive lock, kept for compatibility, use acquire_write() or writing() """
+        self.acquire_write(name=name, debug=debug)
+
+    def release_lock(self):
+        """ Release exclusive lock, kept for compatibility, use release_write() or writing() """
+        self.release_write()
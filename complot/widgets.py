@@ -3,6 +3,7 @@
 import curses
 import logging
 import re
+from contextlib import nullcontext
 
 from complot import errors_list
 from complot.utils import timeit
@@ -10,9 +11,17 @@ from complot.utils import timeit
 logger = logging.getLogger('complot')
 
 
+def reading_input(backend):
+    """ Pause input thread while widget reads keys, widgets without a backend don't know about the input thread """
+    return backend.reading_input() if backend else nullcontext()
+
+
 class ScrollableWindow():
     """ It's a simple scrollable pager window like the UNIX command less """
-    def __init__(self, root_win):
+    def __init__(self, root_win, backend=None):
+        # drawing backend that is told to redraw everything when window closes
+        self._backend = backend
+
         term_height, term_width = root_win.getmaxyx()
 
         self._win_width = term_width - 8
@@ -24,7 +33,19 @@ class ScrollableWindow():
         self._win = curses.newwin(self._win_height, self._win_width, y_pos, x_pos)
         self._win.keypad(True)
 
+    def close(self):
+        """ Window was drawn over plot, backend doesn't know what's on screen anymore """
+        if self._backend:
+            self._backend.invalidate()
+
     def run(self, lines):
+        try:
+            with reading_input(self._backend):
+                self.show(lines)
+        finally:
+            self.close()
+
+    def show(self, lines):
         end_pos = len(lines) -1
 
         if len(lines) >= (self._win_height -1):
@@ -67,10 +88,13 @@ class ScrollableWindow():
 
 class MenuWidget():
     """ Does all the ncurses menu magick.
-        Implements a menu with an input prompt, used filter the menu options. """
-    def __init__(self, stdscr, name='menu', orientation='bottom', height=30):
+        Implements a menu with an input prompt, used filter the menu options.
+        When $backend is set, it is invalidated when the menu closes because the menu was drawn over the plot """
+
+    def __init__(self, stdscr, name='menu', orientation='bottom', height=30, backend=None):
         self.name = name
         self.stdscr = stdscr
+        self._backend = backend
 
         # display menu at top or bottom
         self._orientation = orientation
@@ -108,6 +132,11 @@ class MenuWidget():
     def __str__(self):
         return f"> {self.name}"
 
+    def close(self):
+        """ Menu was drawn over plot, backend doesn't know what's on screen anymore """
+        if self._backend:
+            self._backend.invalidate()
+
     def reset_state(self):
         """ Reset positions and input field for this menu object """
         self.menu_pos = 0
@@ -228,6 +257,13 @@ class MenuWidget():
 
     def input_mode(self, msg=''):
         """ Don't display menu only read input and return """
+        try:
+            with reading_input(self._backend):
+                return self.run_input_mode(msg)
+        finally:
+            self.close()
+
+    def run_input_mode(self, msg):
         self.set_dimensions()
 
         # create window for menu
@@ -274,6 +310,13 @@ class MenuWidget():
         return [line for line in items if string.lower() in str(line).lower()]
 
     def run(self, items):
+        try:
+            with reading_input(self._backend):
+                return self.run_menu(items)
+        finally:
+            self.close()
+
+    def run_menu(self, items):
         logger.debug("start run")
         # re init terminal dimensions and menu width
         self.set_dimensions()
@@ -187,6 +187,7 @@ class Callbacks():
         self.last_pol_index = None
         self.last_df = None
         self.l3.name = self._ticker
+        self.open_ticker_store()
         self.draw()
 
     def bin_window_callback(self, item, args):
@@ -202,6 +203,7 @@ class Callbacks():
         self.last_pol_index = None
         self.last_df = None
         self.l1.name = self._ticker
+        self.open_ticker_store()
         self.draw()
 
     def period_callback(self, item, args):
@@ -214,6 +216,7 @@ class Callbacks():
         self.last_pol_index = None
         self.last_df = None
         self.l1.name = self._ticker
+        self.open_ticker_store()
 
         self.draw()
 
@@ -271,6 +274,9 @@ class CryptoStreamer(PlotApp, Callbacks):
         self.last_pol_index = None
         self.last_df = None
 
+        # load stored candles, only newer candles are fetched
+        self.open_ticker_store()
+
         # setup extra menu options
         ticker_menu = OptionsMenuItem(stdscr, 'Tickers', buttons=[ord('t')], button_name='t')
         for ticker in self.dp_eth.get_symbols():
@@ -313,11 +319,28 @@ class CryptoStreamer(PlotApp, Callbacks):
         self.dp_eth.period   = period
         self.dp_eth.interval = interval
 
+    def open_ticker_store(self):
+        """ Every ticker and interval has its own store, continue polling from the last stored candle """
+        if not self._store_dir:
+            return
+
+        self.open_store(os.path.join(self._store_dir, f"{self._ticker}_{self._interval}"))
+        last_key = self.get_stored_last_key(self.l3)
+        if last_key != None:
+            self.last_pol_index = datetime.datetime.fromtimestamp(last_key, datetime.timezone.utc)
+
     def parse_args(self):
         parser = argparse.ArgumentParser(description='Cryptostreamer unit stuff.')
         parser.add_argument('ticker', help="ticker")
+        parser.add_argument('--record', help="record feed to file, replay it with: python -m complot.bench.replay FILE")
+        parser.add_argument('--store',  help="keep history in directory so it doesn't have to be fetched again on restart")
         args = parser.parse_args()
 
+        self._store_dir = args.store
+
+        if args.record:
+            self.start_recording(args.record)
+
         if args.ticker:
             self._ticker = args.ticker
             self.connect(self._ticker, self._interval, self._period)
@@ -7,13 +7,11 @@ import logging
 import argparse
 import os,sys
 
-import numpy as np
-import pandas as pd
-
 from complot.plot import PlotApp
 from complot.lines import Line, CandleStickLine, HistogramLine, PeaksDetect, CurrentValueLine, HorizontalLine, Arrows
 from complot.menu import Menu, OptionsMenuItem, MenuItem, EditableMenuItem
 from complot.utils import timeit
+from complot.loaders import CSVLoader
 
 logger = logging.getLogger('complot')
 
@@ -40,8 +38,15 @@ class App(PlotApp):
     def parse_args(self):
         parser = argparse.ArgumentParser(description='Pennytrader 3000 plotter')
         parser.add_argument('path', help="path")
+        parser.add_argument('--store', help="keep parsed data in directory, on restart only new rows are added")
+        parser.add_argument('--chunk-size', type=int, default=10_000, help="amount of rows that are parsed and added in one go")
         args = parser.parse_args()
 
+        if args.store:
+            self.open_store(args.store)
+
+        self._chunk_size = args.chunk_size
+
         if args.path:
             self.path = os.path.abspath(args.path)
         else:
@@ -52,71 +57,82 @@ class App(PlotApp):
             logger.error(f"Not a csv file: {path}")
             return
 
-        df = self.get_data(path)
-
-        if df is None:
-            return
-
-        self.update_plot(os.path.basename(path), df)
-
-    def get_data(self, path):
         if not os.path.isfile(path):
             raise Exception(f"File doesn't exist: {path}")
 
-        try:
-            return pd.read_csv(path, index_col='Datetime', parse_dates=True)
-        except pd.errors.EmptyDataError as e:
-            logger.error(f"Something went wrong while reading csv file: {path}")
-            logger.error(e)
+        name = os.path.basename(path)
+        lines = self.create_lines(name)
+        if not lines:
+            return
+
+        # file is read in chunks by a source so data is shown after the first chunk is added,
+        # every next run only reads the rows that were appended to the file
+        loader = CSVLoader(path, chunk_size=self._chunk_size)
+        self.add_source(lambda: self.load(loader, name), self._update_interval, lines, name=name)
+
+    def load(self, loader, name):
+        """ Feed file to our plot chunk by chunk """
+        for chunk in loader.read_chunks():
+            self.update_plot(name, chunk)
+        logger.debug(f"Loaded {name}: {loader.get_stats()}")
+
+    def get_new_rows(self, line, rows):
+        """ Return rows that are newer than the points that were loaded from store at startup,
+            rows of later chunks or files that are older than rows that were added before are kept """
+        last_key = self.get_stored_last_key(line)
+        if last_key == None:
+            return rows
+        return [row for row in rows if (row[0].timestamp() if isinstance(row[0], datetime.datetime) else row[0]) > last_key]
+
+    def create_lines(self, name):
+        """ Create lines for file, return them as list """
+        if name == "candlesticks.csv":
+            line = self.lines['candlesticks'] = CandleStickLine(name='candlesticks', symbol='$')
+            self.add_line(line, orientation='left')
 
-    @timeit
-    def plot_candlesticks(self, name, df):
-        line = CandleStickLine(name=name, symbol='$')
-        self.add_line(line, orientation='left')
+            # create current value line
+            cv = CurrentValueLine(line, name='Current value', color='magenta', hidden=True)
+            self.add_line(cv, orientation='left')
+            return [line]
 
-        # create current value line
-        cv = CurrentValueLine(line, name='Current value', color='magenta', hidden=True)
-        self.add_line(cv, orientation='left')
+        elif name == "orders.csv":
+            line_buy = self.lines['buy'] = Arrows(name='Buy', symbol='$', color='green')
+            self.add_line(line_buy, orientation='left')
 
-        df.apply(lambda row : line.add_point(row.name, row['Open'], row['High'], row['Low'], row['Close']), axis = 1) 
+            line_sell = self.lines['sell'] = Arrows(name='Sell', symbol='$', color='red')
+            self.add_line(line_sell, orientation='left')
+            return [line_buy, line_sell]
 
-    def plot_orders(self, name, df):
-        line_buy = Arrows(name='Buy', symbol='$', color='green')
-        self.add_line(line_buy, orientation='left')
+        elif name == "wallet.csv":
+            line = self.lines['wallet'] = Line(name='Wallet', symbol='$', interpolate=True, color='magenta')
+            self.add_line(line, orientation='right')
+            return [line]
 
-        line_sell = Arrows(name='Sell', symbol='$', color='red')
-        self.add_line(line_sell, orientation='left')
+    @timeit
+    def plot_candlesticks(self, chunk):
+        line = self.lines['candlesticks']
+        line.add_points(self.get_new_rows(line, chunk.get_rows(['Open', 'High', 'Low', 'Close'])))
 
-        for index, row in df.iterrows():
-            if 'Buy' in df.columns:
-                if not pd.isna(row['Buy']) and not pd.isna(row['Id']):
-                    line_buy.add_point(index, row['Buy'], name=f"#{int(row['Id'])}")
-            if 'Sell' in df.columns:
-                if not pd.isna(row['Sell']) and not pd.isna(row['Id']):
-                    line_sell.add_point(index, row['Sell'], name=f"#{int(row['Id'])}")
-        #df['Buy'].dropna().apply(lambda row : line_sell.add_point(row.name, row['Buy'], name=f"#{int(row['Id'])}")) 
-        #df['Sell'].dropna().apply(lambda row : line_sell.add_point(row.name, row['Sell'], name=f"#{int(row['Id'])}")) 
+    def plot_orders(self, chunk):
+        for line, column in ((self.lines['buy'], 'Buy'), (self.lines['sell'], 'Sell')):
+            rows = self.get_new_rows(line, chunk.get_rows([column, 'Id']))
+            line.add_points([(k, y, f"#{int(order_id)}") for k, y, order_id in rows])
 
     @timeit
-    def plot_wallet(self, name, df):
-        line = Line(name='Wallet', symbol='$', interpolate=True, color='magenta')
-        self.add_line(line, orientation='right')
-        df.apply(lambda row : line.add_point(row.name, row['Wallet']), axis = 1) 
-
-    def update_plot(self, name, df):
-        """ Feed df to our plot """
-        logger.debug(f"Plotting: {name}")
+    def plot_wallet(self, chunk):
+        line = self.lines['wallet']
+        line.add_points(self.get_new_rows(line, chunk.get_rows(['Wallet'])))
+
+    def update_plot(self, name, chunk):
+        """ Feed chunk to our plot """
         if name == "candlesticks.csv":
-            self.plot_candlesticks('candlesticks', df)
+            self.plot_candlesticks(chunk)
 
         elif name == "orders.csv":
-            self.plot_orders('orders', df)
+            self.plot_orders(chunk)
 
         elif name == "wallet.csv":
-            self.plot_wallet('wallet', df)
-
-        #else:
-        #    self.plot_candlesticks(name, df)
+            self.plot_wallet(chunk)
 
     def run(self):
         if self.path == None:
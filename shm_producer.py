@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import time
+import math
+import random
+import argparse
+
+from complot.shm import SharedMemoryRing
+
+# Writes a noisy sine to a shared memory ring buffer.
+# Start any amount of viewers in other terminals with: ./shm_viewer.py
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Write points to shared memory for complot viewers')
+    parser.add_argument('-n', '--name',     help='shared memory name', default='complot')
+    parser.add_argument('-i', '--interval', help='seconds between points', type=float, default=0.01)
+    parser.add_argument('-c', '--capacity', help='amount of points in ring buffer', type=int, default=100_000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ring = SharedMemoryRing.create(args.name, ['x', 'y', 'mean'], capacity=args.capacity)
+    print(f"Writing to shared memory: {ring.name}, press ctrl-c to stop")
+
+    mean = 0
+    counter = 0
+    try:
+        while True:
+            y = math.sin(counter / 100) + random.gauss(0, 0.1)
+            mean = 0.95 * mean + 0.05 * y
+            ring.write((time.time(), y, mean))
+            counter += 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        ring.unlink()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import curses
+import datetime
+import argparse
+
+from complot.plot import PlotApp
+from complot.lines import Line
+from complot.shm import SharedMemorySource
+
+# Attaches read-only to the ring buffer written by ./shm_producer.py, only new points are read on every update.
+# Any amount of viewers can attach to the same ring buffer.
+
+
+class App(PlotApp):
+    def __init__(self, stdscr, args):
+        PlotApp.__init__( self,
+                          stdscr,
+                          bin_window=datetime.timedelta(seconds=1),
+                          left_decimals=3,
+                          x_axis_type='datetime',
+                          update_interval=60 )
+
+        self.l1 = Line(name='sine')
+        self.l2 = Line(name='mean')
+        self.add_line(self.l1, orientation='left')
+        self.add_line(self.l2, orientation='left')
+
+        self._source = SharedMemorySource(args.name)
+        self.add_source(self.read, args.interval, [self.l1, self.l2], name=args.name)
+
+        self.start()
+        self._source.close()
+
+    def read(self):
+        """ Split x, y, mean rows into rows for both lines """
+        rows = self._source()
+        return [[(x, y) for x,y,_ in rows], [(x, mean) for x,_,mean in rows]]
+
+    def update(self):
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='View points from shared memory')
+    parser.add_argument('-n', '--name',     help='shared memory name', default='complot')
+    parser.add_argument('-i', '--interval', help='seconds between reads', type=float, default=0.1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    curses.wrapper(App, args)